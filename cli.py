@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-#
+# !/usr/bin/python3
+"""  Command line interface for radioactive decay calculation.
+
+Runs the decay calculation without GUI, so it can be used on headless machines
+and driven by job schedulers. This module must not import PyQt5 or matplotlib.
+
+Starting inventories are given as arguments (-i Ra-225=10 -i Ac-225=10), or as
+a JSON input file, containing either one inventory ({"Ra-225": 10}) or a list
+of inventories, which are calculated in one batch. Results are written as CSV
+(time column, then one column per isotope; plus a leading scenario column for
+batches), as NPZ (times, masses, isotopes arrays), or as memory-mapped result
+file (.rdc, see modules/result_file.py).
+
+With --stream, the CSV file is written chunk by chunk while the calculation
+runs, so runs with any number of steps fit into memory. The output can be
+decimated (--decimate N keeps one row per N steps), and each output bin can be
+reduced (--reducer mean/min/max, repeatable) instead of keeping its first row.
+
+The adaptive solver chooses its own time points, keeping the interpolation
+error below --tolerance (relative to the total mass).
+
+Instead of the masses, a derived output can be written (--quantity activity,
+decays, power or energy), with a column per isotope (or decay mode) and a total
+column. It is calculated chunk by chunk during the run (also when streaming, or
+writing a result file), so the mass history is not kept.
+
+Libs
+----
+* numpy
+
+Help
+----
+* python cli.py --help
+
+Info
+----
+Wetzl Viktor - 2023.03.25 - All rights reserved
+"""
+import argparse
+import logging
+import os
+import sys
+
+import numpy as np
+
+from logger import MAIN_LOGGER as l, console_handler
+import modules.json_handler as jdbh
+from modules.decay_engine import (DecayEngine, SOLVERS, REDUCERS, OUTPUTS,
+                                  EQUILIBRIUM_THRESHOLD, ADAPTIVE_TOLERANCE)
+from modules.chain_cache import ChainCache, load_chain
+from modules.result_file import (ResultFile, RESULT_EXTENSION,
+                                 write_result_file)
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "database", "isotope_database.json")
+
+
+def parse_inventory(items):
+    """Converts 'ISOTOPE=MASS' arguments to an inventory.
+
+    :param list items: Arguments, e.g. ["Ra-225=10", "Ac-225=10"].
+    :return: Starting mass of isotopes.
+    :rtype: dict
+
+    """
+    inventory = {}
+    for item in items:
+        isotope, _, mass = item.partition("=")
+        try:
+            inventory[isotope.strip()] = float(mass)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                    f"Wrong inventory argument: {item}") from None
+    return inventory
+
+
+def load_inventories(path):
+    """Loads starting inventories from a JSON file.
+
+    :param str path: Filepath of a JSON object (one inventory) or a JSON list
+        of objects (batch of inventories).
+    :return: List of inventories.
+    :rtype: list
+
+    """
+    inventories = jdbh.JsonDbHandler(path).load()
+    if isinstance(inventories, dict):
+        inventories = [inventories]
+    return inventories
+
+
+def write_results(path, isotopes, times, masses, quantity="mass"):
+    """Writes the mass history (or a derived output) of every scenario to a
+    CSV or NPZ file.
+
+    :param str path: Output filepath, the format is chosen by its extension.
+    :param list isotopes: Column labels (short IDs), in column order.
+    :param times: Time of each step [s].
+    :type times: numpy.ndarray
+    :param masses: Mass history (scenario x time x isotope) [kg].
+    :type masses: numpy.ndarray
+    :param str quantity: Written quantity, stored in the metadata of result
+        files.
+
+    """
+    if path.endswith(".npz"):
+        np.savez(path, times=times, masses=masses, isotopes=np.array(isotopes))
+        return
+    if path.endswith(RESULT_EXTENSION):
+        result_file = ResultFile.create(
+                path, isotopes, times,
+                scenarios=len(masses) if len(masses) > 1 else None,
+                metadata={"quantity": quantity})
+        result_file.masses[:] = masses if len(masses) > 1 else masses[0]
+        result_file.flush()
+        return
+
+    n_scenarios, n_times, _ = masses.shape
+    columns = [np.tile(times, n_scenarios)[:, np.newaxis],
+               masses.reshape(n_scenarios * n_times, -1)]
+    header = ["time"] + list(isotopes)
+    if n_scenarios > 1:
+        columns.insert(0, np.repeat(np.arange(n_scenarios),
+                                    n_times)[:, np.newaxis])
+        header.insert(0, "scenario")
+    np.savetxt(path, np.hstack(columns), delimiter=",", fmt="%.10g",
+               header=",".join(header), comments="")
+
+
+def stream_results(path, engine, inventories, time_interval, step, solver,
+                   decimation=1, reducers=("first",), quantity="mass"):
+    """Streams the mass history (or a derived output) of every scenario to a
+    CSV file, chunk by chunk.
+
+    :param str path: Output filepath (CSV).
+    :param engine: Decay engine of the chain.
+    :type engine: DecayEngine
+    :param list inventories: Starting inventories (scenarios).
+    :param float time_interval: Length of a time step [s].
+    :param int step: Number of time steps.
+    :param str solver: Solver, see *DecayEngine.stream*.
+    :param int decimation: Number of steps per output row.
+    :param tuple reducers: Reducers of the output bins.
+    :param str quantity: "mass" or a derived output (key of *OUTPUTS*).
+
+    """
+    header = ["time"]
+    for isotope in engine.chain.columns(quantity):
+        header.extend(isotope if len(reducers) == 1 else f"{isotope}:{reducer}"
+                      for reducer in reducers)
+    if len(inventories) > 1:
+        header.insert(0, "scenario")
+
+    with open(path, "w", encoding="utf8") as write_file:
+        write_file.write(",".join(header) + "\n")
+        for scenario, inventory in enumerate(inventories):
+            for times, reduced in engine.stream(inventory, time_interval,
+                                                step, solver=solver,
+                                                decimation=decimation,
+                                                reducers=reducers,
+                                                quantity=quantity):
+                # Reducers of an isotope are adjacent columns
+                columns = [times[:, np.newaxis], np.stack(
+                        [reduced[reducer] for reducer in reducers],
+                        axis=2).reshape(len(times), -1)]
+                if len(inventories) > 1:
+                    columns.insert(0, np.full((len(times), 1), scenario))
+                np.savetxt(write_file, np.hstack(columns), delimiter=",",
+                           fmt="%.10g")
+
+
+def write_output(args, engine, inventories):
+    """Runs the calculation, and writes the output selected by the arguments.
+
+    :param args: Parsed command line arguments.
+    :type args: argparse.Namespace
+    :param engine: Decay engine of the chain.
+    :type engine: DecayEngine
+    :param list inventories: Starting mass of isotopes [kg] per scenario.
+
+    """
+    chain = engine.chain
+    if args.stream and args.output.endswith(RESULT_EXTENSION):
+        write_result_file(args.output, engine, inventories, args.interval,
+                          args.steps, args.solver, args.decimate,
+                          (args.reducer or ["first"])[0], args.quantity)
+    elif args.stream:
+        stream_results(args.output, engine, inventories, args.interval,
+                       args.steps, args.solver, args.decimate,
+                       tuple(args.reducer or ("first",)), args.quantity)
+    else:
+        initial = np.array([chain.initial_vector(inventory)
+                            for inventory in inventories])
+        times, values = engine.run_batch(initial, args.interval, args.steps,
+                                         solver=args.solver,
+                                         tolerance=args.tolerance,
+                                         quantity=args.quantity)
+        write_results(args.output, chain.columns(args.quantity), times,
+                      values, args.quantity)
+
+
+def main(argv=None):
+    """Command line entry point.
+
+    :param list argv: Arguments (default: sys.argv).
+    :return: Exit code.
+    :rtype: int
+
+    """
+    parser = argparse.ArgumentParser(
+            description="Radioactive decay calculator (headless)."
+    )
+    parser.add_argument("-i", "--isotope", action="append", default=[],
+                        metavar="ISOTOPE=MASS",
+                        help="Starting isotope and its mass [kg], repeatable.")
+    parser.add_argument("--input", help="JSON file with inventories.")
+    parser.add_argument("-o", "--output", required=True,
+                        help=f"Output file (.csv, .npz or {RESULT_EXTENSION}).")
+    parser.add_argument("--interval", type=float, default=500,
+                        help="Time interval [s] (default: 500).")
+    parser.add_argument("--steps", type=int, default=15000,
+                        help="Number of steps (default: 15000).")
+    parser.add_argument("--solver", choices=SOLVERS, default="step",
+                        help="Solver (default: step).")
+    parser.add_argument("--tolerance", type=float, metavar="TOL",
+                        help="Adaptive solver: interpolation error relative "
+                             "to the total mass (default: "
+                             f"{ADAPTIVE_TOLERANCE:g}).")
+    parser.add_argument("--equilibrium", type=float, nargs="?",
+                        const=EQUILIBRIUM_THRESHOLD, metavar="RATIO",
+                        help="Short-circuit products in equilibrium, whose "
+                             "decay constant is RATIO times larger than their "
+                             f"parents' (default: {EQUILIBRIUM_THRESHOLD:g}).")
+    parser.add_argument("--stream", action="store_true",
+                        help="Write the CSV (or result file) output while "
+                             "calculating, with constant memory usage.")
+    parser.add_argument("--decimate", type=int, default=1, metavar="N",
+                        help="Streamed output: one row per N steps.")
+    parser.add_argument("--reducer", action="append", choices=REDUCERS,
+                        help="Streamed output: reduction of the N steps of a "
+                             "row, repeatable (default: first).")
+    parser.add_argument("--quantity", choices=("mass",) + tuple(OUTPUTS),
+                        default="mass",
+                        help="Written quantity (default: mass).")
+    parser.add_argument("--database", default=DEFAULT_DATABASE,
+                        help="Isotope database (JSON or SQLite).")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not use the compiled chain cache.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log debug messages to the console.")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        console_handler.setLevel(logging.WARNING)
+
+    try:
+        inventories = parse_inventory(args.isotope)
+        inventories = ([inventories] if inventories else []) + (
+            load_inventories(args.input) if args.input else [])
+    except (argparse.ArgumentTypeError, OSError, ValueError) as error:
+        parser.error(str(error))
+    if not inventories:
+        parser.error("No starting isotopes given (use -i or --input)!")
+    if args.stream and (args.output.endswith(".npz")
+                        or args.solver == "adaptive"):
+        parser.error("Streaming needs CSV or result file output, and a fixed "
+                     "step solver!")
+    if args.output.endswith(RESULT_EXTENSION) and len(args.reducer or []) > 1:
+        parser.error("Result files store one reducer only!")
+    if args.decimate < 1:
+        parser.error("Decimation must be at least 1!")
+    if not args.stream and (args.decimate != 1 or args.reducer):
+        parser.error("--decimate and --reducer need --stream!")
+    if args.tolerance is None:
+        args.tolerance = ADAPTIVE_TOLERANCE
+    elif args.solver != "adaptive":
+        parser.error("--tolerance needs the adaptive solver!")
+    elif not args.tolerance > 0:
+        parser.error("Tolerance must be positive!")
+
+    handler = jdbh.open_database(args.database)
+    isotope_database = jdbh.LazyDatabase(handler)
+    cache = None if args.no_cache else ChainCache.for_database(handler)
+    starting_isotopes = sorted({iid for inventory in inventories
+                                for iid in inventory})
+    try:
+        chain = load_chain(isotope_database, starting_isotopes, cache)
+    except KeyError as error:
+        l.error(error.args[0])
+        return 1
+
+    l.info("Starting decay calculation (%s, %s scenarios)...", args.solver,
+           len(inventories))
+    engine = DecayEngine(chain, args.equilibrium)
+    try:
+        write_output(args, engine, inventories)
+    except (OSError, ValueError) as error:
+        l.error("Results can not be written: %s", error)
+        return 1
+    l.info("Results written to %s", args.output)
+    return 0
+
+
+# Include guard
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Background worker for the decay calculations, so the main window stays
+responsive during long runs.
+
+The worker runs a calculation function in the global thread pool, and reports
+its progress, result or error through Qt signals (delivered in the main
+thread). The calculation gets a progress callback, which also checks the cancel
+flag of the worker: a cancelled calculation is aborted at its next progress
+report, and only the *cancelled* signal is emitted. A live worker also gets a
+*partial* callback, and emits the chunks of the result while it is calculated.
+
+Help
+----
+* https://doc.qt.io/qt-5/qthreadpool.html
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import threading
+
+# Third party imports
+# pylint: disable = no-name-in-module
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+
+
+class CalculationCancelled(Exception):
+    """ Exception for aborting a cancelled calculation. """
+
+
+class WorkerSignals(QObject):
+    """Signals of the calculation worker."""
+    progress = pyqtSignal(float)  # Completed fraction (0 to 1)
+    finished = pyqtSignal(object)  # Return value of the calculation
+    partial = pyqtSignal(object, object)  # Times and masses of a chunk
+    failed = pyqtSignal(str)  # Error message
+    cancelled = pyqtSignal()
+
+
+class CalculationWorker(QRunnable):
+    """Runs a calculation in the thread pool.
+
+    :param function: Calculation, called with the positional and keyword
+        arguments, and a *progress* keyword argument (callback).
+    :type function: callable
+    :param bool live: The function also gets a *partial* keyword argument
+        (callback with the times and masses of a calculated chunk).
+
+    """
+    def __init__(self, function, *args, live=False, **kwargs):
+        super().__init__()
+        self.signals = WorkerSignals()
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+        if live:
+            self._kwargs["partial"] = self._partial
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Requests the calculation to stop at its next progress report."""
+        self._cancelled.set()
+
+    @property
+    def is_cancelled(self):
+        """True, if cancel was requested."""
+        return self._cancelled.is_set()
+
+    def _progress(self, fraction):
+        """Progress callback of the calculation."""
+        if self._cancelled.is_set():
+            raise CalculationCancelled()
+        self.signals.progress.emit(fraction)
+
+    def _partial(self, times, masses):
+        """Partial result callback of the calculation."""
+        if self._cancelled.is_set():
+            raise CalculationCancelled()
+        self.signals.partial.emit(times, masses)
+
+    def run(self):
+        """Runs the calculation, and emits the result (in the worker
+        thread)."""
+        try:
+            result = self._function(*self._args, progress=self._progress,
+                                    **self._kwargs)
+        except CalculationCancelled:
+            l.info("Calculation cancelled")
+            self.signals.cancelled.emit()
+        except Exception as error:  # pylint: disable = broad-except
+            l.exception("Calculation failed")
+            self.signals.failed.emit(str(error))
+        else:
+            if self._cancelled.is_set():
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+    def start(self):
+        """Starts the worker in the global thread pool."""
+        QThreadPool.globalInstance().start(self)
+
+
+if __name__ == '__main__':
+    pass
@@ -34,6 +34,10 @@ from logger import MAIN_LOGGER as l
 from modules.entry_objects import IsotopeEntry
 from modules.utils import InputValidatorBaseClass, InputError
 
+# Number of decay mode fields of the isotope dialog, entries with more decay
+# modes (e.g. imported ones) can not be edited in the dialog
+MAX_DECAY_MODES = 3
+
 
 # pylint: disable = missing-function-docstring
 class ChooseIsotopeWindow(QDialog):
@@ -179,7 +183,7 @@ class CreateIsotopeWindow(QDialog):
         layout2.addLayout(form_layout2)
 
         # Generate field for decays
-        for i in range(0, 3):
+        for i in range(0, MAX_DECAY_MODES):
             layout2.addWidget(
                     QLabel(f"Decay mode {i+1}"), alignment=Qt.AlignCenter
             )
@@ -258,9 +262,12 @@ class CreateIsotopeWindow(QDialog):
             self.stable.setChecked(False)
             self.half_life.setText(str(defaults["half_life"]))
 
-            step = 0
-            for isotope, decay in defaults["decays"].items():
-                decay_field = self.decay_field_list[step]
+            decays = defaults["decays"] or {}
+            if len(decays) > len(self.decay_field_list):
+                raise ValueError(f"Isotope {short_id} has more than "
+                                 f"{MAX_DECAY_MODES} decay modes!")
+            for decay_field, (isotope, decay) in zip(self.decay_field_list,
+                                                     decays.items()):
                 decay_field.itemAt(1).widget().setCurrentText(isotope)
                 decay_field.itemAt(3).widget().setText(decay.get("product", ""))
                 decay_field.itemAt(5).widget().setText(
@@ -269,7 +276,6 @@ class CreateIsotopeWindow(QDialog):
                 decay_field.itemAt(7).widget().setText(
                         str(decay.get("released_energy", ""))
                 )
-                step += 1
 
     def accept_input(self):
         """ Collects the given inputs, and accepts them if all valid. """
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Options of the raw data export: decimation (every n-th row is written) and
+compression of the chosen format (gzip for CSV, zip for NPZ, zstd for Parquet,
+result files are not compressed).
+
+Libs
+----
+* PyQt5
+
+Help
+----
+* https://blog.logrocket.com/how-to-build-gui-pyqt/
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+
+# Third party imports
+# pylint: disable = no-name-in-module
+from PyQt5.QtWidgets import (QDialog, QFormLayout, QCheckBox, QLineEdit,
+                             QVBoxLayout, QHBoxLayout, QPushButton, QLabel)
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.result_file import RESULT_EXTENSION
+from modules.utils import InputValidatorBaseClass, InputError
+
+
+# pylint: disable = missing-function-docstring
+class ExportOptionsWindow(QDialog):
+    """Export options window for PyQt5. The results are the keyword arguments
+    of *export_result* (decimation, compress), or None if cancelled.
+
+    :param str path: Filepath of the export.
+    :param int rows: Number of rows of the exported result.
+
+    """
+    def __init__(self, path, rows):
+        super().__init__(parent=None)
+        self.setWindowTitle("Export options")
+        self.path = path
+        self.rows = rows
+        self.results = None
+
+        # Initialize window
+        self.layout = QVBoxLayout()
+        self._create_fields()
+        self._create_buttons()
+        self.setLayout(self.layout)
+
+    def _create_fields(self):
+        """  """
+        form_layout = QFormLayout()
+        decimation_label = QLabel("Keep every n-th row")
+        decimation_label.setFixedWidth(135)
+        self.decimation = QLineEdit("1")
+        self.decimation.setPlaceholderText(f"of {self.rows} rows")
+        self.decimation.setFixedWidth(100)
+        form_layout.addRow(decimation_label, self.decimation)
+
+        # Result files are not compressed, ".gz" is always compressed
+        self.compress = QCheckBox()
+        self.compress.setChecked(self.path.endswith(".gz"))
+        self.compress.setEnabled(not self.path.endswith(
+                (".gz", RESULT_EXTENSION)))
+        form_layout.addRow(QLabel("Compress"), self.compress)
+        self.layout.addLayout(form_layout)
+
+        # Feedback widget
+        self.status_text = QLabel('')
+        self.status_text.setStyleSheet("color: red")
+        self.layout.addWidget(self.status_text)
+
+    def _create_buttons(self):
+        """  """
+        button_box = QHBoxLayout()
+        button_box.addStretch()
+        button_accept = QPushButton("OK")
+        button_accept.clicked.connect(self.accept_input)
+        button_close = QPushButton("Cancel")
+        button_close.clicked.connect(self.close_window)
+        button_box.addWidget(button_accept)
+        button_box.addWidget(button_close)
+        self.layout.addLayout(button_box)
+
+    def accept_input(self):
+        """ Collects the given inputs, and accepts them if all valid. """
+        IVC = InputValidatorBaseClass()
+        self.status_text.setText("")
+
+        try:
+            decimation = IVC.ival(self.decimation.text(), default=1)
+        except InputError as iee:
+            self.status_text.setText(str(iee))
+            return
+        if decimation < 1:
+            self.status_text.setText("Decimation must be at least 1!")
+            return
+
+        # Set results only when 'OK' is pressed!
+        self.results = {"decimation": decimation,
+                        "compress": self.compress.isChecked()}
+        l.debug("Export options: %s", self.results)
+        self.close_window()
+
+    def close_window(self):
+        self.close()
+
+
+# Include guard
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Live plot of a running calculation.
+
+Only a thinned copy of the chunks is kept (the complete mass history is
+collected by the calculation itself): every n-th row, with about
+*ROWS_PER_PIXEL* rows per pixel column of the plot. When the copy is full,
+every second row is dropped, and n is doubled, so the copy has a fixed size for
+any number of steps. The curves are redrawn at a capped frame rate. The curves
+are created once (as animated artists), then only their data is replaced with
+*set_data*, and they are drawn onto the saved background of the canvas
+(blitting), so a frame costs the same at the first and at the last chunk. The
+axis limits are fixed for the whole run (end time and total mass), so the
+background stays valid.
+
+Libs
+----
+* matplotlib
+* numpy
+
+Help
+----
+* https://matplotlib.org/stable/tutorials/advanced/blitting.html
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import time
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.decay_result import DecayResult, TIME_UNITS
+
+# Maximum number of redraws per second
+LIVE_FPS = 10
+# Number of kept rows per pixel column of the plot
+ROWS_PER_PIXEL = 4
+
+
+class LivePlot:
+    """Live plot of the mass history of a running calculation.
+
+    :param canvas: Canvas of the plot (with an *axes* attribute).
+    :type canvas: MplCanvas
+    :param list isotopes: Short IDs, in column order.
+    :param float end_time: Final time of the calculation [s].
+    :param float max_mass: Upper limit of the mass axis [kg].
+    :param str time_unit: Unit of the time axis.
+
+    """
+    def __init__(self, canvas, isotopes, end_time, max_mass, time_unit="s"):
+        self.canvas = canvas
+        axes = canvas.axes
+        # Thinned rows (every *stride*-th), and the last received row
+        self.max_points = ROWS_PER_PIXEL * max(1, int(axes.bbox.width))
+        self.result = DecayResult.empty(isotopes, self.max_points)
+        self.stride = 1
+        self.rows = 0  # Number of received rows
+        self._last = None
+        self.time_unit = time_unit
+        self._background = None
+        self._last_frame = 0.0
+
+        axes.cla()
+        self.lines = [axes.plot([], [], label=f"{isotope}", animated=True)[0]
+                      for isotope in isotopes]
+        axes.set_title("Radioactive decay")
+        axes.set_xlabel(f"Time [{time_unit}]")
+        axes.set_ylabel("Mass [kg]")
+        axes.set_xlim(0, end_time / TIME_UNITS[time_unit])
+        axes.set_ylim(0, max_mass)
+        axes.grid()
+        axes.legend()
+        self._draw_id = canvas.mpl_connect("draw_event", self._on_draw)
+        canvas.draw()
+        l.debug("Live plot started (%s kept rows)", self.max_points)
+
+    def _on_draw(self, _event):
+        """Saves the background after a full redraw (e.g. resize), and draws
+        the curves onto it."""
+        self._background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        for line in self.lines:
+            self.canvas.axes.draw_artist(line)
+
+    def add(self, times, masses):
+        """Keeps the every *stride*-th row of a chunk, and redraws the curves
+        if the last frame is old enough.
+
+        :param times: Time of each row of the chunk [s].
+        :type times: numpy.ndarray
+        :param masses: Rows of the chunk (time x isotope) [kg].
+        :type masses: numpy.ndarray
+
+        """
+        while True:
+            # Kept rows are the multiples of the stride
+            rows = slice((-self.rows) % self.stride, None, self.stride)
+            kept = len(times[rows])
+            if len(self.result) + kept <= self.max_points:
+                break
+            thinned = DecayResult.empty(self.result.isotopes, self.max_points)
+            thinned.append(self.result.times[::2], self.result.masses[::2])
+            self.result = thinned
+            self.stride *= 2
+        self.result.append(times[rows], masses[rows])
+        self.rows += len(times)
+        self._last = (times[-1:], masses[-1:])
+        if time.perf_counter() - self._last_frame >= 1 / LIVE_FPS:
+            self.redraw()
+
+    def redraw(self):
+        """Updates the data of the curves, and draws them onto the saved
+        background."""
+        result = self.result
+        if self._last is not None and (self.rows - 1) % self.stride:
+            # Curves reach the last received row
+            result = DecayResult(result.isotopes,
+                                 np.concatenate((result.times,
+                                                 self._last[0])),
+                                 np.concatenate((result.masses,
+                                                 self._last[1])))
+        times = result.times_in(self.time_unit)
+        for isotope, line in zip(result.isotopes, self.lines):
+            line.set_data(times, result.column(isotope))
+
+        if self._background is not None:
+            self.canvas.restore_region(self._background)
+            for line in self.lines:
+                self.canvas.axes.draw_artist(line)
+            self.canvas.blit(self.canvas.figure.bbox)
+            self.canvas.flush_events()
+        self._last_frame = time.perf_counter()
+
+    def close(self):
+        """Stops blitting, and draws the collected curves as normal
+        (not animated) ones."""
+        self.canvas.mpl_disconnect(self._draw_id)
+        self.redraw()
+        for line in self.lines:
+            line.set_animated(False)
+        self.canvas.draw_idle()
+
+
+if __name__ == '__main__':
+    pass
@@ -27,11 +27,12 @@ from copy import deepcopy
 # pylint: disable = no-name-in-module
 from PyQt5.QtWidgets import (QWidget, QCompleter, QFormLayout, QLineEdit,
                              QVBoxLayout, QHBoxLayout, QMenu, QPushButton,
-                             QComboBox, QListWidget, QLabel)
+                             QComboBox, QListWidget, QLabel, QCheckBox)
 from PyQt5.QtCore import QEvent
 
 # Local application imports
 from logger import MAIN_LOGGER as l
+from modules.decay_engine import SOLVERS, ADAPTIVE_TOLERANCE
 
 
 # Class and function definitions
@@ -68,6 +69,31 @@ class SimulationWidget(QWidget):
         self.step_number.setFixedWidth(70)
         form_layout.addRow(QLabel("Number of steps"), self.step_number)
 
+        # Solver
+        self.solver_cbox = QComboBox()
+        self.solver_cbox.addItems(SOLVERS)
+        self.solver_cbox.setFixedWidth(70)
+        form_layout.addRow(QLabel("Solver"), self.solver_cbox)
+
+        # Tolerance of the adaptive solver
+        self.tolerance = QLineEdit(f"{ADAPTIVE_TOLERANCE:g}")
+        self.tolerance.setFixedWidth(70)
+        self.tolerance.setToolTip(
+                "Interpolation error of the adaptive solver, relative to the "
+                "total mass.")
+        self.tolerance.setEnabled(False)
+        self.solver_cbox.currentTextChanged.connect(
+                lambda solver: self.tolerance.setEnabled(solver == "adaptive"))
+        form_layout.addRow(QLabel("Adaptive tolerance"), self.tolerance)
+
+        # Equilibrium short-circuit
+        self.equilibrium = QCheckBox()
+        self.equilibrium.setToolTip(
+                "Products, which are much shorter-lived than their parents, "
+                "are evaluated in equilibrium instead of integration.")
+        form_layout.addRow(QLabel("Equilibrium short-circuit"),
+                           self.equilibrium)
+
         # Isotope name Cbox
         self.isotope_name_cbox = QComboBox()
         self.isotope_name_cbox.addItems(sorted(self._idb.keys()))
@@ -141,7 +167,10 @@ class SimulationWidget(QWidget):
         """  """
         return (deepcopy(self.isotopes_list),
                 int(self.interval.text().strip()),
-                int(self.step_number.text().strip())
+                int(self.step_number.text().strip()),
+                self.solver_cbox.currentText(),
+                float(self.tolerance.text().strip()),
+                self.equilibrium.isChecked()
                 )
 
 
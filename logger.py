@@ -29,6 +29,7 @@ Contents
 
 
 import logging
+import multiprocessing
 import os
 import sys
 from logging.handlers import RotatingFileHandler
@@ -67,7 +68,8 @@ MAIN_LOGGER.addHandler(console_handler)
 file_handler = RotatingFileHandler(LOG_FILE, maxBytes=0, backupCount=5)
 file_handler.setLevel(logging.INFO)
 file_handler.setFormatter(FORMATTER)
-file_handler.doRollover()  # Rolls log at each start
+if multiprocessing.parent_process() is None:
+    file_handler.doRollover()  # Rolls log at each start (not in subprocesses)
 MAIN_LOGGER.addHandler(file_handler)
 MAIN_LOGGER.info("Main logger created!")
 
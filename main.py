@@ -23,14 +23,26 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 # pylint: disable = no-name-in-module, unused-import
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QAction, QDesktopWidget,
-                             QMessageBox, QDockWidget)
+                             QMessageBox, QDockWidget, QFileDialog,
+                             QActionGroup)
 # from PyQt5.QtGui import (QFont, QPainter, QBrush, QColor, QFontMetrics)
 from PyQt5.QtCore import Qt
 
 from logger import MAIN_LOGGER as l
 import modules.json_handler as jdbh
+from modules.decay_engine import DecayEngine, EQUILIBRIUM_THRESHOLD, OUTPUTS
+from modules.chain_cache import ChainCache, load_chain
+from modules.result_cache import ResultCache
+from modules.decay_result import DecayResult, TIME_UNITS
+from modules.result_file import ResultFile, RESULT_EXTENSION
+from modules.exporters import export_result
+from modules.nuclide_importer import import_nuclide_table
 from gui.simulation_widget import SimulationWidget
-from gui.create_isotope_window import CreateIsotopeWindow, ChooseIsotopeWindow
+from gui.calculation_worker import CalculationWorker
+from gui.live_plot import LivePlot
+from gui.create_isotope_window import (CreateIsotopeWindow,
+                                       ChooseIsotopeWindow, MAX_DECAY_MODES)
+from gui.export_window import ExportOptionsWindow
 
 
 # Class and function definitions
@@ -46,9 +58,28 @@ class MainWindow(QMainWindow):
     def __init__(self, idbh):
         super().__init__(parent=None)
 
-        # Load isotope db.
+        # Load isotope db. index (keys), records are loaded on demand
         self._idbh = idbh
-        self.isotope_database = self._idbh.load()
+        self.isotope_database = jdbh.LazyDatabase(self._idbh)
+        self.chain_cache = ChainCache.for_database(self._idbh)
+        self.result_cache = ResultCache()
+        # (engine, result) of the plotted calculation, engine is None for
+        # opened result files
+        self.last_run = None
+        # Quantity -> result of the last run, the stored one ("mass", or the
+        # quantity of a result file), and the derived ones calculated so far
+        self.outputs = {}
+        # Running calculation (None, if idle)
+        self.worker = None
+        # Live plot of the running calculation (None, if not plotted yet)
+        self.live_plot = None
+        # (result, time unit) of the plotted curves, downsampled again for the
+        # visible time range on zoom, pan and resize
+        self.plotted = None
+        # Time unit of the plot and of the exported data
+        self.time_unit = "d"
+        # Plotted and exported quantity, "mass" or a key of OUTPUTS
+        self.quantity = "mass"
 
         # Create GUI
         self.setWindowTitle(
@@ -80,11 +111,36 @@ class MainWindow(QMainWindow):
                 'Start', self, triggered=self.start_calculation,
                 shortcut="Ctrl+S"
         )
+        self.continue_action = QAction(
+                'Continue', self, triggered=self.continue_calculation,
+                shortcut="Ctrl+Shift+S"
+        )
+        self.cancel_action = QAction(
+                'Cancel', self, triggered=self.cancel_calculation,
+                shortcut="Esc"
+        )
+        self.open_result_action = QAction(
+                'Open result', self, triggered=self.open_result,
+                shortcut="Ctrl+O"
+        )
         self.close_action = QAction(
                 'Close', self, triggered=self.close_window, shortcut="Ctrl+X"
         )
         self.show_simulation_view_action = (
             self.simulation_view.toggleViewAction())
+        self.live_plot_action = QAction(
+                'Live plot', self, checkable=True, checked=True
+        )
+        self.time_unit_actions = QActionGroup(self)
+        for time_unit in TIME_UNITS:
+            QAction(time_unit, self.time_unit_actions, checkable=True,
+                    checked=time_unit == self.time_unit).triggered.connect(
+                    lambda _, unit=time_unit: self.set_time_unit(unit))
+        self.quantity_actions = QActionGroup(self)
+        for quantity, label in [("mass", "Mass [kg]")] + list(OUTPUTS.items()):
+            QAction(label, self.quantity_actions, checkable=True,
+                    checked=quantity == self.quantity).triggered.connect(
+                    lambda _, name=quantity: self.set_quantity(name))
         self.clear_plot_action = QAction(
                 'Clear plot', self, triggered=self._clear_plotview
         )
@@ -95,6 +151,13 @@ class MainWindow(QMainWindow):
                 'Edit isotope', self, triggered=self.edit_entry,
                 shortcut="Ctrl+E"
         )
+        self.import_table_action = QAction(
+                'Import nuclide table', self, triggered=self.import_table
+        )
+        self.export_data_action = QAction(
+                'Export raw data', self, triggered=self.export_data,
+                shortcut="Ctrl+Shift+E"
+        )
         self.settings_action = QAction(
                 'Settings', self, triggered=self.open_settings
         )
@@ -110,12 +173,23 @@ class MainWindow(QMainWindow):
         self.about_action = QAction('About', self, triggered=self.about)
 
         file_menu.addAction(self.start_action)
+        file_menu.addAction(self.continue_action)
+        file_menu.addAction(self.cancel_action)
+        file_menu.addAction(self.open_result_action)
         file_menu.addSeparator()
         file_menu.addAction(self.close_action)
         view_menu.addAction(self.show_simulation_view_action)
+        view_menu.addAction(self.live_plot_action)
+        time_unit_menu = view_menu.addMenu('Time unit')
+        time_unit_menu.addActions(self.time_unit_actions.actions())
+        quantity_menu = view_menu.addMenu('Quantity')
+        quantity_menu.addActions(self.quantity_actions.actions())
         view_menu.addAction(self.clear_plot_action)
         database_menu.addAction(self.add_entry_action)
         database_menu.addAction(self.edit_entry_action)
+        database_menu.addSeparator()
+        database_menu.addAction(self.import_table_action)
+        export_menu.addAction(self.export_data_action)
         settings_menu.addAction(self.settings_action)
         help_menu.addAction(self.report_bug_action)
         help_menu.addAction(self.open_sharepoint_action)
@@ -139,9 +213,11 @@ class MainWindow(QMainWindow):
         self.graph.axes.set_xlim(0, None)
         self.graph.axes.set_ylim(0, None)
         self.graph.axes.grid()
+        self.graph.mpl_connect("resize_event", self._redraw_plot_data)
         self.setCentralWidget(self.graph)
 
     def _clear_plotview(self):
+        self.plotted = None
         self.graph.axes.cla()  # Clear existing curves
         self.graph.axes.set_title("Radioactive decay")
         self.graph.axes.set_xlabel("Time [s]")
@@ -160,7 +236,14 @@ class MainWindow(QMainWindow):
 
             if choose_isotope_w.results is not None:
                 iid = choose_isotope_w.results
-                self.add_entry(self.isotope_database[iid])
+                entry = self.isotope_database[iid]
+                # The dialog has a limited number of decay mode fields
+                if len(entry.get("decays") or {}) > MAX_DECAY_MODES:
+                    self.statusbar.showMessage(
+                        f"{iid} has more than {MAX_DECAY_MODES} decay modes, "
+                        f"it can not be edited!")
+                    continue
+                self.add_entry(entry)
             else:
                 break
 
@@ -172,121 +255,418 @@ class MainWindow(QMainWindow):
         create_new_isotope_w = CreateIsotopeWindow(default_data)
         create_new_isotope_w.exec_()
 
-        # Process results
+        # Process results, only the edited entry is written to the database
         if create_new_isotope_w.results is not None:
             iid = create_new_isotope_w.results["short_id"]
+            self._idbh.insert_section(iid, create_new_isotope_w.results)
             self.isotope_database.update({iid: create_new_isotope_w.results})
-            self.save_database()
 
         else:
             l.info("Add entry aborted by user")
 
-    def decay_isotope(self, isotope, original_mass, time):
-        """  """
-        data = self.isotope_database[isotope].get("decays", None)
-        half_life = self.isotope_database[isotope].get("half_life", None)
-        products = []
-
-        # Stable isotope
-        if data is None:
-            products.append([isotope, original_mass])
-
-        # Radioactive isotope
+    def import_table(self):
+        """Imports a nuclide table (CSV) into the isotope database."""
+        path, _ = QFileDialog.getOpenFileName(
+                self, "Import nuclide table", "",
+                "Nuclide tables (*.csv *.tsv *.txt);;All files (*)"
+        )
+        if not path:
+            l.info("Import aborted by user")
+            return
+
+        report = import_nuclide_table(path, self._idbh)
+        self.isotope_database.refresh()
+        self.statusbar.showMessage(f"Nuclide table imported: {report}")
+
+    def _plot_rows(self, xlim=None):
+        """Returns the plotted result, downsampled to the pixel columns of the
+        plot area.
+
+        :param tuple xlim: Visible time range in the plotted unit (default:
+            whole result).
+        :rtype: DecayResult
+
+        """
+        result, time_unit = self.plotted
+        start, stop = (None, None) if xlim is None else (
+            limit * TIME_UNITS[time_unit] for limit in xlim)
+        buckets = max(1, int(self.graph.axes.bbox.width))
+        return result.downsample(buckets, start, stop)
+
+    def _set_plot_data(self, xlim=None):
+        """Replaces the data of the curves with the downsampled result."""
+        result = self._plot_rows(xlim)
+        times = result.times_in(self.plotted[1])
+        for isotope, line in zip(result.isotopes,
+                                 self.graph.axes.get_lines()):
+            line.set_data(times, result.column(isotope))
+
+    def _on_xlim_changed(self, axes):
+        """Downsamples the plotted result again for the visible time range
+        (zoom, pan)."""
+        if self.plotted is not None:
+            self._set_plot_data(axes.get_xlim())
+            self.graph.draw_idle()
+
+    def _redraw_plot_data(self, _event=None):
+        """Downsamples the plotted result again for the new plot width."""
+        if self.plotted is not None and self.live_plot is None:
+            self._on_xlim_changed(self.graph.axes)
+
+    def set_time_unit(self, time_unit):
+        """Changes the time unit of the plot, by scaling the plotted times (the
+        result is not downsampled again).
+
+        :param str time_unit: Key of *TIME_UNITS*.
+
+        """
+        self.time_unit = time_unit
+        if self.plotted is None:
+            return
+
+        result, old_unit = self.plotted
+        self.plotted = (result, time_unit)
+        scale = TIME_UNITS[old_unit] / TIME_UNITS[time_unit]
+        for line in self.graph.axes.get_lines():
+            line.set_xdata(line.get_xdata() * scale)
+        left, right = self.graph.axes.get_xlim()
+        # Visible rows are the same, so xlim_changed is not emitted
+        self.graph.axes.set_xlim(left * scale, right * scale, emit=False)
+        self.graph.axes.set_xlabel(f"Time [{time_unit}]")
+        self.graph.draw_idle()
+
+    def set_quantity(self, quantity):
+        """Changes the plotted quantity, the last result is plotted again
+        (derived outputs are calculated from its mass history).
+
+        :param str quantity: "mass" or a key of *OUTPUTS*.
+
+        """
+        self.quantity = quantity
+        if self.last_run is not None and self.live_plot is None:
+            self.plot_last_run()
+
+    def _selected_result(self):
+        """Returns the selected quantity of the last result. A derived output
+        is calculated once (from the mass history), and kept in *outputs*.
+
+        :return: (result, axis label), the result has a column per isotope
+            (or decay mode) and a total column for the derived outputs.
+        :rtype: (DecayResult, str)
+
+        """
+        label = OUTPUTS.get(self.quantity, "Mass [kg]")
+        if self.quantity in self.outputs:
+            return self.outputs[self.quantity], label
+        if "mass" not in self.outputs:
+            raise ValueError(f"The result stores {list(self.outputs)[0]} "
+                             f"only!")
+
+        self.outputs[self.quantity] = self.last_run[1].derived(
+                self._chain(), self.quantity)
+        return self.outputs[self.quantity], label
+
+    def _chain(self):
+        """Returns the decay chain of the last result, the chain of an opened
+        result file is loaded from the database."""
+        engine, result = self.last_run
+        if engine is not None:
+            return engine.chain
+        return load_chain(self.isotope_database, result.isotopes,
+                          self.chain_cache)
+
+    def plot_last_run(self, update=False):
+        """Plots the selected quantity of the last result.
+
+        :param bool update: Update the existing curves (e.g. after a continued
+            calculation), instead of recreating the plot.
+
+        """
+        try:
+            result, label = self._selected_result()
+        except (KeyError, ValueError) as error:
+            l.error("Quantity can not be calculated: %s", error)
+            self.statusbar.showMessage(str(error))
+            return
+
+        if update and self.graph.axes.get_lines():
+            self.update_plot_data(result, time_unit=self.time_unit)
         else:
-            # Calculate remaining mass of original isotope
-            new_mass = original_mass * (2 ** (- (time / half_life)))
-            products.append([isotope, new_mass])
-
-            # Iterate over every decay type:
-            for decay in data.values():
-                # Calculate mass by the
-                # mass difference multiplied by the probability factor
-                products.append(
-                        [decay["product"],
-                         (original_mass-new_mass) * decay["probability"]]
-                )
-
-        return products
-
-    def convert_time_unit(self, time_interval, time_unit):
-        """  """
-        if time_unit == "min":
-            time_interval = time_interval / 60
-
-        if time_unit == "h":
-            time_interval = time_interval / 3600
-
-        if time_unit == "d":
-            time_interval = time_interval / 86400
-
-        if time_unit == "a":
-            time_interval = time_interval / 31556926
-
-        return time_interval
-
-    def create_plot_data(self, mass_distribution, time_interval, time_unit="s"):
-        """  """
-        i = 0
-        data = {}
-        time_interval = self.convert_time_unit(time_interval, time_unit)
+            self.create_plot_data(result, time_unit=self.time_unit,
+                                  label=label)
 
-        # Iterate over a specific mass-distribution in a given timestep
-        for mix in mass_distribution:
+    def create_plot_data(self, result, time_unit="s", label="Mass [kg]"):
+        """Plots every column of a result (e.g. the mass history of every
+        isotope). The curves are downsampled to the pixel columns of the plot
+        (keeping the peaks), and again from the full result when the visible
+        time range changes.
 
-            for isotope, mass in mix.items():
-                if isotope not in data:
-                    data[isotope] = {"time": [], "mass": []}
-                else:
-                    data[isotope]["time"].append(i*time_interval)
-                    data[isotope]["mass"].append(mass)
+        :param result: Result of the decay calculation.
+        :type result: DecayResult
+        :param str time_unit: Unit of the time axis.
+        :param str label: Label of the vertical axis.
 
-            i += 1
+        """
+        self.plotted = (result, time_unit)
+        rows = self._plot_rows()
+        times = rows.times_in(time_unit)
 
         # Generate plot:
         self.graph.axes.cla()  # Clear existing curves
 
         # Generate new data plots
-        for isotope, value in data.items():
-            self.graph.axes.plot(
-                    value["time"], value["mass"], label=f"{isotope}"
-            )
+        for isotope in rows.isotopes:
+            self.graph.axes.plot(times, rows.column(isotope),
+                                 label=f"{isotope}")
 
         # Set axis parameters
         self.graph.axes.set_title("Radioactive decay")
         self.graph.axes.set_xlabel(f"Time [{time_unit}]")
-        self.graph.axes.set_ylabel("Mass [kg]")
+        self.graph.axes.set_ylabel(label)
         self.graph.axes.set_xlim(0, None)
         self.graph.axes.set_ylim(0, None)
         self.graph.axes.grid()
         self.graph.axes.legend()
+        # Callbacks are reset by clearing the axes
+        self.graph.axes.callbacks.connect("xlim_changed",
+                                          self._on_xlim_changed)
         self.graph.draw()
         self.graph.flush_events()
 
-    def start_calculation(self):
-        """  """
-        init_mass, time_interval, step = (
-            self.sim_widget.get_simulation_parameters())
-        init_mass = [init_mass]  # list of dictionaries
-        i = 0
-        l.info("Starting decay calculation...")
-        while i <= step:
-
-            new_mass = {}
-            for isotope, mass in init_mass[-1].items():
+    def update_plot_data(self, result, time_unit="s"):
+        """Updates the data of the existing curves, e.g. after a continued
+        calculation, without recreating the plot."""
+        self.plotted = (result, time_unit)
+        self._set_plot_data()
 
-                # Calculate decay
-                products = self.decay_isotope(isotope, mass, time_interval)
-
-                for product in products:
-                    if product[0] not in new_mass:
-                        new_mass[f"{product[0]}"] = product[1]
-                    else:
-                        new_mass[f"{product[0]}"] += product[1]
+        self.graph.axes.relim()
+        self.graph.axes.autoscale_view()
+        self.graph.axes.set_xlim(0, None)
+        self.graph.axes.set_ylim(0, None)
+        self.graph.draw_idle()
+        self.graph.flush_events()
 
-            init_mass.append(new_mass)
-            i += 1
+    def _close_live_plot(self):
+        """Stops the live plot, its curves are kept."""
+        if self.live_plot is not None:
+            self.live_plot.close()
+            self.live_plot = None
+
+    def _start_worker(self, worker, on_finished, on_partial=None):
+        """Starts a calculation worker. A running calculation is cancelled (and
+        its signals are ignored), the new one supersedes it.
+
+        :param worker: Worker of the calculation.
+        :type worker: CalculationWorker
+        :param on_finished: Called with the result of the calculation.
+        :type on_finished: callable
+        :param on_partial: Called with the times and masses of each calculated
+            chunk (live workers only).
+        :type on_partial: callable
+
+        """
+        if self.worker is not None:
+            l.info("Running calculation superseded")
+            self.worker.cancel()
+            self._close_live_plot()
+        self.worker = worker
+
+        def progress(fraction):
+            if worker is self.worker:
+                self.statusbar.showMessage(f"Calculating... {fraction:.0%}")
+
+        def partial(times, masses):
+            if worker is self.worker:
+                on_partial(times, masses)
+
+        def finished(result):
+            if worker is self.worker:
+                self.worker = None
+                self._close_live_plot()
+                on_finished(result)
+
+        def failed(message):
+            if worker is self.worker:
+                self.worker = None
+                self._close_live_plot()
+                self.statusbar.showMessage(f"Calculation failed: {message}")
+
+        def cancelled():
+            if worker is self.worker:
+                self.worker = None
+                self._close_live_plot()
+                self.statusbar.showMessage("Calculation cancelled")
+
+        worker.signals.progress.connect(progress)
+        if on_partial is not None:
+            worker.signals.partial.connect(partial)
+        worker.signals.finished.connect(finished)
+        worker.signals.failed.connect(failed)
+        worker.signals.cancelled.connect(cancelled)
+        worker.start()
+
+    def cancel_calculation(self):
+        """Cancels the running calculation (at its next progress report)."""
+        if self.worker is None:
+            self.statusbar.showMessage("There is no running calculation!")
+            return
+        self.worker.cancel()
+        self.statusbar.showMessage("Cancelling calculation...")
 
-        self.create_plot_data(init_mass, time_interval, time_unit="d")
+    def start_calculation(self):
+        """Starts the decay calculation with the simulation parameters in the
+        background. The result is plotted when it is finished."""
+        init_mass, time_interval, step, solver, tolerance, equilibrium = (
+            self.sim_widget.get_simulation_parameters())
+        l.info("Starting decay calculation (%s)...", solver)
+        try:
+            # Only the records of the chain are loaded (and compiled)
+            chain = load_chain(self.isotope_database, init_mass.keys(),
+                               self.chain_cache)
+        except KeyError as error:
+            l.error(error.args[0])
+            self.statusbar.showMessage(error.args[0])
+            return
+
+        engine = DecayEngine(
+                chain, EQUILIBRIUM_THRESHOLD if equilibrium else None)
+
+        def finished(run):
+            times, masses = run
+            if engine.reduction is not None:
+                self.statusbar.showMessage(
+                        f"Equilibrium error bound: "
+                        f"{engine.reduction.error_bound:.3g} (after "
+                        f"{engine.reduction.settling_time:.3g} s)")
+            else:
+                self.statusbar.showMessage("Calculation finished")
+            self.last_run = (engine,
+                             DecayResult(chain.isotopes, times, masses))
+            self.outputs = {"mass": self.last_run[1]}
+            self.plot_last_run()
+
+        def partial(times, masses):
+            # Created by the first chunk, a cached result is plotted at once
+            if self.live_plot is None:
+                self.plotted = None
+                self.live_plot = LivePlot(
+                        self.graph, chain.isotopes, step * time_interval,
+                        1.05 * sum(init_mass.values()),
+                        time_unit=self.time_unit)
+            self.live_plot.add(times, masses)
+
+        live = self.live_plot_action.isChecked()
+        self._start_worker(CalculationWorker(
+                self.result_cache.run, engine, init_mass, time_interval,
+                step, solver=solver, tolerance=tolerance, live=live), finished,
+                on_partial=partial if live else None)
+
+    def continue_calculation(self):
+        """Continues the last calculation from its final state, by the number
+        of steps (with the time interval and solver) set in the simulation
+        parameters. The new points are appended to the existing curves."""
+        if self.worker is not None:
+            self.statusbar.showMessage("A calculation is already running!")
+            return
+        if self.last_run is None or self.last_run[0] is None:
+            self.statusbar.showMessage("There is no calculation to continue!")
+            return
+
+        _, time_interval, step, solver, tolerance, _ = (
+            self.sim_widget.get_simulation_parameters())
+        engine, result = self.last_run
+        l.info("Continuing decay calculation (%s) from %s s...", solver,
+               engine.time)
+
+        def finished(run):
+            times, masses = run
+            # Derived outputs are calculated for the new rows only
+            for quantity, output in self.outputs.items():
+                if quantity != "mass":
+                    output.append(times, engine.chain.derived(
+                            masses[0], result.masses[0],
+                            names=(quantity,))[quantity][1])
+            result.append(times, masses[0])
+            self.plot_last_run(update=True)
+            self.statusbar.showMessage(f"Calculation continued until "
+                                       f"{engine.time:.6g} s")
+
+        self._start_worker(CalculationWorker(
+                engine.resume, time_interval, step, solver=solver,
+                tolerance=tolerance), finished)
+
+    def open_result(self):
+        """Opens a result file (read-only memory map) and plots it, without
+        loading the whole file."""
+        path, _ = QFileDialog.getOpenFileName(
+                self, "Open result", "",
+                f"Result files (*{RESULT_EXTENSION});;All files (*)"
+        )
+        if not path:
+            l.info("Opening result aborted by user")
+            return
+
+        try:
+            result_file = ResultFile.open(path)
+        except (OSError, ValueError) as error:
+            l.error("Result file can not be opened: %s", error)
+            self.statusbar.showMessage(str(error))
+            return
+        self.last_run = (None, result_file.result())
+        # Result files may store a derived output instead of the masses
+        quantity = result_file.metadata.get("quantity", "mass")
+        self.outputs = {quantity: self.last_run[1]}
+        for action in self.quantity_actions.actions():
+            action.setChecked(action.text() == OUTPUTS.get(quantity,
+                                                           "Mass [kg]"))
+        self.quantity = quantity
+        self.plot_last_run()
+        self.statusbar.showMessage(f"Result opened: {path}")
+
+    def export_data(self):
+        """Exports the raw data of the plotted quantity (with the time unit of
+        the plot), with the decimation and compression set in the export
+        options. Result files store the stored quantity of the last run (the
+        mass history of a calculation)."""
+        if self.last_run is None:
+            self.statusbar.showMessage("There is no result to export!")
+            return
+
+        path, _ = QFileDialog.getSaveFileName(
+                self, "Export raw data", "",
+                "CSV (*.csv);;Compressed CSV (*.csv.gz);;NumPy (*.npz);;"
+                f"Parquet (*.parquet);;Result file (*{RESULT_EXTENSION})"
+        )
+        if not path:
+            l.info("Export aborted by user")
+            return
+
+        try:
+            if path.endswith(RESULT_EXTENSION):
+                # The stored quantity is the first one of the outputs
+                quantity = next(iter(self.outputs))
+                result = self.last_run[1]
+            else:
+                result, quantity = self._selected_result()[0], self.quantity
+        except (KeyError, ValueError) as error:
+            l.error("Export failed: %s", error)
+            self.statusbar.showMessage(f"Export failed: {error}")
+            return
+
+        options_w = ExportOptionsWindow(path, len(result))
+        options_w.exec_()
+        if options_w.results is None:
+            l.info("Export aborted by user")
+            return
+
+        try:
+            export_result(path, result, time_unit=self.time_unit,
+                          quantity=quantity, **options_w.results)
+        except (OSError, KeyError, ValueError, ImportError) as error:
+            l.error("Export failed: %s", error)
+            self.statusbar.showMessage(f"Export failed: {error}")
+            return
+        self.statusbar.showMessage(f"Raw data exported: {path}")
 
     def open_settings(self):
         print("Settings_open")
@@ -314,11 +694,7 @@ class MainWindow(QMainWindow):
         """ Opens C3D webpage in the default browser. """
         # webbrowser.open('https://c3d.hu/')
 
-    def save_database(self):
-        self._idbh.dump(self.isotope_database)
-
     def close_window(self):
-        self.save_database()
         self.close()
         l.info("Main window terminated!")
 
@@ -326,11 +702,13 @@ class MainWindow(QMainWindow):
 # Include guard
 if __name__ == '__main__':
     # Init JSON handlers:
-    IDBH = jdbh.JsonDbHandler("database/isotope_database.json")
     CDBH = jdbh.JsonDbHandler("database/configuration_settings.json")
 
     # Load config. db.
     config = CDBH.load()  # This is hardcoded
+    # JSON or SQLite (.db, .sqlite) isotope database
+    IDBH = jdbh.open_database(config.get("isotope_database",
+                                         "database/isotope_database.json"))
     # Software related data
     SOFTWARE_VERSION = (
             str(config["program_version_major"]) + "."
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Persistent cache of compiled decay chains.
+
+Every compiled chain (index arrays, decay data and Bateman coefficients) is
+saved as an NPZ file into a directory next to the database, named after the
+starting isotopes. The file also stores a hash of the database records of the
+chain: on lookup only these records are loaded (in one batch) and hashed, and
+the file is discarded if any of them was changed, added or deleted since. The
+least recently used files are evicted above a number and size limit.
+
+Libs
+----
+* numpy
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import hashlib
+import json
+import os
+import threading
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.utils import evict_files
+from modules.decay_engine import DecayChain
+from modules.decay_graph import DecayGraph, get_records, reachable_records
+
+# Version of the saved arrays, files of other versions are outdated
+CACHE_VERSION = 3
+
+
+def records_hash(isotopes, records):
+    """Hashes the records of a chain (and the cache version), missing isotopes
+    are hashed as null.
+
+    :param list isotopes: Short IDs of the chain.
+    :param dict records: Records from the isotope database.
+    :return: Hexadecimal SHA-256 digest.
+    :rtype: str
+
+    """
+    records = [[iid, records.get(iid, None)] for iid in isotopes]
+    content = json.dumps([CACHE_VERSION, records], sort_keys=True)
+    return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+
+class ChainCache:
+    """Directory of compiled decay chains, with least-recently-used eviction.
+
+    :param str directory: Cache directory (created if missing).
+    :param int max_entries: Maximum number of cached chains.
+    :param int max_bytes: Maximum total size of the cached files.
+
+    """
+    def __init__(self, directory, max_entries=256, max_bytes=64 * 2 ** 20):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def for_database(cls, handler, **kwargs):
+        """Returns the cache next to the database of a handler."""
+        return cls(f"{handler.filepath}.chains", **kwargs)
+
+    def _path(self, starting_isotopes):
+        """Filepath of the chain of the starting isotopes."""
+        key = "\n".join(sorted(set(starting_isotopes)))
+        return os.path.join(self.directory,
+                            hashlib.sha256(key.encode("utf8")).hexdigest()
+                            + ".npz")
+
+    def get(self, isotope_database, starting_isotopes):
+        """Returns the cached chain, if its records are unchanged.
+
+        :param isotope_database: Isotope database, or a *LazyDatabase* view.
+        :type isotope_database: dict
+        :param starting_isotopes: Short IDs of the starting isotopes.
+        :type starting_isotopes: iterable
+        :return: Decay chain, or None if not cached or outdated.
+        :rtype: DecayChain
+
+        """
+        path = self._path(starting_isotopes)
+        try:
+            with np.load(path, allow_pickle=False) as npz_file:
+                arrays = dict(npz_file)
+        except (OSError, ValueError):
+            return None
+
+        isotopes = arrays["isotopes"].tolist()
+        records = get_records(isotope_database, isotopes)
+        if records_hash(isotopes, records) != str(arrays.pop("records_hash")):
+            l.debug("Cached chain outdated: %s", path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # Removed by another process / thread
+                pass
+            return None
+
+        try:
+            os.utime(path)  # Most recently used
+        except FileNotFoundError:  # Evicted meanwhile, the chain is loaded
+            pass
+        return DecayChain.from_arrays(arrays)
+
+    def put(self, starting_isotopes, chain, records):
+        """Saves a compiled chain, then evicts the least recently used ones.
+
+        :param starting_isotopes: Short IDs of the starting isotopes.
+        :type starting_isotopes: iterable
+        :param chain: Compiled decay chain.
+        :type chain: DecayChain
+        :param dict records: Records of the chain from the isotope database.
+
+        """
+        path = self._path(starting_isotopes)
+        # Concurrent writers of the same chain write separate files
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as write_file:
+            np.savez(write_file,
+                     records_hash=records_hash(chain.isotopes, records),
+                     **chain.to_arrays())
+        os.replace(temp_path, path)  # Readers never see a partial file
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used chains above the limits."""
+        evict_files(self.directory, ".npz", self.max_entries, self.max_bytes)
+
+    def clear(self):
+        """Removes every cached chain."""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                os.remove(entry.path)
+
+
+def load_chain(isotope_database, starting_isotopes, cache=None):
+    """Returns the decay chain of the starting isotopes, from the cache if
+    possible, otherwise compiled from the database (and cached).
+
+    :param isotope_database: Isotope database, or a *LazyDatabase* view.
+    :type isotope_database: dict
+    :param starting_isotopes: Short IDs of the starting isotopes.
+    :type starting_isotopes: iterable
+    :param cache: Chain cache (default: no caching).
+    :type cache: ChainCache
+    :return: Decay chain.
+    :rtype: DecayChain
+
+    """
+    starting_isotopes = list(starting_isotopes)
+    if cache is not None:
+        chain = cache.get(isotope_database, starting_isotopes)
+        if chain is not None:
+            l.debug("Decay chain loaded from cache: %s", chain.isotopes)
+            return chain
+
+    records = reachable_records(isotope_database, starting_isotopes)
+    chain = DecayChain(DecayGraph(records), starting_isotopes)
+    if cache is not None:
+        cache.put(starting_isotopes, chain, records)
+    return chain
+
+
+if __name__ == '__main__':
+    pass
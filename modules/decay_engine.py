@@ -0,0 +1,1032 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Headless decay engine for the radioactive decay calculator. The decay chain
+reachable from the starting isotopes is compiled once into index arrays, and the
+mass distribution is advanced with one matrix-vector product per time step. The
+module does not depend on PyQt5 or matplotlib, so it can be used without a
+display.
+
+Beside time stepping, the chain can be solved in closed form with the
+generalized Bateman equations (eigen-decomposition of the decay-constant
+matrix), which returns the masses at arbitrary times directly. Chains with
+(nearly) equal decay constants have no Bateman solution, they are evaluated with
+the matrix exponential instead.
+
+The "exact" solver steps with the propagator exp(rate_matrix * interval), which
+also accounts for the growth and decay of the products within a step, so coarse
+steps give the same result as the closed form solution. Eigen-decompositions
+and propagators are cached by the content of the chain, thus repeated runs of
+the same chain and interval reuse them.
+
+Every solver has a batch variant, which advances a matrix of starting
+inventories (scenario x isotope) with the same propagator.
+
+The "adaptive" solver also steps with the exact propagator, but the interval
+is doubled or halved (relative to a base interval, so the propagators are
+reused), keeping the linear interpolation error between the stored points below
+a tolerance. Fast products need short steps only until they equilibrate, so
+long runs are described by a few hundred points instead of millions.
+
+Very long runs can be streamed: the rows are calculated chunk by chunk into a
+reused buffer, and only the decimated (or per bin reduced) rows are yielded,
+so memory does not grow with the number of steps.
+
+Optionally, products with much shorter half-life than their parents are
+short-circuited: they are assumed to be in (transient or secular) equilibrium
+with their parents, and evaluated with the analytic equilibrium ratio instead
+of being integrated. Only the slow isotopes remain in the solved system, which
+removes its stiffness.
+
+Activity, cumulative decays per decay mode, released power and energy are
+derived from the mass history with a single matrix product, as every one of
+them is linear in the masses and the starting masses. The cumulative number of
+decays follows from the balance of the rate equations, without integrating the
+history: D(t) = (I - B)^-1 (N0 - N(t)), where B is the branching matrix.
+
+Libs
+----
+* numpy
+
+Help
+----
+* https://en.wikipedia.org/wiki/Bateman_equation
+* N. J. Higham: The scaling and squaring method for the matrix exponential
+    revisited (2005)
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+from copy import copy
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.utils import LruCache
+
+SOLVERS = ("step", "exact", "adaptive", "bateman")
+# Reducers of the streaming output, applied to the rows of an output bin
+REDUCERS = ("first", "mean", "min", "max")
+# Default interpolation error of the adaptive solver, relative to total mass
+ADAPTIVE_TOLERANCE = 1e-3
+# Default ratio of decay constants, above which a product is in equilibrium
+EQUILIBRIUM_THRESHOLD = 1e3
+# Number of rows (time steps) calculated at once by the chunked solvers
+CHUNK_SIZE = 65536
+# Relative gap between decay constants, below which they count as equal
+DEGENERACY_TOLERANCE = 1e-6
+# Accepted rounding error of the Bateman coefficients, estimated from the
+# condition number of the eigenvectors (nearly equal decay constants give
+# large, cancelling coefficients), the matrix exponential is used above it
+BATEMAN_ERROR = 1e-9
+# Avogadro constant [1/mol], and the energy of 1 MeV [J]
+AVOGADRO = 6.02214076e23
+MEV = 1.602176634e-13
+# Derived outputs of the mass history (see DecayChain.derived), with labels
+OUTPUTS = {"activity": "Activity [Bq]", "decays": "Cumulative decays",
+           "power": "Power [W]", "energy": "Released energy [J]"}
+
+# Pade approximant (degree 13) coefficients and scaling threshold for expm
+_PADE_13 = (64764752532480000., 32382376266240000., 7771770303897600.,
+            1187353796428800., 129060195264000., 10559470521600.,
+            670442572800., 33522128640., 1323241920., 40840800., 960960.,
+            16380., 182., 1.)
+_THETA_13 = 5.371920351148152
+
+# Caches keyed by the content of the chain (and the time interval)
+_EIGEN_CACHE = LruCache(max_size=32)
+_PROPAGATOR_CACHE = LruCache(max_size=128)
+
+
+def expm(matrix):
+    """Matrix exponential with the scaling and squaring method (Pade 13).
+
+    :param matrix: Square matrix.
+    :type matrix: numpy.ndarray
+    :return: exp(matrix)
+    :rtype: numpy.ndarray
+
+    """
+    norm = np.linalg.norm(matrix, 1)
+    squarings = max(0, int(np.ceil(np.log2(norm / _THETA_13)))) if norm else 0
+    scaled = matrix / 2 ** squarings
+
+    b = _PADE_13
+    ident = np.eye(matrix.shape[0])
+    a2 = scaled @ scaled
+    a4 = a2 @ a2
+    a6 = a4 @ a2
+    u = scaled @ (a6 @ (b[13] * a6 + b[11] * a4 + b[9] * a2)
+                  + b[7] * a6 + b[5] * a4 + b[3] * a2 + b[1] * ident)
+    v = (a6 @ (b[12] * a6 + b[10] * a4 + b[8] * a2)
+         + b[6] * a6 + b[4] * a4 + b[2] * a2 + b[0] * ident)
+    result = np.linalg.solve(v - u, v + u)
+
+    for _ in range(squarings):
+        result = result @ result
+    return result
+
+
+class DecayChain:
+    """Decay chain compiled from the isotope database.
+
+    The chain contains every isotope reachable from the starting isotopes,
+    sliced from the decay graph of the database. Each isotope gets an integer
+    index (in topological order, if the chain has no cycle), the decays are
+    stored as parallel (parent, daughter, probability, mode, released energy)
+    arrays. Isotopes without half-life (or missing from the database) are
+    treated as stable.
+
+    :param decay_graph: Compiled decay graph of the database.
+    :type decay_graph: DecayGraph
+    :param starting_isotopes: Short IDs of the starting isotopes.
+    :type starting_isotopes: iterable
+
+    """
+    # Bateman coefficients and propagators are kept in the shared caches, or
+    # on the chain itself (only the coefficients) for one-off chains
+    cached = True
+    _eigen = None
+
+    def __init__(self, decay_graph, starting_isotopes):
+        graph_ids = decay_graph.reachable(starting_isotopes)
+        self.isotopes = [decay_graph.isotopes[i] for i in graph_ids]
+        self.index = {iid: i for i, iid in enumerate(self.isotopes)}
+        local_ids = np.full(len(decay_graph), -1, dtype=np.intp)
+        local_ids[graph_ids] = np.arange(len(graph_ids))
+
+        starts = decay_graph.daughter_ptr[graph_ids]
+        stops = decay_graph.daughter_ptr[graph_ids + 1]
+        edges = np.concatenate(
+                [np.arange(start, stop) for start, stop in zip(starts, stops)]
+                + [np.zeros(0, dtype=np.intp)]
+        )
+
+        self.half_lives = decay_graph.half_lives[graph_ids]
+        self.decay_constants = decay_graph.decay_constants[graph_ids]
+        self.parents = np.repeat(np.arange(len(graph_ids)), stops - starts)
+        self.daughters = local_ids[decay_graph.daughters[edges]]
+        self.probabilities = decay_graph.branching[edges]
+        self.modes = decay_graph.modes[edges]
+        self.released_energies = decay_graph.released_energies[edges]
+        self.mass_numbers = decay_graph.mass_numbers[graph_ids]
+
+        cyclic = set(decay_graph.cycles).intersection(self.isotopes)
+        self.order = None if cyclic else list(range(len(self)))
+        self._update_key()
+        l.debug("Decay chain compiled: %s", self.isotopes)
+
+    def __len__(self):
+        return len(self.isotopes)
+
+    def _update_key(self):
+        """Sets the key of the chain, which identifies its content."""
+        self.key = (tuple(self.isotopes), self.half_lives.tobytes(),
+                    self.parents.tobytes(), self.daughters.tobytes(),
+                    self.probabilities.tobytes())
+
+    def with_parameters(self, half_lives=None, probabilities=None,
+                        cached=True):
+        """Returns a copy of the chain with modified decay data, e.g. for
+        uncertainty calculations. The structure of the chain is unchanged.
+
+        :param half_lives: New half-lives, in chain index order [s].
+        :type half_lives: numpy.ndarray
+        :param probabilities: New branching ratios, in decay order.
+        :type probabilities: numpy.ndarray
+        :param bool cached: Keep the Bateman coefficients and propagators in
+            the shared caches. One-off chains (e.g. perturbed scenarios) would
+            only evict the entries of the reused ones.
+        :return: Modified chain.
+        :rtype: DecayChain
+
+        """
+        chain = copy(self)
+        if half_lives is not None:
+            chain.half_lives = np.asarray(half_lives, dtype=np.float64)
+            chain.decay_constants = np.log(2) / chain.half_lives
+        if probabilities is not None:
+            chain.probabilities = np.asarray(probabilities, dtype=np.float64)
+        chain.cached = cached
+        chain._eigen = None
+        chain._update_key()
+        return chain
+
+    def to_arrays(self):
+        """Exports the chain, with its Bateman coefficients, e.g. to be saved
+        with *numpy.savez*.
+
+        :return: Name -> array.
+        :rtype: dict
+
+        """
+        arrays = {"isotopes": np.array(self.isotopes),
+                  "half_lives": self.half_lives,
+                  "parents": self.parents,
+                  "daughters": self.daughters,
+                  "probabilities": self.probabilities,
+                  "modes": self.modes,
+                  "released_energies": self.released_energies,
+                  "mass_numbers": self.mass_numbers,
+                  "cyclic": np.array(self.order is None)}
+        eigen = self.eigen()
+        if eigen is not None:
+            arrays.update(zip(("eigenvalues", "vectors", "inverse"), eigen))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuilds a chain exported by *to_arrays*, without a decay graph.
+
+        :param arrays: Name -> array, e.g. loaded with *numpy.load*.
+        :type arrays: dict
+        :return: Decay chain.
+        :rtype: DecayChain
+
+        """
+        chain = cls.__new__(cls)
+        chain.isotopes = arrays["isotopes"].tolist()
+        chain.index = {iid: i for i, iid in enumerate(chain.isotopes)}
+        chain.half_lives = arrays["half_lives"]
+        chain.decay_constants = np.log(2) / chain.half_lives
+        chain.parents = arrays["parents"]
+        chain.daughters = arrays["daughters"]
+        chain.probabilities = arrays["probabilities"]
+        chain.modes = arrays["modes"]
+        chain.released_energies = arrays["released_energies"]
+        chain.mass_numbers = arrays["mass_numbers"]
+        chain.order = None if arrays["cyclic"] else list(range(len(chain)))
+        chain._update_key()
+        if "eigenvalues" in arrays:
+            _EIGEN_CACHE[chain.key] = (arrays["eigenvalues"],
+                                       arrays["vectors"], arrays["inverse"])
+        return chain
+
+    def columns(self, quantity="mass"):
+        """Returns the column labels of a quantity.
+
+        :param str quantity: "mass" (the short IDs), or a key of *OUTPUTS*.
+        :rtype: list
+
+        """
+        if quantity == "mass":
+            return list(self.isotopes)
+        return self.output_weights((quantity,))[0][quantity]
+
+    def output_weights(self, names=None):
+        """Returns the weights of the derived outputs, see *derived*. The
+        outputs are masses @ weights + initial masses @ initial_weights.
+
+        :param names: Keys of *OUTPUTS* (default: every output).
+        :type names: iterable
+        :return: (columns, weights, initial_weights) - output name -> column
+            labels, and the weights of the columns (isotope x column).
+        :rtype: (dict, numpy.ndarray, numpy.ndarray)
+
+        """
+        size = len(self)
+        atoms = 1e3 * AVOGADRO / self.mass_numbers  # Number of atoms in 1 kg
+        atoms[self.decay_constants == 0] = 0.0  # Stable isotopes do not decay
+        branching = np.zeros((size, size))
+        np.add.at(branching, (self.daughters, self.parents),
+                  self.probabilities)
+        try:
+            # Cumulative decays of each isotope: (N0 - N(t)) @ decays
+            decays = np.linalg.inv(np.eye(size) - branching).T * atoms
+        except np.linalg.LinAlgError as error:
+            raise ValueError("Cumulative decays are undefined on a closed "
+                             "decay cycle!") from error
+        activity = np.diag(self.decay_constants * atoms)
+        energy = np.zeros(size)  # Mean released energy per decay [J]
+        np.add.at(energy, self.parents,
+                  self.probabilities * self.released_energies * MEV)
+        modes = sorted(set(self.modes.tolist()))
+        per_mode = np.zeros((size, len(modes)))
+        np.add.at(per_mode, (self.parents, np.searchsorted(modes, self.modes)),
+                  self.probabilities)
+
+        zeros = np.zeros((size, size + 1))
+        outputs = {  # Labels, weights, initial weights (with total column)
+            "activity": (self.isotopes, activity, None),
+            "decays": (modes, -decays @ per_mode, decays @ per_mode),
+            "power": (self.isotopes, activity * energy, None),
+            "energy": (self.isotopes, -decays * energy, decays * energy)}
+        columns, weights, initial_weights = {}, [], []
+        for name in OUTPUTS if names is None else names:
+            labels, weight, initial_weight = outputs[name]
+            columns[name] = list(labels) + ["total"]
+            weights.append(np.column_stack([weight, weight.sum(axis=1)]))
+            initial_weights.append(
+                    zeros[:, :len(labels) + 1] if initial_weight is None
+                    else np.column_stack([initial_weight,
+                                          initial_weight.sum(axis=1)]))
+        return columns, np.hstack(weights), np.hstack(initial_weights)
+
+    def derived(self, masses, initial=None, names=None):
+        """Calculates derived outputs of a mass history, with a single matrix
+        product over the rows:
+
+        * activity: activity of each isotope, and the total [Bq]
+        * decays: cumulative number of decays per decay mode, and the total
+        * power: released power of each isotope, and the total [W]
+        * energy: cumulative released energy of each isotope, and the total [J]
+
+        Masses are converted to number of atoms with the mass numbers, the
+        energies are the released energies of the decay modes (unknown ones
+        count as 0).
+
+        :param masses: Mass history (... x time x isotope) [kg].
+        :type masses: numpy.ndarray
+        :param initial: Starting masses (... x isotope) [kg] (default: first
+            row of the history).
+        :type initial: numpy.ndarray
+        :param names: Keys of *OUTPUTS* (default: every output).
+        :type names: iterable
+        :return: Output name -> (column labels, values (... x time x column)).
+        :rtype: dict
+
+        """
+        columns, weights, initial_weights = self.output_weights(names)
+        masses = np.asarray(masses)
+        initial = masses[..., 0, :] if initial is None else np.asarray(initial)
+        values = masses @ weights
+        values += (initial @ initial_weights)[..., np.newaxis, :]
+
+        outputs = {}
+        start = 0
+        for name, labels in columns.items():
+            outputs[name] = (labels, values[..., start:start + len(labels)])
+            start += len(labels)
+        return outputs
+
+    def initial_vector(self, initial_masses):
+        """Converts the starting masses to a mass vector of the chain.
+
+        :param initial_masses: Starting mass of isotopes, e.g. {"Ra-225": 10}.
+        :type initial_masses: dict
+        :return: Mass vector, in chain index order.
+        :rtype: numpy.ndarray
+
+        """
+        vector = np.zeros(len(self), dtype=np.float64)
+        for isotope, mass in initial_masses.items():
+            vector[self.index[isotope]] += mass
+        return vector
+
+    def transition_matrix(self, time_interval):
+        """Returns the matrix, which advances the mass vector by one time step.
+
+        The remaining mass of each isotope is multiplied by the survival factor
+        of the interval, and the decayed mass is credited to the products,
+        multiplied by the probability of the decay mode.
+
+        :param float time_interval: Length of a time step [s].
+        :return: Transition matrix (daughter x parent).
+        :rtype: numpy.ndarray
+
+        """
+        survival = 2 ** (- (time_interval / self.half_lives))
+        matrix = np.diag(survival)
+        np.add.at(matrix, (self.daughters, self.parents),
+                  (1 - survival[self.parents]) * self.probabilities)
+        return matrix
+
+    def rate_matrix(self):
+        """Returns the decay-constant matrix (dm/dt = rate_matrix @ m).
+
+        :return: Rate matrix (daughter x parent) [1/s].
+        :rtype: numpy.ndarray
+
+        """
+        matrix = np.diag(-self.decay_constants)
+        np.add.at(matrix, (self.daughters, self.parents),
+                  self.decay_constants[self.parents] * self.probabilities)
+        return matrix
+
+    def eigen(self):
+        """Eigen-decomposition of the rate matrix, i.e. the coefficients of the
+        generalized Bateman equations.
+
+        The eigenvalues are the negative decay constants, the eigenvectors are
+        built along the topological order, so no numerical eigen-solver is
+        needed. The decomposition does not exist if the chain has a cycle, or a
+        parent and one of its descendants have (nearly) equal decay constants.
+        It is rejected, if its estimated rounding error (condition number of
+        the eigenvectors times the machine epsilon) exceeds *BATEMAN_ERROR*.
+
+        :return: (eigenvalues, eigenvectors, inverse of eigenvectors), or None
+            if the rate matrix is not diagonalizable this way.
+        :rtype: tuple
+
+        """
+        if not self.cached:
+            if self._eigen is None:
+                self._eigen = self._bateman_coefficients() or False
+            return self._eigen or None
+
+        eigen = _EIGEN_CACHE.get(self.key)
+        if eigen is None:
+            eigen = self._bateman_coefficients() or False
+            _EIGEN_CACHE[self.key] = eigen
+        return eigen or None
+
+    def _bateman_coefficients(self):
+        """  """
+        if self.order is None:
+            return None
+
+        rate = self.rate_matrix()
+        eigenvalues = np.diag(rate).copy()
+        vectors = np.zeros_like(rate)
+        for position, k in enumerate(self.order):
+            vectors[k, k] = 1.0
+            for i in self.order[position + 1:]:
+                inflow = rate[i] @ vectors[:, k]
+                if inflow == 0:
+                    continue
+
+                gap = eigenvalues[k] - eigenvalues[i]
+                if abs(gap) <= DEGENERACY_TOLERANCE * max(abs(eigenvalues[k]),
+                                                          abs(eigenvalues[i])):
+                    l.info("Degenerate decay constants: %s, %s",
+                           self.isotopes[k], self.isotopes[i])
+                    return None
+                vectors[i, k] = inflow / gap
+
+        inverse = np.linalg.inv(vectors)
+        condition = (np.linalg.norm(vectors, np.inf)
+                     * np.linalg.norm(inverse, np.inf))
+        if condition * np.finfo(np.float64).eps > BATEMAN_ERROR:
+            l.info("Ill-conditioned Bateman coefficients (condition number: "
+                   "%.3g)", condition)
+            return None
+        return eigenvalues, vectors, inverse
+
+    def propagator(self, time_interval):
+        """Returns the exact propagator of one time step, exp(rate_matrix *
+        time_interval). The matrix is cached per chain and interval (unless
+        the chain is not *cached*).
+
+        :param float time_interval: Length of a time step [s].
+        :return: Propagator matrix (daughter x parent).
+        :rtype: numpy.ndarray
+
+        """
+        key = (self.key, float(time_interval))
+        matrix = _PROPAGATOR_CACHE.get(key) if self.cached else None
+        if matrix is None:
+            eigen = self.eigen()
+            if eigen is None:
+                matrix = expm(self.rate_matrix() * time_interval)
+            else:
+                eigenvalues, vectors, inverse = eigen
+                matrix = (vectors * np.exp(eigenvalues * time_interval)
+                          ) @ inverse
+            # Cancellation may leave tiny negative values
+            np.maximum(matrix, 0.0, out=matrix)
+            if self.cached:
+                _PROPAGATOR_CACHE[key] = matrix
+        return matrix
+
+
+class EquilibriumReduction:
+    """Short-circuits the products, which are in equilibrium with their parents.
+
+    A product is fast, if its decay constant is at least *threshold* times
+    larger than the driving decay constant of every parent (a slow isotope
+    drives with its own decay constant, a fast one with the driving constant of
+    its parents). The mass of a fast product follows from its inflow:
+    m = inflow / decay_constant. Fast products are removed from the chain, and
+    the slow isotopes get effective branching ratios, which include the decays
+    through the fast products. Starting masses of fast products are forwarded
+    to their slow descendants.
+
+    The relative error of the equilibrium masses is at most *error_bound*, after
+    the initial transient (*settling_time*, ten half-lives of the slowest fast
+    product).
+
+    :param chain: Compiled decay chain.
+    :type chain: DecayChain
+    :param float threshold: Ratio of decay constants.
+
+    """
+    def __init__(self, chain, threshold=EQUILIBRIUM_THRESHOLD):
+        self.chain = chain
+        self.threshold = threshold
+        fast = np.zeros(len(chain), dtype=bool)
+        driving = chain.decay_constants.copy()
+
+        if chain.order is None:
+            l.warning("Equilibrium short-circuit is not possible, the decay "
+                      "chain contains a cycle!")
+        else:
+            for isotope in chain.order:
+                parents = chain.parents[chain.daughters == isotope]
+                if len(parents) == 0:
+                    continue
+                parent_driving = driving[parents].max()
+                if chain.decay_constants[isotope] >= threshold * parent_driving:
+                    fast[isotope] = True
+                    driving[isotope] = parent_driving
+
+        self.fast = np.flatnonzero(fast)
+        self.slow = np.flatnonzero(~fast)
+
+        # Branching matrix (daughter x parent), and its blocks
+        branching = np.zeros((len(chain), len(chain)))
+        np.add.at(branching, (chain.daughters, chain.parents),
+                  chain.probabilities)
+        through_fast = np.linalg.inv(
+                np.eye(len(self.fast))
+                - branching[np.ix_(self.fast, self.fast)]
+        )
+        to_slow = branching[np.ix_(self.slow, self.fast)] @ through_fast
+        effective = (branching[np.ix_(self.slow, self.slow)]
+                     + to_slow @ branching[np.ix_(self.fast, self.slow)])
+
+        # Starting masses: slow = forwarding @ full
+        self.forwarding = np.zeros((len(self.slow), len(chain)))
+        self.forwarding[:, self.slow] = np.eye(len(self.slow))
+        self.forwarding[:, self.fast] = to_slow
+
+        # Full masses = reconstruction @ slow
+        self.reconstruction = np.zeros((len(chain), len(self.slow)))
+        self.reconstruction[self.slow] = np.eye(len(self.slow))
+        self.reconstruction[self.fast] = (
+                (through_fast @ branching[np.ix_(self.fast, self.slow)])
+                * chain.decay_constants[self.slow]
+                / chain.decay_constants[self.fast][:, np.newaxis]
+        )
+
+        # Reduced chain of the slow isotopes
+        daughters, parents = np.nonzero(effective)
+        self.reduced = copy(chain)
+        self.reduced.isotopes = [chain.isotopes[i] for i in self.slow]
+        self.reduced.index = {iid: i for i, iid in
+                              enumerate(self.reduced.isotopes)}
+        self.reduced.half_lives = chain.half_lives[self.slow]
+        self.reduced.decay_constants = chain.decay_constants[self.slow]
+        self.reduced.parents = parents
+        self.reduced.daughters = daughters
+        self.reduced.probabilities = effective[daughters, parents]
+        self.reduced.order = (None if chain.order is None
+                              else list(range(len(self.slow))))
+        self.reduced._update_key()
+
+        if len(self.fast):
+            ratio = driving[self.fast] / chain.decay_constants[self.fast]
+            self.error_bound = float((ratio / (1 - ratio)).max())
+            self.settling_time = float(10 * chain.half_lives[self.fast].max())
+        else:
+            self.error_bound = 0.0
+            self.settling_time = 0.0
+        l.info("Equilibrium short-circuit of %s (error bound: %.3g, after "
+               "%.3g s)", [chain.isotopes[i] for i in self.fast],
+               self.error_bound, self.settling_time)
+
+    def forward(self, initial):
+        """Converts starting masses (... x isotope) to the reduced chain."""
+        return initial @ self.forwarding.T
+
+    def expand(self, masses):
+        """Converts masses (... x slow isotope) back to the full chain."""
+        return masses @ self.reconstruction.T
+
+
+def reduce_rows(masses, decimation, reducers):
+    """Reduces every *decimation* consecutive rows to one output row.
+
+    :param masses: Rows (time x isotope).
+    :type masses: numpy.ndarray
+    :param int decimation: Number of rows per output bin (the last bin may be
+        shorter).
+    :param tuple reducers: Names from *REDUCERS*, "first" keeps the first row
+        of each bin.
+    :return: Reducer name -> reduced rows (bin x isotope), new arrays.
+    :rtype: dict
+
+    """
+    bins = -(-len(masses) // decimation)
+    whole = len(masses) // decimation * decimation
+    reduced = {}
+    for reducer in reducers:
+        if reducer == "first":
+            reduced[reducer] = masses[::decimation].copy()
+            continue
+
+        function = {"mean": np.mean, "min": np.min, "max": np.max}[reducer]
+        rows = np.empty((bins, masses.shape[1]))
+        rows[:whole // decimation] = function(
+                masses[:whole].reshape(-1, decimation, masses.shape[1]),
+                axis=1)
+        if whole < len(masses):
+            rows[-1] = function(masses[whole:], axis=0)
+        reduced[reducer] = rows
+    return reduced
+
+
+class DecayEngine:
+    """Decay calculation of a compiled decay chain.
+
+    :param chain: Compiled decay chain.
+    :type chain: DecayChain
+    :param float equilibrium: Threshold of the equilibrium short-circuit (see
+        *EquilibriumReduction*), or None to solve the full chain.
+
+    """
+    def __init__(self, chain, equilibrium=None):
+        self.chain = chain
+        self.time = 0.0  # Final time of the last run [s]
+        self.state = None  # Final masses of the last run (scenario x isotope)
+        self.reduction = None
+        if equilibrium is not None:
+            self.reduction = EquilibriumReduction(chain, equilibrium)
+
+    def run(self, initial_masses, time_interval, step, solver="step",
+            tolerance=ADAPTIVE_TOLERANCE, progress=None):
+        """Advances the starting masses by *step* time steps.
+
+        :param dict initial_masses: Starting mass of isotopes [kg].
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of time steps.
+        :param str solver: "step" for time stepping with the per-step decayed
+            mass credited to the products, "exact" for time stepping with the
+            cached propagator, "adaptive" for exact stepping with variable
+            interval (until step * time_interval), "bateman" for the closed
+            form solution at the same time points.
+        :param float tolerance: Interpolation error of the adaptive solver,
+            relative to the total mass.
+        :param progress: Optional callback, called with the completed fraction
+            (0 to 1) during the calculation. It may raise an exception to abort
+            the calculation.
+        :type progress: callable
+        :return: (times, masses) - time of each row [s], and the mass history
+            (time x isotope) in chain index order [kg].
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        initial = self.chain.initial_vector(initial_masses)
+        times, masses = self.run_batch(initial[np.newaxis], time_interval,
+                                       step, solver=solver,
+                                       tolerance=tolerance, progress=progress)
+        return times, masses[0]
+
+    def run_batch(self, initial_masses, time_interval, step, solver="step",
+                  tolerance=ADAPTIVE_TOLERANCE, progress=None,
+                  quantity="mass"):
+        """Advances many starting inventories of the same chain at once.
+
+        Every scenario shares the same transition matrix (or propagator), so a
+        time step costs one matrix-matrix product for the whole batch.
+
+        :param initial_masses: Starting masses (scenario x isotope) in chain
+            index order [kg].
+        :type initial_masses: array_like
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of time steps.
+        :param str solver: Solver, see *run*.
+        :param float tolerance: Tolerance of the adaptive solver, see *run*.
+        :param progress: Optional progress callback, see *run*.
+        :type progress: callable
+        :param str quantity: "mass", or a derived output (key of *OUTPUTS*),
+            which is calculated chunk by chunk, so the mass history is not
+            kept (except for the adaptive solver).
+        :return: (times, masses) - time of each step [s], and the mass history
+            (scenario x time x isotope) [kg], or the derived output (scenario x
+            time x column, see *DecayChain.columns*).
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver: {solver}")
+        if quantity != "mass" and quantity not in OUTPUTS:
+            raise ValueError(f"Unknown quantity: {quantity}")
+
+        initial = self._initial_matrix(initial_masses)
+        if quantity == "mass" or solver == "adaptive":
+            times, masses = self._run_batch(initial, time_interval, step,
+                                            solver, tolerance, progress)
+            self.time, self.state = times[-1], masses[:, -1].copy()
+            if quantity == "mass":
+                return times, masses
+            return times, self.chain.derived(masses, initial,
+                                             names=(quantity,))[quantity][1]
+
+        _, weights, initial_weights = self.chain.output_weights((quantity,))
+        offset = (initial @ initial_weights)[:, np.newaxis]
+        values = np.empty((len(initial), step + 1, weights.shape[1]))
+        # Chunks of about 1 % of the steps, for the progress reports
+        chunk_rows = max(1, min(CHUNK_SIZE // len(initial), -(-step // 100)))
+        row = 0
+        for _, masses in self._chunks(initial, time_interval, step, solver,
+                                      chunk_rows):
+            np.add(np.matmul(masses, weights).transpose(1, 0, 2), offset,
+                   out=values[:, row:row + len(masses)])
+            row += len(masses)
+            if progress is not None:
+                progress(row / (step + 1))
+        return np.arange(step + 1, dtype=np.float64) * time_interval, values
+
+    def _run_batch(self, initial, time_interval, step, solver, tolerance,
+                   progress=None):
+        """Solver dispatch of *run_batch*, without keeping the final state."""
+        if self.reduction is not None:
+            times, masses = DecayEngine(self.reduction.reduced).run_batch(
+                    self.reduction.forward(initial), time_interval, step,
+                    solver=solver, tolerance=tolerance, progress=progress
+            )
+            return times, self.reduction.expand(masses)
+
+        if solver == "adaptive":
+            return self._run_adaptive(initial, time_interval * step, tolerance,
+                                      progress)
+
+        times = np.arange(step + 1, dtype=np.float64) * time_interval
+        if solver == "bateman":
+            masses = self.solve_batch(initial, times)
+            if progress is not None:
+                progress(1.0)
+            return times, masses
+
+        if solver == "exact":
+            matrix = self.chain.propagator(time_interval)
+        else:
+            matrix = self.chain.transition_matrix(time_interval)
+
+        # Stored time-major, so each step writes a contiguous block
+        masses = np.empty((step + 1,) + initial.shape, dtype=np.float64)
+        masses[0] = initial
+        report = max(1, step // 100)  # Progress is reported in 1 % steps
+        for i in range(step):
+            np.matmul(masses[i], matrix.T, out=masses[i + 1])
+            if progress is not None and (i + 1) % report == 0:
+                progress((i + 1) / step)
+
+        return times, masses.transpose(1, 0, 2)
+
+    def stream(self, initial_masses, time_interval, step, solver="step",
+               decimation=1, reducers=("first",), chunk_size=CHUNK_SIZE,
+               quantity="mass"):
+        """Advances the starting masses by *step* time steps, and yields the
+        output chunk by chunk. Memory usage depends only on the chunk size.
+
+        :param dict initial_masses: Starting mass of isotopes [kg].
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of time steps.
+        :param str solver: "step", "exact" or "bateman", see *run*.
+        :param int decimation: Number of steps per output row.
+        :param tuple reducers: Reduction of the rows of an output bin, names
+            from *REDUCERS*.
+        :param int chunk_size: Number of steps calculated at once (rounded
+            down to a multiple of *decimation*).
+        :param str quantity: "mass", or a derived output (key of *OUTPUTS*),
+            which is calculated from each chunk before the reduction.
+        :return: Generator of (times, reduced) pairs - start time of each output
+            bin [s], and reducer name -> reduced masses (bin x isotope) [kg], or
+            reduced output (bin x column, see *DecayChain.columns*).
+
+        """
+        if solver not in SOLVERS or solver == "adaptive":
+            raise ValueError(f"Solver can not be streamed: {solver}")
+        unknown = set(reducers) - set(REDUCERS)
+        if unknown:
+            raise ValueError(f"Unknown reducers: {sorted(unknown)}")
+        if quantity != "mass" and quantity not in OUTPUTS:
+            raise ValueError(f"Unknown quantity: {quantity}")
+
+        initial = self.chain.initial_vector(initial_masses)[np.newaxis]
+        if quantity != "mass":
+            _, weights, initial_weights = self.chain.output_weights(
+                    (quantity,))
+            offset = initial[0] @ initial_weights
+
+        chunk_rows = max(decimation, chunk_size // decimation * decimation)
+        for times, masses in self._chunks(initial, time_interval, step,
+                                          solver, chunk_rows):
+            masses = masses[:, 0]
+            if quantity != "mass":
+                masses = masses @ weights + offset
+            yield times[::decimation], reduce_rows(masses, decimation,
+                                                   reducers)
+
+    def _chunks(self, initial, time_interval, step, solver, chunk_rows):
+        """Fixed step solution of *step* time steps, chunk by chunk. The final
+        state is kept, when every chunk is consumed.
+
+        :param initial: Starting masses (scenario x isotope) [kg].
+        :type initial: numpy.ndarray
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of time steps.
+        :param str solver: "step", "exact" or "bateman", see *run*.
+        :param int chunk_rows: Number of rows of a chunk.
+        :return: Generator of (times, masses) pairs - time of each row [s], and
+            the masses (time x scenario x isotope) [kg], overwritten by the
+            next chunk.
+
+        """
+        engine = self
+        if self.reduction is not None:
+            engine = DecayEngine(self.reduction.reduced)
+            initial = self.reduction.forward(initial)
+
+        if solver == "exact":
+            matrix = engine.chain.propagator(time_interval)
+        elif solver == "step":
+            matrix = engine.chain.transition_matrix(time_interval)
+
+        buffer = np.empty((min(chunk_rows, step + 1),) + initial.shape)
+        state = initial
+        for first in range(0, step + 1, chunk_rows):
+            rows = min(chunk_rows, step + 1 - first)
+            times = (first + np.arange(rows)) * time_interval
+            if solver == "bateman":
+                masses = engine.solve_batch(initial, times).transpose(1, 0, 2)
+            else:
+                masses = buffer[:rows]
+                masses[0] = state if first == 0 else state @ matrix.T
+                for i in range(1, rows):
+                    np.matmul(masses[i - 1], matrix.T, out=masses[i])
+            state = masses[-1].copy()
+
+            if self.reduction is not None:
+                masses = self.reduction.expand(masses)
+            yield times, masses
+
+        self.time = step * time_interval
+        self.state = (state if self.reduction is None
+                      else self.reduction.expand(state))
+
+    def resume(self, time_interval, step, solver="step",
+               tolerance=ADAPTIVE_TOLERANCE, progress=None):
+        """Continues the last run by *step* time steps (*step* * *time_interval*
+        seconds) from its final state, so the previous steps are not
+        recalculated.
+
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of additional time steps.
+        :param str solver: Solver, see *run*.
+        :param float tolerance: Tolerance of the adaptive solver, see *run*.
+        :param progress: Optional progress callback, see *run*.
+        :type progress: callable
+        :return: (times, masses) - the new rows only (after the final time of
+            the last run), see *run_batch*.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        if self.state is None:
+            raise ValueError("There is no run to continue!")
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver: {solver}")
+
+        if self.reduction is None:
+            times, masses = self._run_batch(self.state, time_interval, step,
+                                            solver, tolerance, progress)
+        else:
+            # State of the reduced chain is the mass of the slow isotopes
+            times, masses = DecayEngine(self.reduction.reduced).run_batch(
+                    self.state[:, self.reduction.slow], time_interval, step,
+                    solver=solver, tolerance=tolerance, progress=progress)
+            masses = self.reduction.expand(masses)
+
+        times, masses = self.time + times[1:], masses[:, 1:]
+        self.time, self.state = times[-1], masses[:, -1].copy()
+        return times, masses
+
+    def extend(self, times, masses, time_interval, step, solver="step",
+               progress=None):
+        """Continues a run (e.g. a cached one) by *step* time steps from its
+        last row, see *resume*.
+
+        :param times: Time of each row of the run [s].
+        :type times: numpy.ndarray
+        :param masses: Mass history of the run (scenario x time x isotope) [kg].
+        :type masses: numpy.ndarray
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of additional time steps.
+        :param str solver: Solver, see *run*.
+        :param progress: Optional progress callback, see *run*.
+        :type progress: callable
+        :return: (times, masses) - the whole run, see *run_batch*.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        self.time, self.state = times[-1], masses[:, -1].copy()
+        new_times, new_masses = self.resume(time_interval, step, solver=solver,
+                                            progress=progress)
+        return (np.concatenate((times, new_times)),
+                np.concatenate((masses, new_masses), axis=1))
+
+    def _run_adaptive(self, initial, end_time, tolerance, progress=None):
+        """Exact time stepping with variable interval.
+
+        The interval is *base * 2**k*, where the base is a fixed fraction of the
+        end time, so the cached propagators are reused within, and between the
+        runs. A step is accepted if the exact mid-step state differs from the
+        linear interpolation of its end points less than the tolerance (the
+        next step is attempted with double interval, if the error is well
+        below), otherwise the step is retried with half interval.
+
+        :return: (times, masses) - see *run_batch*.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        if not tolerance > 0:
+            raise ValueError("Tolerance must be positive!")
+        base = end_time / 2 ** 20
+        exponent = 0
+        time = 0.0
+        state = initial
+        times = [time]
+        masses = [state]
+        scale = max(initial.sum(axis=1).max(), np.finfo(np.float64).tiny)
+
+        while time < end_time:
+            interval = min(base * 2.0 ** exponent, end_time - time)
+            new_state = state @ self.chain.propagator(interval).T
+            middle = state @ self.chain.propagator(interval / 2).T
+            error = np.abs(middle - (state + new_state) / 2).max() / scale
+
+            if error > tolerance and exponent > -30:
+                exponent -= 1
+                continue
+
+            time += interval
+            state = new_state
+            times.append(time)
+            masses.append(state)
+            if progress is not None:
+                progress(time / end_time)
+            if error < tolerance / 4:
+                exponent += 1
+
+        l.debug("Adaptive solver: %s steps", len(times) - 1)
+        return np.array(times), np.stack(masses, axis=1)
+
+    def solve(self, initial_masses, times):
+        """Returns the masses at the requested times in closed form, without
+        time stepping.
+
+        :param dict initial_masses: Starting mass of isotopes [kg].
+        :param times: Requested time points [s].
+        :type times: array_like
+        :return: Masses (time x isotope) in chain index order [kg].
+        :rtype: numpy.ndarray
+
+        """
+        initial = self.chain.initial_vector(initial_masses)
+        return self.solve_batch(initial[np.newaxis], times)[0]
+
+    def solve_batch(self, initial_masses, times):
+        """Closed form solution of many starting inventories at once.
+
+        :param initial_masses: Starting masses (scenario x isotope) in chain
+            index order [kg].
+        :type initial_masses: array_like
+        :param times: Requested time points [s].
+        :type times: array_like
+        :return: Masses (scenario x time x isotope) [kg].
+        :rtype: numpy.ndarray
+
+        """
+        initial = self._initial_matrix(initial_masses)
+        times = np.asarray(times, dtype=np.float64)
+        if self.reduction is not None:
+            masses = DecayEngine(self.reduction.reduced).solve_batch(
+                    self.reduction.forward(initial), times)
+            return self.reduction.expand(masses)
+
+        eigen = self.chain.eigen()
+
+        if eigen is None:
+            rate = self.chain.rate_matrix()
+            masses = np.empty((len(times),) + initial.shape, dtype=np.float64)
+            for i, time in enumerate(times):
+                masses[i] = initial @ expm(rate * time).T
+        else:
+            eigenvalues, vectors, inverse = eigen
+            coefficients = initial @ inverse.T
+            masses = (np.exp(np.outer(times, eigenvalues))[:, np.newaxis, :]
+                      * coefficients) @ vectors.T
+
+        # Cancellation may leave tiny negative values
+        np.maximum(masses, 0.0, out=masses)
+        return masses.transpose(1, 0, 2)
+
+    def _initial_matrix(self, initial_masses):
+        """  """
+        initial = np.asarray(initial_masses, dtype=np.float64)
+        if initial.ndim != 2 or initial.shape[1] != len(self.chain):
+            raise ValueError(
+                    f"Initial masses must have shape (scenarios, "
+                    f"{len(self.chain)}), got {initial.shape}!"
+            )
+        return initial
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Compiled index of the isotope database. The decay graph is built once, when
+the database is loaded, and every solver reads the decay data from its compact
+arrays instead of walking the nested dictionaries of the JSON records.
+
+With a lazy database view, the graph can be restricted to the isotopes
+reachable from given roots, so only the records of the chain are loaded.
+
+Libs
+----
+* numpy
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+from collections import deque
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+
+
+class DecayGraph:
+    """Decay graph of the whole isotope database.
+
+    Every isotope gets an integer ID (its index in *isotopes*). The products of
+    isotope *i* are stored CSR-style: *daughters[daughter_ptr[i]:
+    daughter_ptr[i+1]]* with the matching *branching* ratios, decay *modes* and
+    *released_energies* [MeV] (unknown energies are 0). Products which are
+    referenced, but have no entry in the database, are added to the graph as
+    stable isotopes and listed in *missing*. The mass number of an isotope is
+    read from its record, or from its short ID (e.g. "Ra-225").
+
+    :param isotope_database: Isotope database, as returned by
+        *JsonDbHandler.load*, or a *LazyDatabase* view.
+    :type isotope_database: dict
+    :param roots: Short IDs of starting isotopes. If given, only the isotopes
+        reachable from them are compiled.
+    :type roots: iterable
+
+    """
+    def __init__(self, isotope_database, roots=None):
+        if roots is not None:
+            isotope_database = reachable_records(isotope_database, roots)
+        self.isotopes = list(isotope_database.keys())
+        self.index = {iid: i for i, iid in enumerate(self.isotopes)}
+        self.missing = []
+        half_lives = []
+        mass_numbers = []
+        daughter_ptr = [0]
+        daughters = []
+        branching = []
+        modes = []
+        energies = []
+
+        for isotope in list(self.isotopes):
+            record = isotope_database[isotope]
+            half_life = record.get("half_life", None)
+            decay_data = record.get("decays", None)
+            mass_numbers.append(mass_number(isotope, record))
+
+            if half_life is None or decay_data is None:
+                half_lives.append(np.inf)  # Stable isotope
+                daughter_ptr.append(len(daughters))
+                continue
+
+            half_lives.append(float(half_life))
+            for mode, decay in decay_data.items():
+                product = decay["product"]
+                if product not in self.index:
+                    self.index[product] = len(self.isotopes)
+                    self.isotopes.append(product)
+                    self.missing.append(product)
+                daughters.append(self.index[product])
+                branching.append(decay["probability"])
+                modes.append(mode)
+                energies.append(decay.get("released_energy", None) or 0.0)
+            daughter_ptr.append(len(daughters))
+
+        # Missing products are stable, without decays
+        half_lives.extend([np.inf] * len(self.missing))
+        mass_numbers.extend(mass_number(isotope, {})
+                            for isotope in self.missing)
+        daughter_ptr.extend([len(daughters)] * len(self.missing))
+
+        self.half_lives = np.array(half_lives, dtype=np.float64)
+        self.decay_constants = np.log(2) / self.half_lives  # 0.0 if stable
+        self.daughter_ptr = np.array(daughter_ptr, dtype=np.intp)
+        self.daughters = np.array(daughters, dtype=np.intp)
+        self.branching = np.array(branching, dtype=np.float64)
+        self.modes = np.array(modes, dtype=str)
+        self.released_energies = np.array(energies, dtype=np.float64)
+        self.mass_numbers = np.array(mass_numbers, dtype=np.float64)
+        self.order, self.cycles = self._topological_order()
+        self.rank = np.empty(len(self), dtype=np.intp)
+        self.rank[self.order] = np.arange(len(self))
+
+        if self.missing:
+            l.warning("Decay products missing from the database: %s",
+                      self.missing)
+        if self.cycles:
+            l.warning("Decay cycle in the database: %s", self.cycles)
+        l.debug("Decay graph compiled: %s isotopes", len(self))
+
+    def __len__(self):
+        return len(self.isotopes)
+
+    def products(self, isotope_id):
+        """Returns the products and branching ratios of an isotope.
+
+        :param int isotope_id: Integer ID of the isotope.
+        :return: (daughter IDs, branching ratios)
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        start, stop = self.daughter_ptr[isotope_id:isotope_id + 2]
+        return self.daughters[start:stop], self.branching[start:stop]
+
+    def _topological_order(self):
+        """Orders the isotopes so, that every parent precedes its products.
+
+        Isotopes, which can not be ordered (they are on, or between decay
+        cycles) are placed to the end of the order.
+
+        :return: (order, cycles) - isotope IDs in topological order, and the
+            short IDs of the isotopes on decay cycles.
+        :rtype: (list, list)
+
+        """
+        parents = np.repeat(np.arange(len(self)), np.diff(self.daughter_ptr))
+        indegree = np.bincount(self.daughters, minlength=len(self)).tolist()
+        queue = deque(i for i, degree in enumerate(indegree) if degree == 0)
+        order = []
+        while queue:
+            isotope = queue.popleft()
+            order.append(isotope)
+            for daughter in self.products(isotope)[0].tolist():
+                indegree[daughter] -= 1
+                if indegree[daughter] == 0:
+                    queue.append(daughter)
+
+        if len(order) == len(self):
+            return order, []
+
+        # Peel the isotopes downstream of the cycles, the rest is on a cycle
+        remaining = set(range(len(self))) - set(order)
+        outdegree = {i: 0 for i in remaining}
+        for parent, daughter in zip(parents.tolist(), self.daughters.tolist()):
+            if parent in remaining and daughter in remaining:
+                outdegree[parent] += 1
+
+        downstream = []
+        queue = deque(i for i, degree in outdegree.items() if degree == 0)
+        while queue:
+            isotope = queue.popleft()
+            downstream.append(isotope)
+            for parent in (parents[self.daughters == isotope]).tolist():
+                if parent in outdegree:
+                    outdegree[parent] -= 1
+                    if outdegree[parent] == 0:
+                        queue.append(parent)
+
+        cyclic = sorted(remaining - set(downstream))
+        order.extend(cyclic)
+        order.extend(reversed(downstream))
+        return order, [self.isotopes[i] for i in cyclic]
+
+    def reachable(self, starting_isotopes):
+        """Returns the isotopes reachable from the starting isotopes.
+
+        :param starting_isotopes: Short IDs of the starting isotopes.
+        :type starting_isotopes: iterable
+        :return: Isotope IDs in topological order.
+        :rtype: numpy.ndarray
+
+        """
+        seen = np.zeros(len(self), dtype=bool)
+        queue = deque()
+        for isotope in starting_isotopes:
+            if isotope not in self.index:
+                raise KeyError(f"Isotope {isotope} is not in the database!")
+            queue.append(self.index[isotope])
+
+        while queue:
+            isotope = queue.popleft()
+            if seen[isotope]:
+                continue
+            seen[isotope] = True
+            queue.extend(self.products(isotope)[0].tolist())
+
+        reachable = np.flatnonzero(seen)
+        return reachable[np.argsort(self.rank[reachable])]
+
+
+def mass_number(isotope, record):
+    """Returns the mass number of an isotope, from its record, or its short ID.
+
+    :param str isotope: Short ID, e.g. "Ra-225".
+    :param dict record: Record of the isotope (may be empty).
+    :return: Mass number, or NaN if unknown.
+    :rtype: float
+
+    """
+    value = record.get("mass_number", None)
+    if value is None:
+        value = isotope.rpartition("-")[2].rstrip("m")
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def get_records(isotope_database, identifiers):
+    """Returns the given records, in one batch from a lazy database view.
+
+    :param isotope_database: Isotope database, or a *LazyDatabase* view.
+    :type isotope_database: dict
+    :param identifiers: Short IDs.
+    :type identifiers: iterable
+    :return: Existing records, missing short IDs are skipped.
+    :rtype: dict
+
+    """
+    if hasattr(isotope_database, "records"):
+        return isotope_database.records(identifiers)
+    return {iid: isotope_database[iid] for iid in identifiers
+            if iid in isotope_database}
+
+
+def reachable_records(isotope_database, roots):
+    """Collects the records of the isotopes reachable from the roots. The
+    records are requested generation by generation, so a lazy database view
+    loads each generation in one batch.
+
+    :param isotope_database: Isotope database, or a *LazyDatabase* view.
+    :type isotope_database: dict
+    :param roots: Short IDs of the starting isotopes.
+    :type roots: iterable
+    :return: Records of the reachable isotopes, products missing from the
+        database are skipped.
+    :rtype: dict
+
+    """
+    frontier = list(dict.fromkeys(roots))
+    for isotope in frontier:
+        if isotope not in isotope_database:
+            raise KeyError(f"Isotope {isotope} is not in the database!")
+
+    records = {}
+    seen = set(frontier)
+    while frontier:
+        loaded = get_records(isotope_database, frontier)
+        records.update(loaded)
+        frontier = []
+        for record in loaded.values():
+            for decay in (record.get("decays", None) or {}).values():
+                if decay["product"] not in seen:
+                    seen.add(decay["product"])
+                    frontier.append(decay["product"])
+    return records
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Columnar container of a decay calculation result.
+
+The mass history is a single 2-D float64 array (time x isotope) with the short
+IDs as column header, so plotting and exporting read NumPy arrays directly:
+the column of an isotope, a time window, or the times in another unit are
+views (or a single scaled copy of the time column), not rebuilt lists. Rows can
+be appended (e.g. by a continued calculation) into a preallocated buffer, which
+grows by doubling, so repeated appends do not copy the whole history.
+
+Libs
+----
+* numpy
+
+Contents
+--------
+"""
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+
+# Length of time units [s]
+TIME_UNITS = {"s": 1.0, "min": 60.0, "h": 3600.0, "d": 86400.0,
+              "a": 31556926.0}
+
+
+class DecayResult:
+    """Mass history of a decay chain.
+
+    :param isotopes: Short IDs, in column order.
+    :type isotopes: list
+    :param times: Time of each row [s].
+    :type times: array_like
+    :param masses: Mass history (time x isotope) [kg], used without copying.
+    :type masses: numpy.ndarray
+
+    """
+    def __init__(self, isotopes, times, masses):
+        self.isotopes = list(isotopes)
+        self.index = {iid: i for i, iid in enumerate(self.isotopes)}
+        self._times = np.asarray(times, dtype=np.float64)
+        self._masses = np.asarray(masses, dtype=np.float64)
+        if self._masses.shape != (len(self._times), len(self.isotopes)):
+            raise ValueError(f"Masses must have shape ({len(self._times)}, "
+                             f"{len(self.isotopes)}), got "
+                             f"{self._masses.shape}!")
+        self._rows = len(self._times)
+
+    @classmethod
+    def empty(cls, isotopes, capacity):
+        """Returns an empty result with preallocated rows.
+
+        :param list isotopes: Short IDs, in column order.
+        :param int capacity: Number of preallocated rows.
+        :rtype: DecayResult
+
+        """
+        result = cls(isotopes, np.empty(capacity),
+                     np.empty((capacity, len(isotopes))))
+        result._rows = 0
+        return result
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, isotope):
+        return self.column(isotope)
+
+    @property
+    def times(self):
+        """Time of each row [s]."""
+        return self._times[:self._rows]
+
+    @property
+    def masses(self):
+        """Mass history (time x isotope) [kg]."""
+        return self._masses[:self._rows]
+
+    @property
+    def nbytes(self):
+        """Size of the stored rows."""
+        return self.times.nbytes + self.masses.nbytes
+
+    def column(self, isotope):
+        """Returns the mass history of an isotope, as a view.
+
+        :param str isotope: Short ID.
+        :return: Mass of each row [kg].
+        :rtype: numpy.ndarray
+
+        """
+        return self.masses[:, self.index[isotope]]
+
+    def times_in(self, time_unit):
+        """Returns the time of each row in the given unit.
+
+        :param str time_unit: Key of *TIME_UNITS*.
+        :rtype: numpy.ndarray
+
+        """
+        if time_unit == "s":
+            return self.times
+        return self.times / TIME_UNITS[time_unit]
+
+    def window(self, start=None, stop=None):
+        """Returns the rows between two times (inclusive), as views.
+
+        :param float start: First time [s] (default: first row).
+        :param float stop: Last time [s] (default: last row).
+        :rtype: DecayResult
+
+        """
+        first = 0 if start is None else np.searchsorted(self.times, start)
+        last = (self._rows if stop is None
+                else np.searchsorted(self.times, stop, side="right"))
+        return DecayResult(self.isotopes, self.times[first:last],
+                           self.masses[first:last])
+
+    def thin(self, max_rows):
+        """Returns every n-th row (and the last one), so that at most about
+        *max_rows* rows remain. Only the selected rows are copied (or read from
+        a memory-mapped result).
+
+        :param int max_rows: Maximum number of rows.
+        :rtype: DecayResult
+
+        """
+        if self._rows <= max_rows:
+            return self
+        stride = -(-self._rows // max_rows)
+        rows = np.r_[0:self._rows:stride, self._rows - 1]
+        return DecayResult(self.isotopes, self.times[rows], self.masses[rows])
+
+    def downsample(self, buckets, start=None, stop=None):
+        """Returns the first, minimum, maximum and last mass of each isotope in
+        *buckets* equal time intervals (e.g. the pixel columns of a plot)
+        between two times. A curve drawn from these rows looks the same as the
+        full resolution one (peaks are kept), with at most 4 points per bucket.
+        The rows next to the time window are kept too, so the curves reach the
+        edges of the plot.
+
+        :param int buckets: Number of time intervals.
+        :param float start: First time [s] (default: first row).
+        :param float stop: Last time [s] (default: last row).
+        :rtype: DecayResult
+
+        """
+        first = (0 if start is None
+                 else max(0, np.searchsorted(self.times, start) - 1))
+        last = (self._rows if stop is None else
+                min(self._rows,
+                    np.searchsorted(self.times, stop, side="right") + 1))
+        times, masses = self.times[first:last], self.masses[first:last]
+        if len(times) <= 4 * buckets:
+            return DecayResult(self.isotopes, times, masses)
+
+        # First row of each non-empty bucket, and the last one
+        edges = np.unique(np.searchsorted(
+                times, np.linspace(times[0], times[-1], buckets + 1)[:-1]))
+        ends = np.append(edges[1:], len(times)) - 1
+        rows = np.empty((len(edges), 4, len(self.isotopes)))
+        rows[:, 0] = masses[edges]
+        rows[:, 3] = masses[ends]
+        # Contiguous blocks are reduced faster than with ufunc.reduceat
+        for i, (edge, end) in enumerate(zip(edges, ends + 1)):
+            block = masses[edge:end]
+            block.min(axis=0, out=rows[i, 1])
+            block.max(axis=0, out=rows[i, 2])
+        # Extremes are drawn inside the bucket, within one pixel column
+        row_times = np.stack([times[edges], times[edges], times[ends],
+                              times[ends]], axis=1)
+        return DecayResult(self.isotopes, row_times.ravel(),
+                           rows.reshape(-1, len(self.isotopes)))
+
+    def derived(self, chain, name):
+        """Returns a derived output (e.g. activity) of the mass history, with
+        the same times, see *DecayChain.derived*. The first row is the
+        starting inventory.
+
+        :param chain: Decay chain of the result.
+        :type chain: DecayChain
+        :param str name: Output name, key of *OUTPUTS*.
+        :rtype: DecayResult
+
+        """
+        columns, weights, initial_weights = chain.output_weights((name,))
+        if self.isotopes != chain.isotopes:
+            # Rows of the weights are reordered, so the (possibly
+            # memory-mapped) masses are not copied
+            rows = [self.index[iid] for iid in chain.isotopes]
+            expanded = np.zeros((2, len(self.isotopes), weights.shape[1]))
+            expanded[0, rows], expanded[1, rows] = weights, initial_weights
+            weights, initial_weights = expanded
+        values = self.masses @ weights
+        values += self.masses[0] @ initial_weights
+        return DecayResult(columns[name], self.times, values)
+
+    def append(self, times, masses):
+        """Appends rows, growing the buffer by doubling if it is full.
+
+        :param times: Time of each new row [s].
+        :type times: array_like
+        :param masses: New rows (time x isotope) [kg].
+        :type masses: numpy.ndarray
+
+        """
+        rows = self._rows + len(times)
+        if rows > len(self._times):
+            capacity = max(rows, 2 * len(self._times))
+            l.debug("Result buffer grown to %s rows", capacity)
+            new_times = np.empty(capacity)
+            new_masses = np.empty((capacity, len(self.isotopes)))
+            new_times[:self._rows] = self.times
+            new_masses[:self._rows] = self.masses
+            self._times, self._masses = new_times, new_masses
+
+        self._times[self._rows:rows] = times
+        self._masses[self._rows:rows] = masses
+        self._rows = rows
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Raw data exporters of decay calculation results.
+
+The exporters write the arrays of a *DecayResult* directly: CSV is formatted
+chunk by chunk with *numpy.savetxt* (one format string per row, no per-cell
+Python strings), NPZ and Parquet are written in native binary. Every format
+supports time unit conversion, decimation (every n-th row) and optional
+compression. The format is chosen by the file extension.
+
+Libs
+----
+* numpy
+* pyarrow (optional, for Parquet)
+
+Help
+----
+* https://arrow.apache.org/docs/python/parquet.html
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import gzip
+import io
+
+# Third party imports
+import numpy as np
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.result_file import ResultFile, RESULT_EXTENSION
+
+# Number of rows formatted at once
+CSV_CHUNK_ROWS = 8192
+
+
+def _columns(result, time_unit, decimation):
+    """Returns the (decimated) time column in the given unit, and masses."""
+    times = result.times_in(time_unit)[::decimation]
+    return times, result.masses[::decimation]
+
+
+def export_csv(path, result, time_unit="s", decimation=1, compress=False,
+               quantity="mass"):
+    """Writes a result as CSV (time column, then one column per isotope).
+
+    :param str path: Filepath, compressed with gzip if it ends with ".gz".
+    :param result: Result of the decay calculation.
+    :type result: DecayResult
+    :param str time_unit: Unit of the time column.
+    :param int decimation: Every n-th row is written.
+    :param bool compress: Compress with gzip, regardless of the extension.
+    :param str quantity: Unused, for the common exporter interface.
+
+    """
+    times, masses = _columns(result, time_unit, decimation)
+    header = ",".join([f"time [{time_unit}]"] + result.isotopes)
+    fmt = ",".join(["%.10g"] * (len(result.isotopes) + 1))
+
+    if compress or path.endswith(".gz"):
+        write_file = gzip.open(path, "wb", compresslevel=6)
+    else:
+        write_file = open(path, "wb")
+    with write_file:
+        write_file.write((header + "\n").encode("utf8"))
+        rows = np.empty((min(CSV_CHUNK_ROWS, len(times)),
+                         len(result.isotopes) + 1))
+        for start in range(0, len(times), CSV_CHUNK_ROWS):
+            chunk = rows[:min(CSV_CHUNK_ROWS, len(times) - start)]
+            chunk[:, 0] = times[start:start + len(chunk)]
+            chunk[:, 1:] = masses[start:start + len(chunk)]
+            # Chunk is formatted in memory, and written at once
+            text = io.StringIO()
+            np.savetxt(text, chunk, fmt=fmt)
+            write_file.write(text.getvalue().encode("utf8"))
+
+
+def export_npz(path, result, time_unit="s", decimation=1, compress=False,
+               quantity="mass"):
+    """Writes a result as NPZ (times, masses, isotopes and time_unit arrays).
+
+    :param str path: Filepath.
+    :param result: Result of the decay calculation.
+    :type result: DecayResult
+    :param str time_unit: Unit of the times.
+    :param int decimation: Every n-th row is written.
+    :param bool compress: Use zip compression.
+    :param str quantity: Unused, for the common exporter interface.
+
+    """
+    times, masses = _columns(result, time_unit, decimation)
+    save = np.savez_compressed if compress else np.savez
+    save(path, times=times, masses=masses, isotopes=np.array(result.isotopes),
+         time_unit=np.array(time_unit))
+
+
+def export_parquet(path, result, time_unit="s", decimation=1, compress=False,
+                   quantity="mass"):
+    """Writes a result as Parquet table (time column, then one column per
+    isotope). Needs the optional pyarrow package.
+
+    :param str path: Filepath.
+    :param result: Result of the decay calculation.
+    :type result: DecayResult
+    :param str time_unit: Unit of the time column.
+    :param int decimation: Every n-th row is written.
+    :param bool compress: Use zstd compression.
+    :param str quantity: Unused, for the common exporter interface.
+
+    """
+    if pyarrow is None:
+        raise ImportError("Parquet export needs the pyarrow package!")
+
+    times, masses = _columns(result, time_unit, decimation)
+    columns = [pyarrow.array(times)] + [
+        pyarrow.array(np.ascontiguousarray(masses[:, i]))
+        for i in range(len(result.isotopes))]
+    table = pyarrow.table(columns,
+                          names=[f"time [{time_unit}]"] + result.isotopes)
+    pyarrow.parquet.write_table(table, path,
+                                compression="zstd" if compress else "none")
+
+
+def export_result_file(path, result, time_unit="s", decimation=1,
+                       compress=False, quantity="mass"):
+    """Writes a result as memory-mapped result file (times are always stored
+    in seconds, the file is not compressed).
+
+    :param str path: Filepath.
+    :param result: Result of the decay calculation.
+    :type result: DecayResult
+    :param str time_unit: Unused, for the common exporter interface.
+    :param int decimation: Every n-th row is written.
+    :param bool compress: Unused, for the common exporter interface.
+    :param str quantity: Stored quantity ("mass" or a derived output), it is
+        kept in the metadata.
+
+    """
+    times, masses = _columns(result, "s", decimation)
+    result_file = ResultFile.create(path, result.isotopes, times,
+                                    metadata={"decimation": decimation,
+                                              "quantity": quantity})
+    result_file.masses[:] = masses
+    result_file.flush()
+
+
+EXPORTERS = {".csv": export_csv, ".csv.gz": export_csv, ".npz": export_npz,
+             ".parquet": export_parquet, RESULT_EXTENSION: export_result_file}
+
+
+def export_result(path, result, time_unit="s", decimation=1, compress=False,
+                  quantity="mass"):
+    """Writes a result with the exporter matching the file extension.
+
+    :param str path: Filepath (.csv, .csv.gz, .npz, .parquet or .rdc).
+    :param result: Result of the decay calculation.
+    :type result: DecayResult
+    :param str time_unit: Unit of the time column.
+    :param int decimation: Every n-th row is written.
+    :param bool compress: Use the compression of the format.
+    :param str quantity: Quantity of the result ("mass" or a derived output),
+        stored in the metadata of result files.
+
+    """
+    for extension, exporter in EXPORTERS.items():
+        if path.lower().endswith(extension):
+            break
+    else:
+        raise ValueError(f"Unknown export format: {path}")
+
+    if decimation < 1:
+        raise ValueError("Decimation must be at least 1!")
+    exporter(path, result, time_unit, decimation, compress, quantity)
+    l.info("Result exported: %s", path)
+
+
+if __name__ == '__main__':
+    pass
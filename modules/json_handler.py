@@ -4,11 +4,25 @@
 """JSON database handler module for SeatUP Desktop App. This module describes
 the JSON database handler classes.
 
+Beside the JSON file, the same interface is implemented over an SQLite file,
+where every entry is stored as a separate record (JSON text, keyed by its
+identifier). Inserting, updating or deleting an entry touches only its own
+record, and a single lookup does not parse the whole database.
+
+Lookups of the JSON handler do not keep the parsed database either: the file
+is scanned once (and again only if it changed), and only the byte offsets of
+the entries are kept. An entry is parsed from its own slice of the file.
+
+*LazyDatabase* is a read-only dictionary view over a handler: it keeps only the
+keys in memory, and loads the entries on first access (in batches, see
+*records*), with a bounded cache.
+
 Help
 ----
 * https://www.pythoncentral.io/hashing-strings-with-python/
 * https://stackoverflow.com/questions/18337407/saving-utf-8-texts-with-json-/
     dumps-as-utf8-not-as-u-escape-sequence
+* https://docs.python.org/3/library/sqlite3.html
 
 Contents
 --------
@@ -16,6 +30,11 @@ Contents
 
 # Standard library imports
 import json
+import os
+import re
+import sqlite3
+from collections.abc import Mapping
+from contextlib import closing, contextmanager
 
 # pylint: disable = no-name-in-module
 # Third party imports
@@ -24,6 +43,57 @@ import json
 
 # Local application imports
 from logger import MAIN_LOGGER as l
+from modules.utils import LruCache
+
+# Insignificant whitespace of JSON text
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _entry_offsets(text):
+    """Returns the position of every entry of a JSON object, without keeping
+    the parsed entries.
+
+    :param str text: JSON text of an object.
+    :return: Key -> (start, end) byte offsets of its value (UTF-8).
+    :rtype: dict
+
+    """
+    decoder = json.JSONDecoder()
+    offsets = {}
+    # Byte offsets are counted incrementally from the character offsets
+    chars, position = 0, 0
+
+    def byte_offset(index):
+        nonlocal chars, position
+        position += len(text[chars:index].encode("utf8"))
+        chars = index
+        return position
+
+    index = _WHITESPACE.match(text).end()
+    if text[index:index + 1] != "{":
+        raise ValueError("Database is not a JSON object!")
+    index = _WHITESPACE.match(text, index + 1).end()
+    if text[index:index + 1] == "}":
+        return offsets
+
+    while True:
+        if text[index:index + 1] != '"':
+            raise ValueError(f"Invalid JSON key at character {index}!")
+        key, index = json.decoder.scanstring(text, index + 1)
+        index = _WHITESPACE.match(text, index).end()
+        if text[index:index + 1] != ":":
+            raise ValueError(f"Missing ':' at character {index}!")
+        index = _WHITESPACE.match(text, index + 1).end()
+        # The value is parsed only to find its end, and dropped
+        _, end = decoder.raw_decode(text, index)
+        offsets[key] = (byte_offset(index), byte_offset(end))
+        index = _WHITESPACE.match(text, end).end()
+        if text[index:index + 1] == ",":
+            index = _WHITESPACE.match(text, index + 1).end()
+        elif text[index:index + 1] == "}":
+            return offsets
+        else:
+            raise ValueError(f"Missing ',' at character {index}!")
 
 
 class JsonDbHandler:
@@ -38,6 +108,36 @@ class JsonDbHandler:
     """
     def __init__(self, path):
         self._filepath = path
+        # (mtime, size) of the file, and the byte offsets of its entries
+        self._index = None
+
+    @property
+    def filepath(self):
+        """Filepath of the database."""
+        return self._filepath
+
+    def _offsets(self, read_file):
+        """Returns the byte offsets of the entries for lookups. The file is
+        scanned again only if it has changed (modification time or size), so
+        repeated lookups (e.g. a decay chain, generation by generation) cost
+        one scan, and a parse of the looked up entries.
+
+        :param read_file: The database file, opened in binary mode.
+        :type read_file: file
+        :return: Key -> (start, end) byte offsets of its entry.
+        :rtype: dict
+
+        """
+        stat = os.fstat(read_file.fileno())
+        stat = (stat.st_mtime_ns, stat.st_size)
+        index = self._index
+        if index is None or index[0] != stat:
+            read_file.seek(0)
+            index = (stat, _entry_offsets(read_file.read().decode("utf8")))
+            self._index = index
+            l.debug("Database %s indexed: %s entries", self._filepath,
+                    len(index[1]))
+        return index[1]
 
     def load(self):
         """Loads a JSON object from a given filepath, then converts it to python
@@ -57,6 +157,7 @@ class JsonDbHandler:
         :type database: dict
 
         """
+        self._index = None
         with open(self._filepath, "w", encoding='utf8') as write_file:
             json.dump(database, write_file, ensure_ascii=False, indent=4)
 
@@ -125,6 +226,59 @@ class JsonDbHandler:
     # NOTE: delete_section2 is unnecessary, as existing sub-keys with None/null
     #  value are preferred over missing keys
 
+    def insert_sections(self, sections):
+        """Insert / overwrite many entries (sections) at once, with a single
+        load and dump of the JSON object.
+
+        :param sections: Iterable of (identifier, section) pairs.
+        :type sections: iterable
+
+        """
+        database = self.load()
+        database.update(sections)
+        self.dump(database)
+        l.info("Database %s succesfully updated!", self._filepath)
+
+    def get_section(self, identifier):
+        """Returns given entry (section) of JSON object.
+
+        :param str identifier: Key in database (JSON object).
+        :return: Entry, or None if missing.
+        :rtype: dict
+
+        """
+        return self.get_sections([identifier]).get(identifier, None)
+
+    def get_sections(self, identifiers):
+        """Returns given entries (sections) of JSON object. Only the given
+        entries are parsed, from their own part of the file.
+
+        :param identifiers: Keys in database (JSON object).
+        :type identifiers: iterable
+        :return: Existing entries, missing keys are skipped.
+        :rtype: dict
+
+        """
+        sections = {}
+        with open(self._filepath, "rb") as read_file:
+            offsets = self._offsets(read_file)
+            for identifier in identifiers:
+                if identifier in offsets:
+                    start, end = offsets[identifier]
+                    read_file.seek(start)
+                    sections[identifier] = json.loads(
+                            read_file.read(end - start))
+        return sections
+
+    def keys(self):
+        """Returns the keys of the JSON object.
+
+        :rtype: list
+
+        """
+        with open(self._filepath, "rb") as read_file:
+            return list(self._offsets(read_file))
+
     def print_contents(self):
         """Print contents of JSON object."""
 
@@ -166,6 +320,279 @@ class JsonDbHandler:
         return ""
 
 
+class SqliteDbHandler(JsonDbHandler):
+    """SQLite database handler with the interface of *JsonDbHandler*.
+
+    Every entry (section) is stored as JSON text in its own record, keyed by
+    its identifier, so single entry operations do not rewrite the file.
+
+    :param path: Filepath of SQLite database (created if missing).
+    :type path: filepath
+
+    """
+    def __init__(self, path):
+        super().__init__(path)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                               "identifier TEXT PRIMARY KEY, "
+                               "section TEXT NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        """Connection, which commits (or rolls back on error) and closes at
+        the end of a 'with' block."""
+        with closing(sqlite3.connect(self._filepath)) as connection:
+            with connection:
+                yield connection
+
+    def load(self):
+        """Loads every entry of the database.
+
+        :return: Dictionary of entries.
+        :rtype: dict
+
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                    "SELECT identifier, section FROM entries ORDER BY rowid")
+            return {identifier: json.loads(section)
+                    for identifier, section in rows}
+
+    def dump(self, database):
+        """Replaces the contents of the database with a dictionary, in one
+        transaction.
+
+        :param database: Python dictionary to be written to disk.
+        :type database: dict
+
+        """
+        with self._connect() as connection:
+            connection.execute("DELETE FROM entries")
+            connection.executemany(
+                    "INSERT INTO entries VALUES (?, ?)",
+                    ((key, json.dumps(value, ensure_ascii=False))
+                     for key, value in database.items())
+            )
+
+    def update(self, new_database):
+        """Inserts / overwrites the entries of another database (dict).
+
+        :param new_database: New database.
+        :type new_database: dict
+
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                    ((key, json.dumps(value, ensure_ascii=False))
+                     for key, value in new_database.items())
+            )
+
+    def insert_section(self, identifier, section):
+        """Insert / overwrite given entry (section).
+
+        :param str identifier: Key in database.
+        :param section: Dictionary to be inserted under *identifier* key.
+        :type section: dict
+
+        """
+        with self._connect() as connection:
+            connection.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                    (identifier, json.dumps(section, ensure_ascii=False))
+            )
+        l.info("Database %s succesfully updated!", self._filepath)
+
+    def insert_sections(self, sections):
+        """Insert / overwrite many entries (sections) in one transaction. The
+        sections are consumed one by one, so a generator keeps memory usage
+        bounded.
+
+        :param sections: Iterable of (identifier, section) pairs.
+        :type sections: iterable
+
+        """
+        with self._connect() as connection:
+            connection.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                    ((key, json.dumps(value, ensure_ascii=False))
+                     for key, value in sections)
+            )
+        l.info("Database %s succesfully updated!", self._filepath)
+
+    def insert_section2(self, identifier, identifier2, section):
+        """Insert / overwrite given sub-entry (section).
+
+        :param str identifier: Key in database.
+        :param str identifier2: Subkey in database.
+        :param section: Dictionary to be inserted under *identifier* key and
+            *identifier2* subkey.
+        :type section: dict
+
+        """
+        entry = self.get_section(identifier)
+        if entry is not None:
+            entry.update({identifier2: section})
+        else:
+            entry = {identifier2: section}
+        self.insert_section(identifier, entry)
+
+    def delete_section(self, identifier):
+        """Delete given entry (section).
+
+        :param str identifier: Key in database.
+
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                    "DELETE FROM entries WHERE identifier = ?", (identifier,))
+            if cursor.rowcount == 0:
+                raise KeyError(identifier)
+        l.info("Database %s succesfully updated!", self._filepath)
+
+    def get_section(self, identifier):
+        """Returns given entry (section), without loading the database.
+
+        :param str identifier: Key in database.
+        :return: Entry, or None if missing.
+        :rtype: dict
+
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                    "SELECT section FROM entries WHERE identifier = ?",
+                    (identifier,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def get_sections(self, identifiers):
+        """Returns given entries (sections), without loading the database.
+
+        :param identifiers: Keys in database.
+        :type identifiers: iterable
+        :return: Existing entries, missing keys are skipped.
+        :rtype: dict
+
+        """
+        identifiers = list(identifiers)
+        sections = {}
+        with self._connect() as connection:
+            # Chunks stay below the limit of SQL variables
+            for start in range(0, len(identifiers), 500):
+                chunk = identifiers[start:start + 500]
+                rows = connection.execute(
+                        "SELECT identifier, section FROM entries WHERE "
+                        f"identifier IN ({', '.join('?' * len(chunk))})",
+                        chunk)
+                sections.update((identifier, json.loads(section))
+                                for identifier, section in rows)
+        return sections
+
+    def keys(self):
+        """Returns the keys of the database.
+
+        :rtype: list
+
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                    "SELECT identifier FROM entries ORDER BY rowid")
+            return [row[0] for row in rows]
+
+
+class LazyDatabase(Mapping):
+    """Read-only dictionary view of a database, which loads the entries on
+    demand. Only the keys are read at creation, the loaded entries are kept in
+    a least-recently-used cache.
+
+    :param handler: Database handler.
+    :type handler: JsonDbHandler
+    :param int cache_size: Maximum number of entries kept in memory.
+
+    """
+    def __init__(self, handler, cache_size=4096):
+        self._handler = handler
+        self._cache = LruCache(cache_size)
+        self._keys = []
+        self._key_set = set()
+        self.refresh()
+
+    def refresh(self):
+        """Re-reads the keys, and drops the loaded entries (e.g. after the
+        database was modified through the handler)."""
+        self._keys = self._handler.keys()
+        self._key_set = set(self._keys)
+        self._cache.clear()
+        l.debug("Database index loaded: %s entries", len(self._keys))
+
+    def records(self, identifiers):
+        """Returns the given entries, loading the uncached ones in one batch.
+
+        :param identifiers: Keys in database.
+        :type identifiers: iterable
+        :return: Existing entries, missing keys are skipped.
+        :rtype: dict
+
+        """
+        records = {}
+        uncached = []
+        for identifier in identifiers:
+            if identifier in self._cache:
+                records[identifier] = self._cache.get(identifier)
+            elif identifier in self._key_set:
+                uncached.append(identifier)
+
+        if uncached:
+            loaded = self._handler.get_sections(uncached)
+            for identifier, section in loaded.items():
+                self._cache[identifier] = section
+            records.update(loaded)
+        return records
+
+    def update(self, entries):
+        """Registers entries written through the handler.
+
+        :param entries: New / modified entries.
+        :type entries: dict
+
+        """
+        for identifier, section in entries.items():
+            if identifier not in self._key_set:
+                self._keys.append(identifier)
+                self._key_set.add(identifier)
+            self._cache[identifier] = section
+
+    def __getitem__(self, identifier):
+        if identifier not in self._key_set:
+            raise KeyError(identifier)
+        return self.records([identifier])[identifier]
+
+    def __contains__(self, identifier):
+        return identifier in self._key_set
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+
+def open_database(path):
+    """Returns the database handler matching the file extension.
+
+    :param path: Filepath of JSON or SQLite database.
+    :type path: filepath
+    :return: Database handler.
+    :rtype: JsonDbHandler
+
+    """
+    if os.path.splitext(path)[1].lower() in SQLITE_EXTENSIONS:
+        return SqliteDbHandler(path)
+    return JsonDbHandler(path)
+
+
 # Foprogram
 if __name__ == "__main__":
     pass
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Stochastic (Monte Carlo) decay calculation for small inventories, where the
+number of atoms is too low for the deterministic mass bookkeeping.
+
+Every trial is an independent atom count vector, and all trials are advanced
+together: the decays of a step are sampled from binomial distributions with the
+decay probability of the interval, then the decayed atoms are split among the
+decay modes with conditional binomial sampling (which is equivalent to a
+multinomial split). Only statistics over the trials (mean, variance and
+percentiles) are stored, so memory does not grow with the number of trials.
+
+Libs
+----
+* numpy
+
+Contents
+--------
+"""
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+
+
+class MonteCarloResult:
+    """Statistics of a Monte Carlo decay calculation.
+
+    :ivar isotopes: Short IDs, in column order.
+    :ivar times: Time of each recorded step [s].
+    :ivar mean: Mean atom count (time x isotope).
+    :ivar variance: Variance of the atom count (time x isotope).
+    :ivar percentiles: Percentile levels [%].
+    :ivar bands: Atom count at the percentile levels (level x time x isotope).
+
+    """
+    def __init__(self, isotopes, times, mean, variance, percentiles, bands):
+        self.isotopes = isotopes
+        self.times = times
+        self.mean = mean
+        self.variance = variance
+        self.percentiles = percentiles
+        self.bands = bands
+
+    def band(self, percentile):
+        """Returns the atom count history at the given percentile level."""
+        return self.bands[self.percentiles.index(percentile)]
+
+
+def _branch_levels(chain):
+    """Groups the decays by their position within the parent's decay modes.
+
+    :return: List of (parents, conditional probabilities, incidence matrix)
+        per level. The incidence matrix maps the decays to their products.
+    :rtype: list
+
+    """
+    levels = []
+    remaining = np.ones(len(chain))
+    position = np.zeros(len(chain.parents), dtype=np.intp)
+    seen = {}
+    for i, parent in enumerate(chain.parents.tolist()):
+        position[i] = seen.get(parent, 0)
+        seen[parent] = position[i] + 1
+
+    for level in range(int(position.max(initial=-1)) + 1):
+        decays = np.flatnonzero(position == level)
+        parents = chain.parents[decays]
+        probabilities = chain.probabilities[decays]
+        conditional = np.divide(probabilities, remaining[parents],
+                                out=np.zeros_like(probabilities),
+                                where=remaining[parents] > 0)
+        remaining[parents] -= probabilities
+        incidence = np.zeros((len(decays), len(chain)), dtype=np.int64)
+        incidence[np.arange(len(decays)), chain.daughters[decays]] = 1
+        levels.append((parents, np.clip(conditional, 0.0, 1.0), incidence))
+    return levels
+
+
+def run_monte_carlo(chain, initial_atoms, time_interval, step, trials,
+                    seed=None, percentiles=(5, 50, 95), record_every=1):
+    """Advances many independent trials of the starting atom counts.
+
+    :param chain: Compiled decay chain.
+    :type chain: DecayChain
+    :param dict initial_atoms: Starting number of atoms, e.g. {"Ac-225": 5000}.
+    :param float time_interval: Length of a time step [s].
+    :param int step: Number of time steps.
+    :param int trials: Number of independent trials.
+    :param seed: Seed of the random generator, for reproducible results.
+    :param tuple percentiles: Percentile levels of the bands [%].
+    :param int record_every: Statistics are recorded at every n-th step.
+    :return: Statistics over the trials.
+    :rtype: MonteCarloResult
+
+    """
+    rng = np.random.default_rng(seed)
+    decay_probability = 1 - 2 ** (- (time_interval / chain.half_lives))
+    levels = _branch_levels(chain)
+
+    counts = np.empty((trials, len(chain)), dtype=np.int64)
+    counts[:] = np.rint(chain.initial_vector(initial_atoms)).astype(np.int64)
+
+    recorded = np.arange(0, step + 1, record_every)
+    mean = np.empty((len(recorded), len(chain)))
+    variance = np.empty((len(recorded), len(chain)))
+    bands = np.empty((len(percentiles), len(recorded), len(chain)))
+
+    def record(row):
+        mean[row] = counts.mean(axis=0)
+        variance[row] = counts.var(axis=0)
+        bands[:, row] = np.percentile(counts, percentiles, axis=0)
+
+    # Only uncertain events are sampled, certain ones (p == 1) are copied
+    uncertain = (decay_probability > 0) & (decay_probability < 1)
+    certain = np.flatnonzero(decay_probability >= 1)
+
+    l.info("Starting Monte Carlo calculation (%s trials)...", trials)
+    record(0)
+    decayed = np.zeros_like(counts)
+    for i in range(1, step + 1):
+        active = np.flatnonzero(uncertain & counts.any(axis=0))
+        decayed[:, active] = rng.binomial(counts[:, active],
+                                          decay_probability[active])
+        decayed[:, certain] = counts[:, certain]
+        counts -= decayed
+
+        for parents, conditional, incidence in levels:
+            branched = decayed[:, parents]
+            sampled = np.flatnonzero(conditional < 1)
+            branched[:, sampled] = rng.binomial(branched[:, sampled],
+                                                conditional[sampled])
+            decayed[:, parents] -= branched
+            counts += branched @ incidence
+
+        decayed[:] = 0
+        if i % record_every == 0:
+            record(i // record_every)
+
+    return MonteCarloResult(chain.isotopes, recorded * time_interval, mean,
+                            variance, list(percentiles), bands)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Bulk importer of nuclide tables (e.g. exported from ENSDF or NUBASE) into the
+isotope database.
+
+The table is a CSV / text file with a header row, and one row per decay mode.
+Consecutive rows of the same isotope are merged into one entry, so the file is
+read in a single pass, and only one isotope is kept in memory at a time. The
+entries are validated in batch, with the same rules and defaults as the isotope
+creation window, and written to the database in one transaction.
+
+Recognized columns (case-insensitive, only *symbol* and *mass_number* are
+mandatory):
+
+* short_id, name, symbol, mass_number, proton_number, neutron_number, reference
+* half_life - in seconds, empty or "stable" for stable isotopes
+* decay_mode, product, probability (fraction, or percent with "%" sign)
+* q_value - released energy in MeV
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import csv
+from itertools import groupby
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.utils import InputValidatorBaseClass, InputError
+
+DELIMITERS = ",;\t|"
+
+
+class ImportReport:
+    """Summary of a bulk import.
+
+    :ivar int rows: Number of data rows read.
+    :ivar int imported: Number of isotope entries written.
+    :ivar list errors: (line number, short ID, message) of rejected entries.
+
+    """
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.errors = []
+
+    def __str__(self):
+        return (f"{self.rows} rows, {self.imported} isotopes imported, "
+                f"{len(self.errors)} rejected")
+
+
+def _row_value(row, key):
+    """Returns the stripped value of a column, or None if missing/empty."""
+    value = row.get(key, None)
+    if value is None:
+        return None
+    value = value.strip()
+    return value if value else None
+
+
+def _probability(ivc, value):
+    """Converts a branching ratio, given as fraction or percent."""
+    if value is not None and value.endswith("%"):
+        return ivc.fval(value[:-1]) / 100
+    return ivc.fval(value, default=1)
+
+
+def _build_entry(ivc, short_id, rows):
+    """Builds and validates an isotope entry from its rows.
+
+    :param ivc: Input validator.
+    :type ivc: InputValidatorBaseClass
+    :param str short_id: Short ID of the isotope (e.g. "Tc-99m").
+    :param list rows: Rows of the same isotope.
+    :return: Isotope entry, with the keys of *IsotopeEntry*.
+    :rtype: dict
+
+    """
+    first = rows[0]
+    symbol = ivc.sval(_row_value(first, "symbol"))
+    mass_number = ivc.ival(_row_value(first, "mass_number"))
+    if symbol is None or mass_number is None:
+        raise InputError("Symbol and mass number are mandatory parameters!")
+
+    half_life = _row_value(first, "half_life")
+    if half_life is not None and half_life.lower() == "stable":
+        half_life = None
+
+    entry = {"name": ivc.sval(_row_value(first, "name"), default=symbol),
+             "symbol": symbol,
+             "mass_number": mass_number,
+             "short_id": short_id,
+             "proton_number": ivc.ival(_row_value(first, "proton_number")),
+             "neutron_number": ivc.ival(_row_value(first, "neutron_number")),
+             "reference": ivc.sval(_row_value(first, "reference")),
+             "half_life": ivc.fval(half_life),
+             "decays": None
+             }
+    if entry["half_life"] is None:
+        return entry
+    if entry["half_life"] <= 0:
+        raise InputError(f"Invalid half-life ({entry['half_life']})")
+
+    decays = {}
+    for row in rows:
+        decay_type = ivc.sval(_row_value(row, "decay_mode"))
+        if decay_type is None:
+            continue
+        if decay_type in decays:
+            raise InputError(f"Duplicate decay mode ({decay_type})")
+        product = ivc.sval(_row_value(row, "product"))
+        if product is None:
+            raise InputError(f"Missing product of decay mode ({decay_type})")
+        decays[decay_type] = {
+                "product": product,
+                "probability": _probability(ivc,
+                                            _row_value(row, "probability")),
+                "released_energy": ivc.fval(_row_value(row, "q_value"))
+        }
+
+    if not decays:
+        raise InputError("Undefined decay for unstable isotope!")
+    if sum(decay["probability"] for decay in decays.values()) > 1 + 1e-6:
+        raise InputError("Sum of decay probabilities is larger than 1!")
+    entry["decays"] = decays
+    return entry
+
+
+def read_nuclide_table(path, report=None, delimiter=None):
+    """Reads a nuclide table in a single pass, and yields the valid entries.
+
+    :param str path: Filepath of the table.
+    :param report: Optional report, filled during reading.
+    :type report: ImportReport
+    :param str delimiter: Column delimiter (default: detected from the header).
+    :return: Generator of (short ID, entry) pairs. The short ID is read from
+        the *short_id* column (e.g. for isomers), or built from the symbol and
+        mass number. Repeated short IDs are rejected.
+
+    """
+    report = ImportReport() if report is None else report
+    ivc = InputValidatorBaseClass()
+    imported = set()
+
+    with open(path, encoding="utf8", newline="") as read_file:
+        header = read_file.readline()
+        if delimiter is None:
+            delimiter = max(DELIMITERS, key=header.count)
+        fieldnames = [name.strip().lower() for name in
+                      next(csv.reader([header], delimiter=delimiter))]
+        reader = csv.DictReader(read_file, fieldnames=fieldnames,
+                                delimiter=delimiter)
+
+        def isotope_key(row):
+            report.rows += 1
+            row["line"] = reader.line_num + 1  # Header is the first line
+            short_id = _row_value(row, "short_id")
+            if short_id is None:
+                short_id = (f"{_row_value(row, 'symbol')}-"
+                            f"{_row_value(row, 'mass_number')}")
+            return short_id
+
+        for short_id, group in groupby(reader, key=isotope_key):
+            rows = list(group)
+            try:
+                if short_id in imported:
+                    raise InputError("Duplicate isotope (rows are not "
+                                     "consecutive, or short ID is repeated)")
+                entry = _build_entry(ivc, short_id, rows)
+            except InputError as error:
+                report.errors.append((rows[0]["line"], short_id, str(error)))
+                continue
+            imported.add(short_id)
+            report.imported += 1
+            yield short_id, entry
+
+
+def import_nuclide_table(path, handler, delimiter=None):
+    """Imports a nuclide table into the isotope database, in one transaction.
+
+    :param str path: Filepath of the table.
+    :param handler: Handler of the isotope database.
+    :type handler: JsonDbHandler
+    :param str delimiter: Column delimiter (default: detected).
+    :return: Summary of the import.
+    :rtype: ImportReport
+
+    """
+    report = ImportReport()
+    handler.insert_sections(read_nuclide_table(path, report, delimiter))
+    for line, short_id, message in report.errors[:20]:
+        l.warning("Import: line %s (%s) rejected: %s", line, short_id, message)
+    l.info("Nuclide table %s imported: %s", path, report)
+    return report
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Memoized results of decay calculations.
+
+A result is keyed by the content of the chain (which changes with the database
+records), the equilibrium threshold, the starting inventory, the time interval
+and the solver (and the number of steps and the tolerance of the adaptive
+solver). The number of steps is not part of the key of fixed interval
+solvers: a shorter run is served as a slice of the cached one, and a longer run
+continues the cached one from its last row, so only the missing steps are
+calculated. The results are kept in memory within a size budget (least recently
+used ones are evicted), and optionally written to a cache directory. The cache
+can be used from worker threads, the calculations run outside of its lock.
+A calculated result can also be delivered chunk by chunk (e.g. for live
+plotting), while it is streamed by the engine.
+
+Libs
+----
+* numpy
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.decay_engine import ADAPTIVE_TOLERANCE
+from modules.utils import evict_files
+
+# Number of chunks of a streamed (partially delivered) calculation
+PARTIAL_CHUNKS = 100
+
+
+class ResultCache:
+    """Least-recently-used cache of mass histories, with memory budget.
+
+    :param int max_bytes: Memory budget of the cached arrays.
+    :param str directory: Optional cache directory, for results kept between
+        sessions (its size is limited to *max_bytes* as well).
+
+    """
+    def __init__(self, max_bytes=256 * 2 ** 20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()  # key -> (times, masses)
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._results)
+
+    @staticmethod
+    def _key(engine, initial_masses, time_interval, step, solver, tolerance):
+        """Key of a run, the number of steps and the tolerance are only part
+        of it for the adaptive solver."""
+        threshold = (None if engine.reduction is None
+                     else engine.reduction.threshold)
+        return (engine.chain.key, threshold,
+                tuple(sorted(initial_masses.items())), float(time_interval),
+                solver,
+                (step, tolerance) if solver == "adaptive" else None)
+
+    def _path(self, key):
+        """Filepath of a result in the cache directory."""
+        digest = hashlib.sha256(repr(key).encode("utf8")).hexdigest()
+        return os.path.join(self.directory, digest + ".npz")
+
+    def _get(self, key):
+        """Returns a result from memory, or the cache directory."""
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+        if self.directory is None:
+            return None
+
+        try:
+            with np.load(self._path(key), allow_pickle=False) as npz_file:
+                result = npz_file["times"], npz_file["masses"]
+            os.utime(self._path(key))  # Most recently used
+        except (OSError, ValueError, KeyError):
+            return None
+        self._store(key, result)
+        return result
+
+    def _store(self, key, result):
+        """Stores a result in memory, then evicts above the budget."""
+        for array in result:
+            array.setflags(write=False)  # Cached arrays are shared
+        if key in self._results:
+            self.nbytes -= sum(array.nbytes for array in self._results[key])
+        self._results[key] = result
+        self._results.move_to_end(key)
+        self.nbytes += sum(array.nbytes for array in result)
+
+        while self.nbytes > self.max_bytes and len(self._results) > 1:
+            _, evicted = self._results.popitem(last=False)
+            self.nbytes -= sum(array.nbytes for array in evicted)
+
+    def _save(self, key, result):
+        """Writes a result to the cache directory."""
+        path = self._path(key)
+        # Concurrent calculations of the same key write separate files
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as write_file:
+            np.savez(write_file, times=result[0], masses=result[1])
+        os.replace(temp_path, path)
+        evict_files(self.directory, ".npz", max_bytes=self.max_bytes)
+
+    @staticmethod
+    def _stream(engine, initial_masses, time_interval, step, solver, progress,
+                partial):
+        """Runs a calculation with *DecayEngine.stream*, and delivers each
+        chunk as soon as it is calculated."""
+        times = np.empty(step + 1)
+        masses = np.empty((step + 1, len(engine.chain.isotopes)))
+        row = 0
+        for chunk_times, reduced in engine.stream(
+                initial_masses, time_interval, step, solver=solver,
+                chunk_size=max(1, -(-(step + 1) // PARTIAL_CHUNKS))):
+            rows = slice(row, row + len(chunk_times))
+            times[rows], masses[rows] = chunk_times, reduced["first"]
+            row = rows.stop
+            # Chunks are new arrays, they can be passed to other threads
+            partial(chunk_times, reduced["first"])
+            if progress is not None:
+                progress(row / (step + 1))
+        return times, masses
+
+    def run(self, engine, initial_masses, time_interval, step, solver="step",
+            tolerance=ADAPTIVE_TOLERANCE, progress=None, partial=None):
+        """Returns the result of *DecayEngine.run*, from the cache if possible.
+
+        :param engine: Decay engine of the chain.
+        :type engine: DecayEngine
+        :param dict initial_masses: Starting mass of isotopes [kg].
+        :param float time_interval: Length of a time step [s].
+        :param int step: Number of time steps.
+        :param str solver: Solver, see *DecayEngine.run*.
+        :param float tolerance: Tolerance of the adaptive solver, see
+            *DecayEngine.run*.
+        :param progress: Optional progress callback, see *DecayEngine.run*.
+        :type progress: callable
+        :param partial: Optional callback, called with the (times, masses) of
+            each calculated chunk. Only a new (not cached or extended) run of a
+            fixed interval solver is delivered in chunks.
+        :type partial: callable
+        :return: (times, masses) - see *DecayEngine.run*, the arrays are
+            read-only. The final state is kept by the engine, as if it was run.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+
+        """
+        key = self._key(engine, initial_masses, time_interval, step, solver,
+                        tolerance)
+        with self._lock:
+            cached = self._get(key)
+            hit = cached is not None and (solver == "adaptive"
+                                          or len(cached[0]) > step)
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            l.debug("Result served from cache (%s of %s steps)", step,
+                    len(cached[0]) - 1)
+            times, masses = cached
+            if solver != "adaptive":
+                times, masses = times[:step + 1], masses[:step + 1]
+            engine.time = times[-1]
+            engine.state = masses[np.newaxis, -1].copy()
+            return times, masses
+
+        if cached is None and partial is not None and solver != "adaptive":
+            result = self._stream(engine, initial_masses, time_interval, step,
+                                  solver, progress, partial)
+        elif cached is None:
+            result = engine.run(initial_masses, time_interval, step,
+                                solver=solver, tolerance=tolerance,
+                                progress=progress)
+        else:
+            # Only the missing steps are calculated
+            l.debug("Cached result extended (%s -> %s steps)",
+                    len(cached[0]) - 1, step)
+            times, masses = engine.extend(cached[0], cached[1][np.newaxis],
+                                          time_interval,
+                                          step - len(cached[0]) + 1,
+                                          solver=solver, progress=progress)
+            result = times, masses[0]
+
+        with self._lock:
+            self._store(key, result)
+        if self.directory is not None:
+            self._save(key, result)
+        return result
+
+    def clear(self):
+        """Removes every result from memory."""
+        with self._lock:
+            self._results.clear()
+            self.nbytes = 0
+
+
+if __name__ == '__main__':
+    pass
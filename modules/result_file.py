@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Memory-mapped result files, for sharing large mass histories between
+processes (e.g. sweep workers and the GUI) without copying.
+
+A result file has a text header (magic line with the header size, and JSON:
+isotopes, shape of the mass array, metadata), padded to a multiple of the page
+size, followed by the raw little-endian float64 body: the time column, then the
+mass array (time x isotope, or scenario x time x isotope). Both arrays are
+opened with *numpy.memmap*, so slicing reads only the touched pages, and
+multi-GB histories can be inspected without loading them into memory. Instead
+of the masses, a derived output (e.g. activity) can be stored, its name is the
+*quantity* of the metadata, and the isotopes are its column labels.
+
+Libs
+----
+* numpy
+
+Help
+----
+* https://numpy.org/doc/stable/reference/generated/numpy.memmap.html
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import json
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.decay_result import DecayResult
+
+RESULT_EXTENSION = ".rdc"
+MAGIC = b"RDC-RESULT"
+# Magic line of the first format version, with a fixed size header
+MAGIC_1 = b"RDC-RESULT 1\n"
+# Size of the magic line: magic, version and header size (fixed width)
+MAGIC_LINE_SIZE = 26
+# The header is padded to a multiple of the page size, so the body is aligned
+PAGE_SIZE = 4096
+DTYPE = np.dtype("<f8")
+
+
+class ResultFile:
+    """Memory-mapped result file.
+
+    :ivar list isotopes: Short IDs, in column order.
+    :ivar times: Time of each row [s] (memory-mapped).
+    :ivar masses: Mass array [kg] (memory-mapped), (time x isotope) or
+        (scenario x time x isotope).
+    :ivar dict metadata: Parameters of the calculation.
+
+    """
+    def __init__(self, isotopes, times, masses, metadata):
+        self.isotopes = isotopes
+        self.times = times
+        self.masses = masses
+        self.metadata = metadata
+
+    @classmethod
+    def create(cls, path, isotopes, times, scenarios=None, metadata=None):
+        """Creates a result file, and writes its header and time column. The
+        masses are written into the returned memory map.
+
+        :param str path: Filepath.
+        :param list isotopes: Short IDs, in column order.
+        :param times: Time of each row [s].
+        :type times: array_like
+        :param int scenarios: Number of scenarios (default: single result,
+            without scenario axis).
+        :param dict metadata: Parameters of the calculation (JSON serializable).
+        :rtype: ResultFile
+
+        """
+        times = np.asarray(times, dtype=DTYPE)
+        shape = (len(times), len(isotopes))
+        if scenarios is not None:
+            shape = (scenarios,) + shape
+        header = json.dumps({"isotopes": list(isotopes), "shape": shape,
+                             "metadata": metadata or {}}).encode("utf8")
+        header_size = -(-(MAGIC_LINE_SIZE + len(header)) // PAGE_SIZE
+                        ) * PAGE_SIZE
+        magic_line = f"{header_size:>12d}\n".encode("ascii")
+        magic_line = MAGIC + b" 2 " + magic_line
+
+        with open(path, "wb") as write_file:
+            write_file.write(magic_line
+                             + header.ljust(header_size - MAGIC_LINE_SIZE))
+            write_file.write(times.tobytes())
+            # Sets the file size, the masses are written through the map
+            write_file.truncate(header_size + DTYPE.itemsize
+                                * (len(times) + int(np.prod(shape))))
+        return cls.open(path, mode="r+")
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """Opens a result file, without reading its body.
+
+        :param str path: Filepath.
+        :param str mode: "r" (read-only) or "r+" (writable), see
+            *numpy.memmap*.
+        :rtype: ResultFile
+
+        """
+        with open(path, "rb") as read_file:
+            magic_line = read_file.readline(MAGIC_LINE_SIZE)
+            if magic_line == MAGIC_1:
+                header_size = PAGE_SIZE
+            elif (magic_line.startswith(MAGIC + b" 2 ")
+                  and magic_line[13:-1].strip().isdigit()):
+                header_size = int(magic_line[13:-1])
+            else:
+                raise ValueError(f"Not a result file: {path}")
+            header = read_file.read(header_size - len(magic_line))
+        header = json.loads(header.decode("utf8"))
+
+        shape = tuple(header["shape"])
+        times = np.memmap(path, dtype=DTYPE, mode=mode, offset=header_size,
+                          shape=(shape[-2],))
+        masses = np.memmap(path, dtype=DTYPE, mode=mode,
+                           offset=header_size + DTYPE.itemsize * shape[-2],
+                           shape=shape)
+        return cls(header["isotopes"], times, masses, header["metadata"])
+
+    @property
+    def scenarios(self):
+        """Number of scenarios, or None without scenario axis."""
+        return self.masses.shape[0] if self.masses.ndim == 3 else None
+
+    def result(self, scenario=0):
+        """Returns the mass history of a scenario, backed by the memory map.
+
+        :param int scenario: Scenario index (ignored without scenario axis).
+        :rtype: DecayResult
+
+        """
+        masses = self.masses if self.masses.ndim == 2 else self.masses[scenario]
+        return DecayResult(self.isotopes, self.times, masses)
+
+    def flush(self):
+        """Writes the modified pages to the disk."""
+        self.masses.flush()
+
+
+def write_result_file(path, engine, inventories, time_interval, step,
+                      solver="step", decimation=1, reducer="first",
+                      quantity="mass"):
+    """Streams a calculation into a result file, with constant memory usage.
+
+    :param str path: Filepath.
+    :param engine: Decay engine of the chain.
+    :type engine: DecayEngine
+    :param list inventories: Starting mass of isotopes [kg] per scenario. A
+        single inventory is stored without scenario axis.
+    :param float time_interval: Length of a time step [s].
+    :param int step: Number of time steps.
+    :param str solver: Solver, see *DecayEngine.stream*.
+    :param int decimation: Number of steps per stored row.
+    :param str reducer: Reduction of the steps of a stored row.
+    :param str quantity: Stored quantity, "mass" or a derived output (key of
+        *OUTPUTS*), with the columns of *DecayChain.columns*.
+    :return: The written file (writable memory map).
+    :rtype: ResultFile
+
+    """
+    times = np.arange(0, step + 1, decimation) * time_interval
+    metadata = {"inventories": inventories, "time_interval": time_interval,
+                "step": step, "solver": solver, "decimation": decimation,
+                "reducer": reducer, "quantity": quantity}
+    result_file = ResultFile.create(
+            path, engine.chain.columns(quantity), times,
+            scenarios=len(inventories) if len(inventories) > 1 else None,
+            metadata=metadata)
+
+    for scenario, inventory in enumerate(inventories):
+        masses = result_file.result(scenario).masses
+        row = 0
+        for chunk_times, reduced in engine.stream(
+                inventory, time_interval, step, solver=solver,
+                decimation=decimation, reducers=(reducer,),
+                quantity=quantity):
+            masses[row:row + len(chunk_times)] = reduced[reducer]
+            row += len(chunk_times)
+    result_file.flush()
+    l.info("Result file written: %s (%s rows, %s scenarios)", path,
+           len(times), len(inventories))
+    return result_file
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# !/usr/bin/python3
+
+"""Parameter sweep over the half-lives and branching ratios of a decay chain,
+distributed across processes, e.g. for uncertainty calculations.
+
+The compiled chain, the starting masses and the requested times are sent to
+each worker process only once, through the pool initializer. The tasks contain
+only the perturbed half-life and branching ratio arrays of a block of
+scenarios, and the results are yielded as soon as a block is completed.
+
+Optionally, the workers write their blocks directly into a memory-mapped result
+file (see *result_file*), so the mass histories are not sent back through the
+pool, and the yielded arrays are views of the file.
+
+Libs
+----
+* numpy
+
+Help
+----
+* https://docs.python.org/3/library/concurrent.futures.html
+
+Contents
+--------
+"""
+
+# Standard library imports
+# First import should be the logging module if any!
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Third party imports
+import numpy as np
+
+# Local application imports
+from logger import MAIN_LOGGER as l
+from modules.decay_engine import DecayEngine
+from modules.result_file import ResultFile
+
+# State of the worker process, set by the pool initializer
+_WORKER = {}
+
+
+def _init_worker(chain, initial, times, output=None):
+    """Stores the shared data of the sweep in the worker process."""
+    _WORKER["chain"] = chain
+    _WORKER["initial"] = initial[np.newaxis]
+    _WORKER["times"] = times
+    _WORKER["output"] = (None if output is None
+                         else ResultFile.open(output, mode="r+"))
+
+
+def _run_block(block_id, half_lives, probabilities):
+    """Calculates a block of scenarios in the worker process.
+
+    :return: (block_id, pid, masses, elapsed) - masses is a (scenario x time x
+        isotope) array (None, if written to the result file), elapsed is the
+        calculation time of the block [s].
+    :rtype: tuple
+
+    """
+    start = time.perf_counter()
+    chain = _WORKER["chain"]
+    output = _WORKER["output"]
+    if output is None:
+        masses = np.empty((len(half_lives), len(_WORKER["times"]),
+                           len(chain)))
+    else:
+        masses = output.masses[block_id:block_id + len(half_lives)]
+    for i, (half_life, probability) in enumerate(zip(half_lives,
+                                                     probabilities)):
+        # Coefficients of a one-off scenario are not kept in the shared cache
+        engine = DecayEngine(chain.with_parameters(half_life, probability,
+                                                   cached=False))
+        masses[i] = engine.solve_batch(_WORKER["initial"], _WORKER["times"])[0]
+
+    if output is not None:
+        output.flush()
+        masses = None
+    return block_id, os.getpid(), masses, time.perf_counter() - start
+
+
+def perturb(chain, scenarios, half_life_error=0.0, branching_error=0.0,
+            seed=None):
+    """Samples half-lives and branching ratios around the database values.
+
+    Half-lives are sampled from a normal distribution with the given relative
+    standard deviation. Branching ratios are sampled the same way, then the
+    ratios of every parent are normalized back to their original sum.
+
+    :param chain: Compiled decay chain.
+    :type chain: DecayChain
+    :param int scenarios: Number of samples.
+    :param float half_life_error: Relative standard deviation of half-lives.
+    :param float branching_error: Relative standard deviation of branching
+        ratios.
+    :param seed: Seed of the random generator.
+    :return: (half_lives, probabilities) - arrays of (scenario x isotope) and
+        (scenario x decay) shape.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+
+    """
+    rng = np.random.default_rng(seed)
+    # Factors are kept positive, so stable isotopes remain stable (inf)
+    factors = rng.normal(1.0, half_life_error, (scenarios, len(chain)))
+    half_lives = chain.half_lives * np.maximum(factors, 1e-6)
+    probabilities = chain.probabilities * np.maximum(rng.normal(
+            1.0, branching_error, (scenarios, len(chain.probabilities))), 0.0)
+
+    # Keep the sum of branching ratios per parent
+    totals = np.zeros((scenarios, len(chain)))
+    np.add.at(totals, (slice(None), chain.parents), probabilities)
+    original = np.bincount(chain.parents, chain.probabilities, len(chain))
+    scale = np.divide(original, totals, out=np.zeros_like(totals),
+                      where=totals > 0)
+    probabilities *= scale[:, chain.parents]
+    return half_lives, probabilities
+
+
+class SweepStats:
+    """Throughput statistics of a sweep, per worker process."""
+
+    def __init__(self):
+        self.scenarios = {}  # pid -> calculated scenarios
+        self.busy_time = {}  # pid -> calculation time [s]
+        self.start = time.perf_counter()
+
+    def add(self, pid, scenarios, elapsed):
+        """Registers a completed block."""
+        self.scenarios[pid] = self.scenarios.get(pid, 0) + scenarios
+        self.busy_time[pid] = self.busy_time.get(pid, 0.0) + elapsed
+
+    def throughput(self):
+        """Returns the throughput of each worker.
+
+        :return: pid -> scenarios per second of calculation time.
+        :rtype: dict
+
+        """
+        return {pid: self.scenarios[pid] / max(self.busy_time[pid], 1e-12)
+                for pid in self.scenarios}
+
+    def __str__(self):
+        wall_time = time.perf_counter() - self.start
+        total = sum(self.scenarios.values())
+        lines = [f"{total} scenarios in {wall_time:.3f} s "
+                 f"({total / max(wall_time, 1e-12):.1f} /s), "
+                 f"{len(self.scenarios)} workers"]
+        for pid, rate in sorted(self.throughput().items()):
+            lines.append(f"    worker {pid}: {self.scenarios[pid]} scenarios,"
+                         f" {rate:.1f} /s")
+        return "\n".join(lines)
+
+
+def run_sweep(chain, initial_masses, times, half_lives, probabilities,
+              workers=None, block_size=64, stats=None, output=None):
+    """Calculates every perturbed scenario in a process pool, and yields the
+    results as they are completed (not in scenario order).
+
+    :param chain: Compiled decay chain.
+    :type chain: DecayChain
+    :param dict initial_masses: Starting mass of isotopes [kg].
+    :param times: Requested time points [s].
+    :type times: array_like
+    :param half_lives: Half-lives (scenario x isotope) [s], e.g. from *perturb*.
+    :type half_lives: numpy.ndarray
+    :param probabilities: Branching ratios (scenario x decay).
+    :type probabilities: numpy.ndarray
+    :param int workers: Number of processes (default: number of CPUs).
+    :param int block_size: Number of scenarios sent to a worker at once.
+    :param stats: Optional statistics object, filled during the sweep.
+    :type stats: SweepStats
+    :param str output: Optional result file, written by the workers.
+    :return: Generator of (scenario indices, masses) pairs, masses is a
+        (scenario x time x isotope) array [kg] (read-only view of the result
+        file, if given).
+
+    """
+    initial = chain.initial_vector(initial_masses)
+    times = np.asarray(times, dtype=np.float64)
+    stats = SweepStats() if stats is None else stats
+    result_file = None
+    if output is not None:
+        ResultFile.create(output, chain.isotopes, times,
+                          scenarios=len(half_lives),
+                          metadata={"initial_masses": initial_masses})
+        result_file = ResultFile.open(output)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(chain, initial, times,
+                                       output)) as executor:
+        futures = {}
+        for start in range(0, len(half_lives), block_size):
+            stop = min(start + block_size, len(half_lives))
+            future = executor.submit(_run_block, start, half_lives[start:stop],
+                                     probabilities[start:stop])
+            futures[future] = stop
+
+        for future in as_completed(futures):
+            start, pid, masses, elapsed = future.result()
+            stop = futures[future]
+            if result_file is not None:
+                masses = result_file.masses[start:stop]
+            stats.add(pid, stop - start, elapsed)
+            yield np.arange(start, stop), masses
+
+    l.info("Sweep finished: %s", stats)
+
+
+if __name__ == '__main__':
+    pass
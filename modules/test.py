@@ -1,5 +1,39 @@
+import json
+import os
+import tempfile
+import threading
 import unittest
+from unittest import mock
+
+import numpy as np
+
 from utils import InputValidatorBaseClass, InputError
+from modules.decay_engine import (DecayChain, DecayEngine, expm, AVOGADRO,
+                                  MEV, _EIGEN_CACHE)
+from modules.decay_graph import DecayGraph
+from modules.chain_cache import ChainCache, load_chain
+from modules.result_cache import ResultCache
+from modules.decay_result import DecayResult
+from modules.result_file import ResultFile, write_result_file, PAGE_SIZE
+from modules.exporters import export_result
+from modules.monte_carlo import run_monte_carlo
+from modules.sweep import perturb, run_sweep, _init_worker, _run_block
+from modules.nuclide_importer import import_nuclide_table
+from modules.json_handler import (JsonDbHandler, SqliteDbHandler,
+                                  LazyDatabase, open_database, _entry_offsets)
+from cli import main as cli_main
+
+
+# Small branching chain for the decay engine tests
+TEST_DATABASE = {
+    "A-1": {"half_life": 100.0,
+            "decays": {"alpha": {"product": "B-1", "probability": 0.75},
+                       "beta_minus": {"product": "C-1", "probability": 0.25}}
+            },
+    "B-1": {"half_life": 10.0,
+            "decays": {"alpha": {"product": "C-1", "probability": 1.0}}},
+    "C-1": {"half_life": None, "decays": None},
+}
 
 
 class TestInputValidatorBaseClass(unittest.TestCase):
@@ -113,5 +147,946 @@ class TestInputValidatorBaseClass(unittest.TestCase):
         )
 
 
+class TestDbHandler(unittest.TestCase):
+
+    def test_sqlite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "isotopes.db")
+            handler = open_database(path)
+            self.assertIsInstance(handler, SqliteDbHandler)
+            self.assertIsInstance(open_database("isotopes.json"),
+                                  JsonDbHandler)
+
+            handler.dump(TEST_DATABASE)
+            self.assertEqual(handler.load(), TEST_DATABASE)
+            self.assertEqual(handler.keys(), ["A-1", "B-1", "C-1"])
+            self.assertEqual(handler.get_section("B-1"),
+                             TEST_DATABASE["B-1"])
+            self.assertIsNone(handler.get_section("X-1"))
+
+            handler.insert_section("X-1", {"half_life": None})
+            handler.insert_section2("X-1", "name", "Test")
+            self.assertEqual(handler.get_section("X-1"),
+                             {"half_life": None, "name": "Test"})
+            handler.update({"C-1": {"half_life": 1.0}})
+            self.assertEqual(handler.get_section("C-1"), {"half_life": 1.0})
+
+            handler.delete_section("X-1")
+            self.assertNotIn("X-1", handler.keys())
+            with self.assertRaises(KeyError):
+                handler.delete_section("X-1")
+
+    def test_json_parse_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = JsonDbHandler(os.path.join(directory, "isotopes.json"))
+            handler.dump(TEST_DATABASE)
+            with mock.patch("modules.json_handler._entry_offsets",
+                            wraps=_entry_offsets) as scan:
+                # The chain is loaded generation by generation, one scan
+                chain = load_chain(LazyDatabase(handler), ["A-1"])
+                self.assertEqual(len(chain), 3)
+                handler.get_section("B-1")["half_life"] = 0.0
+                self.assertEqual(handler.get_section("B-1"),
+                                 TEST_DATABASE["B-1"])
+                self.assertIsNone(handler.get_section("X-1"))
+                self.assertEqual(scan.call_count, 1)
+                # Only the offsets are kept, not the parsed entries
+                offsets = handler._index[1].values()
+                self.assertEqual({type(offset) for offset in offsets},
+                                 {tuple})
+
+                # Changed file is scanned again
+                handler.insert_section("X-1", {"half_life": None, "é": "ő"})
+                self.assertIn("X-1", handler.keys())
+                self.assertEqual(handler.get_section("X-1"),
+                                 {"half_life": None, "é": "ő"})
+                self.assertEqual(handler.get_section("C-1"),
+                                 TEST_DATABASE["C-1"])
+                self.assertEqual(scan.call_count, 2)
+
+            self.assertEqual(_entry_offsets('{}'), {})
+            self.assertEqual(_entry_offsets('{"ő": [1, {"a": "}"}], "b":2}'),
+                             {"ő": (7, 22), "b": (28, 29)})
+            for text in ("[]", '{"a" 1}', '{"a": 1 "b": 2}', '{"a": 1'):
+                with self.assertRaises(ValueError, msg=text):
+                    _entry_offsets(text)
+
+    def test_import_nuclide_table(self):
+        table = ("Symbol;Mass_number;Half_life;Decay_mode;Product;"
+                 "Probability;Q_value\n"
+                 "A;1;10;alpha;B-1;60%;4.2\n"
+                 "A;1;10;beta_minus;C-1;0.4;\n"
+                 "B;1;;;;;\n"
+                 "D;1;5;alpha;;1;\n"
+                 "C;1;stable;;;;\n")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "table.csv")
+            with open(path, "w", encoding="utf8") as write_file:
+                write_file.write(table)
+            handler = SqliteDbHandler(os.path.join(directory, "isotopes.db"))
+
+            report = import_nuclide_table(path, handler)
+            self.assertEqual((report.rows, report.imported), (5, 3))
+            self.assertEqual(report.errors[0][:2], (5, "D-1"))
+            self.assertEqual(handler.keys(), ["A-1", "B-1", "C-1"])
+            decays = handler.get_section("A-1")["decays"]
+            self.assertAlmostEqual(decays["alpha"]["probability"], 0.6)
+            self.assertEqual(decays["alpha"]["released_energy"], 4.2)
+            self.assertEqual(decays["beta_minus"]["product"], "C-1")
+            self.assertIsNone(handler.get_section("C-1")["half_life"])
+
+            # Isomers are keyed by the short_id column, repeats are rejected
+            with open(path, "w", encoding="utf8") as write_file:
+                write_file.write(
+                        "Short_id,Symbol,Mass_number,Half_life,Decay_mode,"
+                        "Product,Probability\n"
+                        "Tc-99m,Tc,99,21624,gamma,Tc-99,\n"
+                        "Tc-99,Tc,99,6.66e12,beta_minus,Ru-99,\n"
+                        "Tc-99m,Tc,99,21600,gamma,Tc-99,\n"
+                        "E-1,E,1,1,m1,A-1,0.4\nE-1,E,1,1,m2,A-1,0.3\n"
+                        "E-1,E,1,1,m3,A-1,0.2\nE-1,E,1,1,m4,A-1,0.1\n")
+            report = import_nuclide_table(path, handler)
+            self.assertEqual((report.rows, report.imported), (7, 3))
+            self.assertEqual([error[:2] for error in report.errors],
+                             [(4, "Tc-99m")])
+            # Any number of decay modes is imported
+            self.assertEqual(len(handler.get_section("E-1")["decays"]), 4)
+            self.assertEqual(handler.get_section("Tc-99m")["half_life"], 21624)
+            self.assertIn("beta_minus", handler.get_section("Tc-99")["decays"])
+
+    def test_lazy_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            handler = SqliteDbHandler(os.path.join(directory, "isotopes.db"))
+            handler.dump(TEST_DATABASE)
+            handler.insert_section("D-1", {"half_life": None, "decays": None})
+
+            database = LazyDatabase(handler, cache_size=2)
+            self.assertEqual(list(database), ["A-1", "B-1", "C-1", "D-1"])
+            self.assertIn("D-1", database)
+            self.assertEqual(len(database._cache), 0)
+            self.assertEqual(database.records(["B-1", "X-1", "A-1"]),
+                             {"B-1": TEST_DATABASE["B-1"],
+                              "A-1": TEST_DATABASE["A-1"]})
+            self.assertEqual(database["C-1"], TEST_DATABASE["C-1"])
+            self.assertEqual(len(database._cache), 2)
+            with self.assertRaises(KeyError):
+                database["X-1"]
+
+            # Only the records reachable from the roots are compiled
+            graph = DecayGraph(database, roots=["B-1"])
+            self.assertEqual(graph.isotopes, ["B-1", "C-1"])
+            with self.assertRaises(KeyError):
+                DecayGraph(database, roots=["X-1"])
+
+            database.update({"X-1": {"half_life": None, "decays": None}})
+            self.assertEqual(len(database), 5)
+            database.refresh()
+            self.assertEqual(len(database), 4)
+
+
+class TestDecayGraph(unittest.TestCase):
+
+    def test_graph(self):
+        database = dict(TEST_DATABASE)
+        database["D-1"] = {"half_life": 1.0,
+                           "decays": {"alpha": {"product": "X-1",
+                                                "probability": 1.0}}}
+        graph = DecayGraph(database)
+        self.assertEqual(graph.missing, ["X-1"])
+        self.assertEqual(graph.cycles, [])
+        self.assertTrue(np.isinf(graph.half_lives[graph.index["X-1"]]))
+
+        daughters, branching = graph.products(graph.index["A-1"])
+        self.assertEqual([graph.isotopes[i] for i in daughters],
+                         ["B-1", "C-1"])
+        np.testing.assert_allclose(branching, [0.75, 0.25])
+
+        # Every parent precedes its products
+        rank = {graph.isotopes[i]: r for r, i in enumerate(graph.order)}
+        self.assertLess(rank["B-1"], rank["C-1"])
+        self.assertLess(rank["D-1"], rank["X-1"])
+
+    def test_cycle(self):
+        database = {"A-1": {"half_life": 1.0,
+                            "decays": {"alpha": {"product": "B-1",
+                                                 "probability": 1.0}}},
+                    "B-1": {"half_life": 1.0,
+                            "decays": {"alpha": {"product": "A-1",
+                                                 "probability": 0.5},
+                                       "beta_minus": {"product": "C-1",
+                                                      "probability": 0.5}}},
+                    "C-1": {"half_life": None, "decays": None}}
+        graph = DecayGraph(database)
+        self.assertEqual(graph.cycles, ["A-1", "B-1"])
+        self.assertEqual(graph.isotopes[graph.order[-1]], "C-1")
+        self.assertIsNone(DecayChain(graph, ["A-1"]).order)
+
+
+class TestDecayEngine(unittest.TestCase):
+
+    def test_chain(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["B-1", "A-1"])
+        self.assertEqual(chain.isotopes, ["A-1", "B-1", "C-1"])
+        self.assertEqual(chain.decay_constants[chain.index["C-1"]], 0.0)
+        with self.assertRaises(KeyError):
+            DecayChain(DecayGraph(TEST_DATABASE), ["X-1"])
+
+    def test_run(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        times, masses = DecayEngine(chain).run({"A-1": 10}, 5, 100)
+        self.assertEqual(masses.shape, (101, 3))
+        self.assertEqual(times[-1], 500)
+
+        # Reference: per-isotope update of the mass distribution
+        mass = {"A-1": 10.0}
+        for _ in range(100):
+            new_mass = {}
+            for isotope, value in mass.items():
+                record = TEST_DATABASE[isotope]
+                if record["decays"] is None:
+                    new_mass[isotope] = new_mass.get(isotope, 0) + value
+                    continue
+                remaining = value * 2 ** (-5 / record["half_life"])
+                new_mass[isotope] = new_mass.get(isotope, 0) + remaining
+                for decay in record["decays"].values():
+                    new_mass[decay["product"]] = (
+                            new_mass.get(decay["product"], 0)
+                            + (value - remaining) * decay["probability"])
+            mass = new_mass
+
+        for isotope, value in mass.items():
+            self.assertAlmostEqual(masses[-1, chain.index[isotope]], value)
+        self.assertAlmostEqual(masses[-1].sum(), 10)
+
+    def test_bateman(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        engine = DecayEngine(chain)
+        self.assertIsNotNone(chain.eigen())
+        times = np.array([0, 1, 50, 500])
+        masses = engine.solve({"A-1": 10}, times)
+
+        # Two-member Bateman solution for the branch A -> B
+        la, lb = chain.decay_constants[:2]
+        expected = 10 * 0.75 * la / (lb - la) * (
+                np.exp(-la * times) - np.exp(-lb * times))
+        np.testing.assert_allclose(masses[:, 0], 10 * np.exp(-la * times))
+        np.testing.assert_allclose(masses[:, 1], expected, atol=1e-12)
+        np.testing.assert_allclose(masses.sum(axis=1), 10)
+
+        # Same result with the matrix exponential
+        rate = chain.rate_matrix()
+        for time, mass in zip(times, masses):
+            np.testing.assert_allclose(expm(rate * time) @ masses[0], mass,
+                                       atol=1e-12)
+
+    def test_exact(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        engine = DecayEngine(chain)
+        times, masses = engine.run({"A-1": 10}, 50, 10, solver="exact")
+        np.testing.assert_allclose(masses, engine.solve({"A-1": 10}, times),
+                                   atol=1e-12)
+
+        # Propagator is reused by an identical chain
+        other = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        self.assertIs(other.propagator(50), chain.propagator(50))
+        self.assertIsNot(other.propagator(25), chain.propagator(50))
+
+    def test_adaptive(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        engine = DecayEngine(chain)
+        times, masses = engine.run({"A-1": 10}, 10, 100, solver="adaptive",
+                                   tolerance=1e-3)
+        self.assertEqual(times[0], 0)
+        self.assertEqual(times[-1], 1000)
+        self.assertLess(len(times), 200)
+        np.testing.assert_allclose(masses, engine.solve({"A-1": 10}, times),
+                                   atol=1e-12)
+
+        # Linear interpolation of the stored points is within tolerance
+        fine = np.linspace(0, 1000, 5000)
+        exact = engine.solve({"A-1": 10}, fine)
+        for i in range(len(chain)):
+            error = np.abs(np.interp(fine, times, masses[:, i]) - exact[:, i])
+            self.assertLess(error.max(), 2 * 1e-3 * 10)
+
+        # Finer tolerance needs more points
+        self.assertGreater(len(engine.run({"A-1": 10}, 10, 100,
+                                          solver="adaptive",
+                                          tolerance=1e-5)[0]), len(times))
+        with self.assertRaises(ValueError):
+            engine.run({"A-1": 10}, 10, 100, solver="adaptive", tolerance=0)
+
+    def test_equilibrium(self):
+        database = {"P-1": {"half_life": 1000.0,
+                            "decays": {"alpha": {"product": "F-1",
+                                                 "probability": 1.0}}},
+                    "F-1": {"half_life": 0.1,
+                            "decays": {"alpha": {"product": "G-1",
+                                                 "probability": 0.5},
+                                       "beta_minus": {"product": "S-1",
+                                                      "probability": 0.5}}},
+                    "G-1": {"half_life": 0.01,
+                            "decays": {"alpha": {"product": "S-1",
+                                                 "probability": 1.0}}},
+                    "S-1": {"half_life": None, "decays": None}}
+        chain = DecayChain(DecayGraph(database), ["P-1"])
+        engine = DecayEngine(chain, equilibrium=1e3)
+        reduction = engine.reduction
+        self.assertEqual(reduction.reduced.isotopes, ["P-1", "S-1"])
+        np.testing.assert_allclose(reduction.reduced.probabilities, [1.0])
+        self.assertLess(reduction.error_bound, 1e-3)
+
+        times = np.array([10, 100, 1000, 5000])
+        reduced = engine.solve({"P-1": 1, "F-1": 0.1}, times)
+        full = DecayEngine(chain).solve({"P-1": 1, "F-1": 0.1}, times)
+        np.testing.assert_allclose(reduced, full, rtol=2e-3 * 2)
+
+    def test_batch(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1", "B-1"])
+        engine = DecayEngine(chain)
+        initial = np.array([[10, 0, 0], [0, 5, 0], [3, 2, 1]])
+
+        for solver in ("step", "exact", "bateman"):
+            times, masses = engine.run_batch(initial, 20, 30, solver=solver)
+            self.assertEqual(masses.shape, (3, 31, 3))
+            for scenario, inventory in enumerate(initial):
+                _, single = engine.run(dict(zip(chain.isotopes, inventory)),
+                                       20, 30, solver=solver)
+                np.testing.assert_allclose(masses[scenario], single,
+                                           atol=1e-12)
+
+        with self.assertRaises(ValueError):
+            engine.run_batch(np.ones((2, 4)), 20, 30)
+
+    def test_resume(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        engine = DecayEngine(chain)
+        with self.assertRaises(ValueError):
+            engine.resume(20, 10)
+
+        expected = engine.run({"A-1": 1.0}, 20, 30, solver="exact")
+        engine.run({"A-1": 1.0}, 20, 10, solver="exact")
+        times, masses = engine.resume(20, 20, solver="exact")
+        np.testing.assert_allclose(times, expected[0][11:])
+        np.testing.assert_allclose(masses[0], expected[1][11:], rtol=1e-12)
+        self.assertEqual(engine.time, 600)
+        np.testing.assert_allclose(engine.state[0], expected[1][-1],
+                                   rtol=1e-12)
+
+        # Adaptive resume covers the requested interval
+        times, _ = engine.resume(20, 20, solver="adaptive")
+        self.assertAlmostEqual(times[-1], 1000)
+
+    def test_derived(self):
+        database = {
+            "A-1": {"half_life": 100.0,
+                    "decays": {"alpha": {"product": "B-1", "probability": 0.75,
+                                         "released_energy": 5.0},
+                               "beta_minus": {"product": "C-1",
+                                              "probability": 0.25,
+                                              "released_energy": 1.0}}},
+            "B-1": {"half_life": 10.0, "mass_number": "1",
+                    "decays": {"alpha": {"product": "C-1", "probability": 1.0,
+                                         "released_energy": 2.0}}},
+            "C-1": {"half_life": None, "decays": None}}
+        chain = DecayChain(DecayGraph(database), ["A-1"])
+        np.testing.assert_array_equal(chain.mass_numbers, [1, 1, 1])
+        times, masses = DecayEngine(chain).run({"A-1": 1e-3}, 1, 10000,
+                                               solver="exact")
+        outputs = chain.derived(masses)
+        atoms = AVOGADRO  # 1 g of mass number 1
+
+        labels, activity = outputs["activity"]
+        self.assertEqual(labels, ["A-1", "B-1", "C-1", "total"])
+        self.assertAlmostEqual(activity[0, 0] / (np.log(2) / 100 * atoms), 1)
+        np.testing.assert_allclose(activity[:, -1], activity[:, :3].sum(1))
+
+        # Cumulative decays are the integral of the activity
+        labels, decays = outputs["decays"]
+        self.assertEqual(labels, ["alpha", "beta_minus", "total"])
+        integral = np.sum((activity[1:, :2] + activity[:-1, :2]) / 2, axis=0)
+        self.assertAlmostEqual(decays[-1, -1] / integral.sum(), 1, places=4)
+        np.testing.assert_allclose(decays[0], 0, atol=1)
+        np.testing.assert_allclose(decays[-1] / atoms, [1.5, 0.25, 1.75],
+                                   rtol=1e-6)
+
+        _, power = outputs["power"]
+        np.testing.assert_allclose(power[:, 0],
+                                   activity[:, 0] * (0.75 * 5 + 0.25) * MEV)
+        _, energy = outputs["energy"]
+        self.assertAlmostEqual(energy[-1, -1] / (atoms * 5.5 * MEV), 1,
+                               places=5)
+
+        # Derived output of a result, with other column order
+        result = DecayResult(chain.isotopes[::-1], times, masses[:, ::-1])
+        np.testing.assert_allclose(result.derived(chain, "power").masses,
+                                   power)
+
+        # Outputs calculated chunk by chunk during the run
+        engine = DecayEngine(chain)
+        self.assertEqual(chain.columns("decays"), labels)
+        for solver in ("step", "exact", "bateman"):
+            _, step_masses = engine.run({"A-1": 1e-3}, 1, 300, solver=solver)
+            initial = np.array([[1e-3, 0, 0], [0, 2e-3, 0]])
+            _, values = engine.run_batch(initial, 1, 300, solver=solver,
+                                         quantity="energy")
+            np.testing.assert_allclose(
+                    values[0], chain.derived(step_masses)["energy"][1],
+                    rtol=1e-9, atol=1e-9 * values.max())
+            np.testing.assert_allclose(engine.state[0], step_masses[-1])
+
+            chunks = list(engine.stream({"A-1": 1e-3}, 1, 300, solver=solver,
+                                        chunk_size=64, quantity="energy"))
+            np.testing.assert_allclose(
+                    np.concatenate([chunk[1]["first"] for chunk in chunks]),
+                    values[0], rtol=1e-9, atol=1e-9 * values.max())
+        with self.assertRaises(ValueError):
+            engine.run_batch(initial, 1, 300, quantity="volume")
+
+    def test_progress(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        engine = DecayEngine(chain)
+        for solver in ("step", "exact", "adaptive", "bateman"):
+            reports = []
+            engine.run({"A-1": 1.0}, 20, 300, solver=solver,
+                       progress=reports.append)
+            self.assertTrue(reports, solver)
+            self.assertEqual(reports, sorted(reports))
+            self.assertAlmostEqual(reports[-1], 1.0)
+
+        # Exception of the callback aborts the calculation
+        def cancel(fraction):
+            raise InterruptedError()
+        with self.assertRaises(InterruptedError):
+            engine.run({"A-1": 1.0}, 20, 300, progress=cancel)
+
+    def test_stream(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        engine = DecayEngine(chain)
+        times, masses = engine.run({"A-1": 1.0}, 2, 100)
+
+        chunks = list(engine.stream({"A-1": 1.0}, 2, 100, chunk_size=16))
+        self.assertEqual(len(chunks), 7)
+        np.testing.assert_array_equal(
+                np.concatenate([chunk[0] for chunk in chunks]), times)
+        np.testing.assert_allclose(
+                np.concatenate([chunk[1]["first"] for chunk in chunks]),
+                masses, rtol=1e-12)
+        np.testing.assert_allclose(engine.state[0], masses[-1], rtol=1e-12)
+
+        # Reduced bins, the last one is shorter
+        chunks = list(engine.stream({"A-1": 1.0}, 2, 100, decimation=10,
+                                    reducers=("mean", "min", "max"),
+                                    chunk_size=25))
+        bin_times = np.concatenate([chunk[0] for chunk in chunks])
+        np.testing.assert_array_equal(bin_times, times[::10])
+        for reducer, function in (("mean", np.mean), ("min", np.min),
+                                  ("max", np.max)):
+            reduced = np.concatenate([chunk[1][reducer] for chunk in chunks])
+            np.testing.assert_allclose(reduced[3],
+                                       function(masses[30:40], axis=0))
+            np.testing.assert_allclose(reduced[-1], masses[100])
+
+        with self.assertRaises(ValueError):
+            next(engine.stream({"A-1": 1.0}, 2, 100, solver="adaptive"))
+
+    def test_bateman_degenerate(self):
+        database = {"A-1": {"half_life": 10.0,
+                            "decays": {"alpha": {"product": "B-1",
+                                                 "probability": 1.0}}},
+                    "B-1": {"half_life": 10.0,
+                            "decays": {"alpha": {"product": "C-1",
+                                                 "probability": 1.0}}}}
+        chain = DecayChain(DecayGraph(database), ["A-1"])
+        self.assertIsNone(chain.eigen())
+        times = np.array([0, 5, 10, 40])
+        masses = DecayEngine(chain).solve({"A-1": 1}, times)
+        lam = chain.decay_constants[0]
+        np.testing.assert_allclose(masses[:, 1],
+                                   lam * times * np.exp(-lam * times),
+                                   atol=1e-12)
+
+        # Nearly equal decay constants, the closed form is evaluated without
+        # cancellation (expm1) as reference
+        times = np.array([1.0, 10.0, 50.0, 200.0])
+        for gap, diagonalizable in ((1e-2, True), (1e-5, False)):
+            database["B-1"]["half_life"] = 10.0 * (1 + gap)
+            chain = DecayChain(DecayGraph(database), ["A-1"])
+            self.assertEqual(chain.eigen() is not None, diagonalizable)
+            masses = DecayEngine(chain).solve({"A-1": 1}, times)
+            lam_a, lam_b = chain.decay_constants[:2]
+            gap = lam_b - lam_a
+            expected = (lam_a * np.exp(-lam_a * times)
+                        * -np.expm1(-gap * times) / gap)
+            np.testing.assert_allclose(masses[:, 1], expected, rtol=1e-9)
+            np.testing.assert_allclose(masses.sum(axis=1), 1, rtol=1e-9)
+
+
+class TestDecayResult(unittest.TestCase):
+
+    def test_result(self):
+        times = np.arange(5) * 43200.0
+        masses = np.arange(10.0).reshape(5, 2)
+        result = DecayResult(["A-1", "B-1"], times, masses)
+        self.assertEqual(len(result), 5)
+        self.assertTrue(np.shares_memory(result["B-1"], masses))
+        np.testing.assert_array_equal(result["B-1"], [1, 3, 5, 7, 9])
+        np.testing.assert_array_equal(result.times_in("d"),
+                                      [0, 0.5, 1, 1.5, 2])
+
+        window = result.window(43200, 86400)
+        np.testing.assert_array_equal(window.times, [43200, 86400])
+        self.assertTrue(np.shares_memory(window.masses, masses))
+        with self.assertRaises(ValueError):
+            DecayResult(["A-1"], times, masses)
+
+        # Appended rows grow the buffer by doubling
+        result = DecayResult.empty(["A-1", "B-1"], 2)
+        for i in range(5):
+            result.append(times[i:i + 1], masses[i:i + 1])
+        self.assertEqual(len(result._times), 8)
+        np.testing.assert_array_equal(result.masses, masses)
+
+    def test_downsample(self):
+        # Short-lived spike of a single row is kept
+        times = np.arange(100000.0)
+        masses = np.zeros((100000, 2))
+        masses[:, 0] = np.exp(-times / 20000)
+        masses[54321, 1] = 1.0
+        result = DecayResult(["A-1", "B-1"], times, masses)
+        self.assertEqual(len(result.downsample(30000)), 100000)
+        downsampled = result.downsample(100)
+        self.assertLessEqual(len(downsampled), 400)
+        self.assertEqual(downsampled["B-1"].max(), 1.0)
+        self.assertEqual(downsampled.times[0], 0)
+        self.assertEqual(downsampled.times[-1], 99999)
+        self.assertEqual(downsampled["A-1"][-1], masses[-1, 0])
+
+        # Zoomed window is downsampled from the full resolution rows
+        window = result.downsample(100, 54000, 55000)
+        self.assertLessEqual(len(window), 400)
+        self.assertLess(window.times[0], 54000)
+        self.assertGreater(window.times[-1], 55000)
+        self.assertEqual(window["B-1"].max(), 1.0)
+        np.testing.assert_array_equal(result.downsample(1000, 10, 20).times,
+                                      np.arange(9.0, 22.0))
+
+    def test_result_file(self):
+        engine = DecayEngine(DecayChain(DecayGraph(TEST_DATABASE), ["A-1"]))
+        times, masses = engine.run({"A-1": 1.0}, 2, 100)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "result.rdc")
+            write_result_file(path, engine, [{"A-1": 1.0}], 2, 100,
+                              decimation=10)
+            result_file = ResultFile.open(path)
+            self.assertIsNone(result_file.scenarios)
+            self.assertEqual(result_file.metadata["step"], 100)
+            result = result_file.result()
+            np.testing.assert_array_equal(result.times, times[::10])
+            np.testing.assert_allclose(result["B-1"], masses[::10, 1],
+                                       rtol=1e-12)
+            with self.assertRaises(ValueError):
+                result.masses[0, 0] = 1.0  # Read-only
+
+            write_result_file(path, engine, [{"A-1": 1.0}, {"B-1": 2.0}], 2,
+                              100)
+            result_file = ResultFile.open(path)
+            self.assertEqual(result_file.masses.shape, (2, 101, 3))
+            np.testing.assert_allclose(result_file.result(0).masses, masses,
+                                       rtol=1e-12)
+
+            # Header larger than a page, the body stays page-aligned
+            inventories = [{"A-1": float(i)} for i in range(300)]
+            write_result_file(path, engine, inventories, 2, 10)
+            result_file = ResultFile.open(path)
+            self.assertEqual(result_file.metadata["inventories"], inventories)
+            self.assertEqual(result_file.times.offset % PAGE_SIZE, 0)
+            np.testing.assert_allclose(result_file.result(299).masses,
+                                       299 * masses[:11], rtol=1e-12)
+
+            # Derived output instead of the masses
+            write_result_file(path, engine, [{"A-1": 1.0}], 2, 100,
+                              quantity="activity")
+            result_file = ResultFile.open(path)
+            self.assertEqual(result_file.metadata["quantity"], "activity")
+            self.assertEqual(result_file.isotopes,
+                             engine.chain.columns("activity"))
+            np.testing.assert_allclose(
+                    result_file.masses,
+                    engine.chain.derived(masses)["activity"][1], rtol=1e-9)
+            del result, result_file  # Release the maps (Windows)
+
+    def test_export(self):
+        times = np.arange(5) * 43200.0
+        masses = np.arange(10.0).reshape(5, 2)
+        result = DecayResult(["A-1", "B-1"], times, masses)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "result.csv.gz")
+            export_result(path, result, time_unit="d", decimation=2)
+            exported = np.loadtxt(path, delimiter=",", skiprows=1)
+            np.testing.assert_array_equal(exported,
+                                          [[0, 0, 1], [1, 4, 5], [2, 8, 9]])
+
+            path = os.path.join(directory, "result.npz")
+            export_result(path, result, compress=True)
+            with np.load(path) as exported:
+                np.testing.assert_array_equal(exported["masses"], masses)
+                self.assertEqual(exported["isotopes"].tolist(),
+                                 ["A-1", "B-1"])
+
+            path = os.path.join(directory, "result.rdc")
+            export_result(path, result, decimation=2, quantity="activity")
+            result_file = ResultFile.open(path)
+            self.assertEqual(result_file.metadata,
+                             {"decimation": 2, "quantity": "activity"})
+            np.testing.assert_array_equal(result_file.result().masses,
+                                          masses[::2])
+            del result_file  # Release the map (Windows)
+
+            with self.assertRaises(ValueError):
+                export_result(os.path.join(directory, "result.xls"), result)
+
+
+class TestChainCache(unittest.TestCase):
+
+    def test_cache(self):
+        database = {key: dict(value) for key, value in TEST_DATABASE.items()}
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ChainCache(directory, max_entries=1)
+            chain = load_chain(database, ["A-1"], cache)
+            cached = cache.get(database, ["A-1"])
+            self.assertEqual(cached.isotopes, chain.isotopes)
+            self.assertEqual(cached.key, chain.key)
+            self.assertIsNotNone(cached.eigen())
+
+            # Changed record invalidates the cached chain
+            database["C-1"]["half_life"] = 1e6
+            self.assertIsNone(cache.get(database, ["A-1"]))
+            chain = load_chain(database, ["A-1"], cache)
+            self.assertEqual(cache.get(database, ["A-1"]).key, chain.key)
+
+            # Least recently used chain is evicted
+            load_chain(database, ["B-1"], cache)
+            self.assertIsNone(cache.get(database, ["A-1"]))
+            self.assertIsNotNone(cache.get(database, ["B-1"]))
+
+    def test_threads(self):
+        # Concurrent calculations save and evict the same chains
+        database = {key: dict(value) for key, value in TEST_DATABASE.items()}
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ChainCache(directory, max_entries=1)
+            errors = []
+
+            def load(index):
+                start = ("A-1", "B-1")[index % 2]
+                try:
+                    for _ in range(20):
+                        chain = load_chain(database, [start], cache)
+                        self.assertEqual(len(chain), 3 - index % 2)
+                except Exception as error:  # pylint: disable = broad-except
+                    errors.append(error)
+
+            threads = [threading.Thread(target=load, args=(i,))
+                       for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertEqual([name for name in os.listdir(directory)
+                              if name.endswith(".tmp")], [])
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_prefix_reuse(self):
+        engine = DecayEngine(DecayChain(DecayGraph(TEST_DATABASE), ["A-1"]))
+        cache = ResultCache()
+        times, masses = cache.run(engine, {"A-1": 1.0}, 2.0, 100)
+        self.assertEqual(cache.misses, 1)
+
+        # Shorter run is a slice, longer one continues the cached run
+        short = cache.run(engine, {"A-1": 1.0}, 2.0, 50)
+        np.testing.assert_array_equal(short[1], masses[:51])
+        self.assertEqual(cache.hits, 1)
+        times, masses = cache.run(engine, {"A-1": 1.0}, 2.0, 150)
+        expected = engine.run({"A-1": 1.0}, 2.0, 150)
+        np.testing.assert_allclose(times, expected[0])
+        np.testing.assert_array_equal(masses, expected[1])
+        self.assertEqual(cache.misses, 2)
+        self.assertFalse(masses.flags.writeable)
+
+        # Continued run of the equilibrium short-circuit
+        engine = DecayEngine(engine.chain, equilibrium=5)
+        cache.run(engine, {"A-1": 1.0}, 2.0, 10, solver="exact")
+        masses = cache.run(engine, {"A-1": 1.0}, 2.0, 20, solver="exact")[1]
+        np.testing.assert_allclose(
+                masses, engine.run({"A-1": 1.0}, 2.0, 20, solver="exact")[1],
+                rtol=1e-12, atol=1e-15)
+
+        # Tolerance is part of the key of the adaptive solver
+        coarse = cache.run(engine, {"A-1": 1.0}, 2.0, 10, solver="adaptive")
+        fine = cache.run(engine, {"A-1": 1.0}, 2.0, 10, solver="adaptive",
+                         tolerance=1e-5)
+        self.assertGreater(len(fine[0]), len(coarse[0]))
+
+    def test_threads(self):
+        # Concurrent (e.g. a running and a superseded) calculations share the
+        # result cache and the propagator cache
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        expected = DecayEngine(chain).run({"A-1": 1.0}, 2.0, 200,
+                                          solver="exact")[1]
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_bytes=20000, directory=directory)
+            results, errors = [], []
+
+            def calculate(index):
+                try:
+                    for step in range(50, 201, 50):
+                        engine = DecayEngine(chain)
+                        interval = 2.0 + index % 2 * step  # Other keys too
+                        cache.run(engine, {"A-1": 1.0}, interval, step,
+                                  solver="exact")
+                    results.append(cache.run(DecayEngine(chain), {"A-1": 1.0},
+                                             2.0, 200, solver="exact")[1])
+                except Exception as error:  # pylint: disable = broad-except
+                    errors.append(error)
+
+            threads = [threading.Thread(target=calculate, args=(i,))
+                       for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            for masses in results:
+                np.testing.assert_allclose(masses, expected, rtol=1e-12)
+            self.assertEqual(cache.hits + cache.misses, 40)
+
+    def test_budget(self):
+        engine = DecayEngine(DecayChain(DecayGraph(TEST_DATABASE), ["A-1"]))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_bytes=5000, directory=directory)
+            cache.run(engine, {"A-1": 1.0}, 1.0, 100)
+            cache.run(engine, {"A-1": 2.0}, 1.0, 100)
+            self.assertEqual(len(cache), 1)
+            self.assertLessEqual(cache.nbytes, 5000)
+
+            # Evicted result is reloaded from the cache directory
+            cache.run(engine, {"B-1": 1.0}, 1.0, 1)
+            cache.run(engine, {"A-1": 2.0}, 1.0, 100)
+            self.assertEqual(cache.hits, 1)
+
+    def test_partial(self):
+        engine = DecayEngine(DecayChain(DecayGraph(TEST_DATABASE), ["A-1"]))
+        expected = engine.run({"A-1": 1.0}, 2.0, 300, solver="exact")
+        cache = ResultCache()
+        chunks = []
+        times, masses = cache.run(
+                engine, {"A-1": 1.0}, 2.0, 300, solver="exact",
+                partial=lambda *chunk: chunks.append(chunk))
+        self.assertGreater(len(chunks), 1)
+        np.testing.assert_array_equal(
+                np.concatenate([chunk[0] for chunk in chunks]), times)
+        np.testing.assert_array_equal(
+                np.concatenate([chunk[1] for chunk in chunks]), masses)
+        np.testing.assert_allclose(masses, expected[1], rtol=1e-12)
+        self.assertEqual(engine.time, 600)
+
+        # Cached result is not delivered in chunks
+        chunks.clear()
+        cache.run(engine, {"A-1": 1.0}, 2.0, 300, solver="exact",
+                  partial=lambda *chunk: chunks.append(chunk))
+        self.assertEqual(chunks, [])
+
+
+class TestMonteCarlo(unittest.TestCase):
+
+    def test_monte_carlo(self):
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        result = run_monte_carlo(chain, {"A-1": 1000}, 5, 40, 4000, seed=1,
+                                 record_every=10)
+        self.assertEqual(result.mean.shape, (5, 3))
+        np.testing.assert_array_equal(result.times, [0, 50, 100, 150, 200])
+
+        # Atoms are conserved in every trial, the mean follows the
+        # deterministic time stepping
+        self.assertTrue(np.all(result.variance.sum(axis=1) >= 0))
+        np.testing.assert_allclose(result.mean.sum(axis=1), 1000)
+        _, masses = DecayEngine(chain).run({"A-1": 1000}, 5, 40)
+        np.testing.assert_allclose(result.mean, masses[::10], rtol=0.02,
+                                   atol=2)
+        self.assertTrue(np.all(result.band(5) <= result.band(95)))
+
+        # Reproducible with the same seed
+        again = run_monte_carlo(chain, {"A-1": 1000}, 5, 40, 4000, seed=1,
+                                record_every=10)
+        np.testing.assert_array_equal(result.bands, again.bands)
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        self.times = np.linspace(0, 300, 7)
+        self.half_lives, self.probabilities = perturb(self.chain, 10, 0.1,
+                                                      0.2, seed=2)
+        self.expected = np.array([
+            DecayEngine(self.chain.with_parameters(
+                    half_life, probability, cached=False)).solve({"A-1": 1.0},
+                                                                 self.times)
+            for half_life, probability in zip(self.half_lives,
+                                              self.probabilities)])
+
+    def test_perturb(self):
+        half_lives, probabilities = perturb(self.chain, 200, 0.1, 0.2, seed=1)
+        self.assertEqual(half_lives.shape, (200, 3))
+        self.assertEqual(probabilities.shape, (200, 3))
+        self.assertTrue(np.all(np.isinf(half_lives[:, 2])))  # Stable
+        self.assertGreater(probabilities[:, 0].std(), 0.01)
+
+        # Branching ratios of every parent still sum to 1
+        totals = np.zeros((200, len(self.chain)))
+        np.add.at(totals, (slice(None), self.chain.parents), probabilities)
+        np.testing.assert_allclose(totals[:, :2], 1, rtol=1e-12)
+
+    def test_run_sweep(self):
+        masses = np.zeros_like(self.expected)
+        for indices, block in run_sweep(self.chain, {"A-1": 1.0}, self.times,
+                                        self.half_lives, self.probabilities,
+                                        workers=2, block_size=4):
+            masses[indices] = block
+        np.testing.assert_allclose(masses, self.expected, rtol=1e-10)
+
+        # Blocks written by the workers into a result file
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sweep.rdc")
+            masses = np.zeros_like(self.expected)
+            for indices, block in run_sweep(
+                    self.chain, {"A-1": 1.0}, self.times, self.half_lives,
+                    self.probabilities, workers=2, block_size=4, output=path):
+                masses[indices] = block
+            np.testing.assert_allclose(masses, self.expected, rtol=1e-10)
+            result_file = ResultFile.open(path)
+            np.testing.assert_allclose(result_file.masses, self.expected,
+                                       rtol=1e-10)
+            del block, result_file  # Release the maps (Windows)
+
+    def test_one_off_chains(self):
+        _init_worker(self.chain, self.chain.initial_vector({"A-1": 1.0}),
+                     self.times)
+        _, _, masses, _ = _run_block(0, self.half_lives, self.probabilities)
+        np.testing.assert_allclose(masses, self.expected, rtol=1e-10)
+
+        # Perturbed chains do not evict the shared Bateman coefficients
+        for half_life, probability in zip(self.half_lives,
+                                          self.probabilities):
+            key = self.chain.with_parameters(half_life, probability).key
+            self.assertNotIn(key, _EIGEN_CACHE)
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = self.path("isotopes.json")
+        JsonDbHandler(self.database).dump(TEST_DATABASE)
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        self.times, self.masses = DecayEngine(chain).run({"A-1": 2.0}, 20,
+                                                         30)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def run_cli(self, *args):
+        return cli_main(["--database", self.database, "--no-cache",
+                         "--interval", "20", "--steps", "30"] + list(args))
+
+    def test_csv(self):
+        self.assertEqual(self.run_cli("-i", "A-1=2", "-o",
+                                      self.path("out.csv")), 0)
+        with open(self.path("out.csv"), encoding="utf8") as read_file:
+            self.assertEqual(read_file.readline().strip(), "time,A-1,B-1,C-1")
+        written = np.loadtxt(self.path("out.csv"), delimiter=",", skiprows=1)
+        np.testing.assert_allclose(written[:, 0], self.times)
+        np.testing.assert_allclose(written[:, 1:], self.masses, rtol=1e-9)
+
+        # Streamed, decimated output
+        self.assertEqual(self.run_cli("-i", "A-1=2", "--stream", "--decimate",
+                                      "10", "-o", self.path("out.csv")), 0)
+        written = np.loadtxt(self.path("out.csv"), delimiter=",", skiprows=1)
+        np.testing.assert_allclose(written[:, 1:], self.masses[::10],
+                                   rtol=1e-9)
+
+    def test_npz(self):
+        self.assertEqual(self.run_cli("-i", "A-1=2", "--solver", "exact",
+                                      "-o", self.path("out.npz")), 0)
+        chain = DecayChain(DecayGraph(TEST_DATABASE), ["A-1"])
+        masses = DecayEngine(chain).solve({"A-1": 2.0}, self.times)
+        with np.load(self.path("out.npz")) as written:
+            self.assertEqual(written["isotopes"].tolist(),
+                             ["A-1", "B-1", "C-1"])
+            np.testing.assert_allclose(written["masses"][0], masses,
+                                       rtol=1e-9, atol=1e-12)
+
+    def test_adaptive(self):
+        lengths = []
+        for tolerance in ("1e-3", "1e-5"):
+            self.assertEqual(self.run_cli("-i", "A-1=2", "--solver",
+                                          "adaptive", "--tolerance", tolerance,
+                                          "-o", self.path("out.npz")), 0)
+            with np.load(self.path("out.npz")) as written:
+                self.assertEqual(written["times"][-1], 20 * 30)
+                lengths.append(len(written["times"]))
+        self.assertGreater(lengths[1], lengths[0])
+
+    def test_batch(self):
+        with open(self.path("inventories.json"), "w",
+                  encoding="utf8") as write_file:
+            json.dump([{"A-1": 2.0}, {"A-1": 1.0}], write_file)
+        for name in ("out.csv", "out.rdc"):
+            self.assertEqual(self.run_cli("--input",
+                                          self.path("inventories.json"),
+                                          "-o", self.path(name)), 0)
+        written = np.loadtxt(self.path("out.csv"), delimiter=",", skiprows=1)
+        self.assertEqual(written.shape, (2 * 31, 5))
+        np.testing.assert_allclose(written[31:, 2:], self.masses / 2,
+                                   rtol=1e-9)
+        result_file = ResultFile.open(self.path("out.rdc"))
+        np.testing.assert_allclose(result_file.result(1).masses,
+                                   self.masses / 2, rtol=1e-9)
+        self.assertEqual(result_file.metadata["quantity"], "mass")
+        del result_file  # Release the map (Windows)
+
+        # Derived output keeps its quantity
+        self.assertEqual(self.run_cli("-i", "A-1=2", "--quantity", "activity",
+                                      "-o", self.path("activity.rdc")), 0)
+        result_file = ResultFile.open(self.path("activity.rdc"))
+        self.assertEqual(result_file.metadata["quantity"], "activity")
+        del result_file
+
+    def test_errors(self):
+        for args in (["-o", self.path("out.csv")],  # No inventory
+                     ["-i", "A-1", "-o", self.path("out.csv")],
+                     ["-i", "A-1=2", "--stream", "-o", self.path("out.npz")],
+                     ["-i", "A-1=2", "--decimate", "10", "-o",
+                      self.path("out.csv")],
+                     ["-i", "A-1=2", "--reducer", "max", "-o",
+                      self.path("out.csv")],
+                     ["-i", "A-1=2", "--tolerance", "1e-5", "-o",
+                      self.path("out.csv")],
+                     ["-i", "A-1=2", "--solver", "adaptive", "--tolerance",
+                      "0", "-o", self.path("out.csv")]):
+            with self.assertRaises(SystemExit, msg=args):
+                self.run_cli(*args)
+        self.assertEqual(self.run_cli("-i", "X-1=2", "-o",
+                                      self.path("out.csv")), 1)
+        self.assertEqual(self.run_cli("-i", "A-1=2", "-o",
+                                      self.path("missing/out.csv")), 1)
+
+
 if __name__ == '__main__':
     unittest.main()
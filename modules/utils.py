@@ -16,11 +16,14 @@ Help
 Contents
 --------
 """
+import os
 import secrets
 import string
 import time
 import uuid
 import hashlib
+import threading
+from collections import OrderedDict
 
 
 class InputError(Exception):
@@ -139,6 +142,78 @@ class InputValidatorBaseClass:
     #     return int(value)
 
 
+class LruCache:
+    """Dictionary-like cache with least-recently-used eviction. It can be
+    shared between threads (e.g. a running and a superseded calculation).
+
+    :param int max_size: Maximum number of stored entries.
+
+    """
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value, and marks it as recently used."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._data.clear()
+
+
+def evict_files(directory, suffix, max_entries=None, max_bytes=None):
+    """Removes the least recently used (modified) files of a cache directory,
+    above a number and total size limit.
+
+    :param str directory: Cache directory.
+    :param str suffix: Only files with this ending are considered.
+    :param int max_entries: Maximum number of files (default: no limit).
+    :param int max_bytes: Maximum total size of files (default: no limit).
+
+    """
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # Removed by another thread or process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    entries.sort(reverse=True)
+
+    total = 0
+    for count, (_, size, path) in enumerate(entries):
+        total += size
+        if ((max_entries is not None and count >= max_entries)
+                or (max_bytes is not None and total > max_bytes)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
 def get_actual_time():
     """Formats the actual time.
 